@@ -1,59 +1,116 @@
+import atexit
+import hashlib
+import os
+import time
 import streamlit as st
-import tempfile
-import joblib
-from model_utils import predict_image
-from ascvd import calculate_ascvd_risk  # Ensure ascvd.py is in your project
+import instrumentation
+import model_registry
+from embedding_cache import EmbeddingCache
+from workers import EmbeddingWorkerPool
+from model_utils import HEAD_LABELS, predict_all, image_risk_points
+from quality_gate import ImageRejected, build_gate
+from ascvd import calculate_ascvd_risk, combine_with_image_points, risk_category  # Ensure ascvd.py is in your project
 
 st.set_page_config(page_title="CVD Risk Estimator", layout="centered")
 st.title("🫀 CVD Risk Estimator from Facial Photo and Patient Data")
 
+
+@st.cache_resource(show_spinner="Loading models...")
+def load_models():
+    # Loaded once per server process and shared across reruns and sessions.
+    return model_registry.warm_up()
+
+
+@st.cache_resource
+def load_embedder():
+    # Optional worker pool (CVD_EMBEDDING_WORKERS) shared by every session of this server.
+    workers = int(os.environ.get("CVD_EMBEDDING_WORKERS", "0"))
+    if workers <= 0:
+        return model_registry.get_embedder()
+    pool = EmbeddingWorkerPool(workers)
+    atexit.register(pool.close)
+    return pool
+
+
+@st.cache_resource
+def load_embedding_cache():
+    # Optional persistent embedding cache (CVD_EMBEDDING_CACHE_DIR) shared by every session.
+    cache_dir = os.environ.get("CVD_EMBEDDING_CACHE_DIR")
+    if not cache_dir:
+        return None
+    cache = EmbeddingCache(cache_dir, model_name=model_registry.embedding_model_id(), settings="original")
+    atexit.register(cache.flush)
+    return cache
+
+
+@st.cache_resource
+def load_quality_gate():
+    # Optional quality gate (CVD_QUALITY_GATE=1), as in the HTTP service.
+    if os.environ.get("CVD_QUALITY_GATE", "0") != "1":
+        return None
+    workers = int(os.environ.get("CVD_EMBEDDING_WORKERS", "0"))
+    return build_gate(model_registry.get_face_preprocessor(), shares_embedder=workers <= 0)
+
+
+@st.cache_data(show_spinner=False, max_entries=512)
+def predict_uploaded_image(content_hash, _image_bytes):
+    # Memoized per image content (SHA-256 of the upload) across reruns and sessions,
+    # so editing patient fields never re-runs image inference.
+    predictions, timings = predict_all(_image_bytes, models, embedder=embedder, cache=embedding_cache,
+                                       gate=quality_gate)
+    return {
+        "predictions": {head: (str(pred) if pred is not None else None) for head, pred in predictions.items()},
+        "timings": timings,
+        "computed_at": time.time(),
+    }
+
+
+def content_hash(uploaded_file):
+    # Hash each upload once per session instead of on every rerun.
+    hashes = st.session_state.setdefault("upload_hashes", {})
+    if uploaded_file.file_id not in hashes:
+        hashes[uploaded_file.file_id] = hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+    return hashes[uploaded_file.file_id]
+
+
+models = load_models()
+embedder = load_embedder()
+embedding_cache = load_embedding_cache()
+quality_gate = load_quality_gate()
+run_started = time.time()
+
 # File upload
 uploaded_file = st.file_uploader("Upload a patient photo", type=["jpg", "jpeg", "png"])
 
+image_points = None
+
 # Display image immediately after upload
 if uploaded_file is not None:
     st.image(uploaded_file, caption="Uploaded Image", use_container_width=True)
 
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp:
-        tmp.write(uploaded_file.getvalue())
-        tmp_path = tmp.name
-
     with st.spinner("Analyzing photo..."):
 
-        # Load models
-        aging_classifier = joblib.load("aging_spots_classifier_model.pkl")
-        aging_scaler = joblib.load("aging_spots_classifier_model_scaler.pkl")
-        jugular_classifier = joblib.load("jugular_veins_classifier_model.pkl")
-        jugular_scaler = joblib.load("jugular_veins_classifier_model_scaler.pkl")
-        xanthelasma_classifier = joblib.load("xanthelasma_classifier_model.pkl")
-        xanthelasma_scaler = joblib.load("xanthelasma_classifier_model_scaler.pkl")
-        neck_classifier = joblib.load("neck_circumference_classifier_model.pkl")
-        neck_scaler = joblib.load("neck_circumference_classifier_model_scaler.pkl")
-
-        # Image predictions
-        aging_pred = predict_image(tmp_path, aging_classifier, aging_scaler)
-        jugular_pred = predict_image(tmp_path, jugular_classifier, jugular_scaler)
-        xanthelasma_pred = predict_image(tmp_path, xanthelasma_classifier, xanthelasma_scaler)
-        neck_pred = predict_image(tmp_path, neck_classifier, neck_scaler)
-
-        st.subheader("🔬 Image Predictions")
-        st.write(f"Aging Spots: {aging_pred or 'Unable to determine'}")
-        st.write(f"Jugular Veins: {jugular_pred or 'Unable to determine'}")
-        st.write(f"Xanthelasma: {xanthelasma_pred or 'Unable to determine'}")
-        st.write(f"Neck Circumference: {neck_pred or 'Unable to determine'}")
-
-        # Risk score
-        image_points = 0
-        if aging_pred and aging_pred.lower() == "positive":
-            image_points += 2
-        if jugular_pred and jugular_pred.lower() == "positive":
-            image_points += 1
-        if xanthelasma_pred and xanthelasma_pred.lower() == "positive":
-            image_points += 3
-        if neck_pred and neck_pred.lower() == "positive":
-            image_points += 2
-
-        st.success(f"🧠 Image-Based Risk Score: {image_points}")
+        # Image predictions (one embedding shared by all four classifiers)
+        try:
+            result = predict_uploaded_image(content_hash(uploaded_file), uploaded_file.getvalue())
+        except ImageRejected as e:
+            st.error(f"Photo rejected by the quality gate ({e.reason}); please upload a sharper, well-lit photo of the face.")
+            st.stop()
+        predictions = result["predictions"]
+
+    st.subheader("🔬 Image Predictions")
+    for head, label in HEAD_LABELS.items():
+        st.write(f"{label}: {predictions[head] or 'Unable to determine'}")
+    if result["computed_at"] >= run_started:
+        st.caption("🆕 Freshly computed. Timings: " + ", ".join(
+            f"{stage} {seconds * 1000:.0f} ms" for stage, seconds in result["timings"].items()))
+    else:
+        st.caption("⚡ Cached result for this photo (no image inference on this run)")
+
+    # Risk score
+    image_points = image_risk_points(predictions)
+
+    st.success(f"🧠 Image-Based Risk Score: {image_points}")
 
 # Patient inputs
 st.header("🧾 Patient Data")
@@ -74,77 +131,41 @@ with col2:
     diabetic = st.radio("Diabetic?", ["Yes", "No"])
     sts = st.number_input("STS Score (Optional)", min_value=0.0, step=0.1)
 
-# Run button
-if uploaded_file is not None and st.button("🔍 Run CVD Prediction"):
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp:
-        tmp.write(uploaded_file.getvalue())
-        tmp_path = tmp.name
-
-    with st.spinner("Analyzing photo..."):
-
-        # Load models
-        aging_classifier = joblib.load("aging_spots_classifier_model.pkl")
-        aging_scaler = joblib.load("aging_spots_classifier_model_scaler.pkl")
-        jugular_classifier = joblib.load("jugular_veins_classifier_model.pkl")
-        jugular_scaler = joblib.load("jugular_veins_classifier_model_scaler.pkl")
-        xanthelasma_classifier = joblib.load("xanthelasma_classifier_model.pkl")
-        xanthelasma_scaler = joblib.load("xanthelasma_classifier_model_scaler.pkl")
-        neck_classifier = joblib.load("neck_circumference_classifier_model.pkl")
-        neck_scaler = joblib.load("neck_circumference_classifier_model_scaler.pkl")
-
-        # Image predictions
-        aging_pred = predict_image(tmp_path, aging_classifier, aging_scaler)
-        jugular_pred = predict_image(tmp_path, jugular_classifier, jugular_scaler)
-        xanthelasma_pred = predict_image(tmp_path, xanthelasma_classifier, xanthelasma_scaler)
-        neck_pred = predict_image(tmp_path, neck_classifier, neck_scaler)
-
-        st.subheader("🔬 Image Predictions")
-        st.write(f"Aging Spots: {aging_pred or 'Unable to determine'}")
-        st.write(f"Jugular Veins: {jugular_pred or 'Unable to determine'}")
-        st.write(f"Xanthelasma: {xanthelasma_pred or 'Unable to determine'}")
-        st.write(f"Neck Circumference: {neck_pred or 'Unable to determine'}")
-
-        # Risk score
-        image_points = 0
-        if aging_pred and aging_pred.lower() == "positive":
-            image_points += 2
-        if jugular_pred and jugular_pred.lower() == "positive":
-            image_points += 1
-        if xanthelasma_pred and xanthelasma_pred.lower() == "positive":
-            image_points += 3
-        if neck_pred and neck_pred.lower() == "positive":
-            image_points += 2
-
-        st.success(f"🧠 Image-Based Risk Score: {image_points}")
-
-        # Prepare inputs
-        bp_treatment_bool = bp_treatment == "Yes"
-        smoker_bool = smoker == "Yes"
-        diabetic_bool = diabetic == "Yes"
-
-        # Risk calculations
-        try:
-            ascvd_risk = calculate_ascvd_risk(
-                age, sex if sex != "Select" else None, total_chol, hdl,
-                systolic_bp, bp_treatment_bool, smoker_bool,
-                diabetic_bool, rcri if rcri > 0 else None, sts if sts > 0 else None
-            )
-        except Exception as e:
-            ascvd_risk = 0
-            st.error(f"ASCVD Risk Calculation Failed: {e}")
-
-        final_risk = ascvd_risk + image_points * 2
-
-        st.subheader("📊 Final Risk Estimate")
-        st.write(f"ASCVD 10-Year Risk: **{ascvd_risk:.2f}%**")
-        st.write(f"Final Estimated CVD Risk: **{final_risk:.2f}%**")
-
-        if final_risk <= 5:
-            st.success("Risk Category: Low Risk")
-        elif 5 < final_risk <= 7.4:
-            st.info("Risk Category: Medium-low Risk")
-        elif 7.5 <= final_risk <= 19.9:
-            st.warning("Risk Category: Medium-high Risk")
-        else:
-            st.error("Risk Category: High Risk")
-
+# Final risk: recomputed live from the patient fields and the memoized image points
+if image_points is not None:
+    # Prepare inputs
+    bp_treatment_bool = bp_treatment == "Yes"
+    smoker_bool = smoker == "Yes"
+    diabetic_bool = diabetic == "Yes"
+
+    # Risk calculations
+    try:
+        ascvd_risk = calculate_ascvd_risk(
+            age, sex if sex != "Select" else None, total_chol, hdl,
+            systolic_bp, bp_treatment_bool, smoker_bool,
+            diabetic_bool, rcri if rcri > 0 else None, sts if sts > 0 else None
+        )
+    except Exception as e:
+        ascvd_risk = 0
+        st.error(f"ASCVD Risk Calculation Failed: {e}")
+
+    final_risk = combine_with_image_points(ascvd_risk, image_points)
+
+    st.subheader("📊 Final Risk Estimate")
+    st.write(f"ASCVD 10-Year Risk: **{ascvd_risk:.2f}%**")
+    st.write(f"Final Estimated CVD Risk: **{final_risk:.2f}%**")
+
+    category = risk_category(final_risk)
+    show_category = {
+        "Low Risk": st.success,
+        "Medium-low Risk": st.info,
+        "Medium-high Risk": st.warning,
+    }.get(category, st.error)
+    show_category(f"Risk Category: {category}")
+else:
+    st.info("Upload a patient photo to see the final risk estimate.")
+
+# Per-stage metrics for this server process (enabled with CVD_METRICS=1)
+if instrumentation.enabled():
+    with st.expander("Pipeline metrics"):
+        st.json(instrumentation.snapshot())
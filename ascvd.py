@@ -177,6 +177,21 @@ def calculate_ascvd_risk(age, sex, total_chol, hdl, systolic_bp, bp_treatment, s
     final_risk = round(final_risk, 2)
     return min(final_risk, 100)
 
+def combine_with_image_points(ascvd_risk, image_points):
+    """Combines the ASCVD risk with image-based points (each point adds 2%)."""
+    return ascvd_risk + image_points * 2
+
+def risk_category(final_risk):
+    """Maps a final risk percentage to the reported risk category."""
+    if final_risk <= 5:
+        return "Low Risk"
+    elif 5 < final_risk <= 7.4:
+        return "Medium-low Risk"
+    elif 7.5 <= final_risk <= 19.9:
+        return "Medium-high Risk"
+    else:  # final_risk >= 20
+        return "High Risk"
+
 if __name__ == "__main__":
     # Basic test example
     risk = calculate_ascvd_risk(55, "male", 210, 45, 130, True, False, True)
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Vectorized ASCVD Risk Calculator
+
+Columnar counterpart of ascvd.py for whole patient cohorts: every argument is an
+array (or DataFrame column, or a scalar broadcast to the cohort) and the points,
+base risk and RCRI/STS-weighted final risk are computed with lookup tables and
+np.searchsorted instead of per-patient if/elif ladders.
+
+Missing values follow the scalar code, with NaN standing in for None:
+  - a missing sex scores no age/cholesterol/smoking/diabetes points, and the
+    "risk" is the raw points (the scalar fallback);
+  - a sex other than male/female scores no age/cholesterol points and uses the
+    female smoking/diabetes points and risk table;
+  - a missing measurement (or BP treatment, for systolic BP) scores 0 points;
+  - missing RCRI/STS scores drop out of the weighting.
+
+Run this module directly to check parity with ascvd.calculate_ascvd_risk over
+every bin boundary.
+"""
+
+import numpy as np
+
+from ascvd import calculate_ascvd_risk as calculate_ascvd_risk_scalar
+from ascvd import points_to_risk as scalar_points_to_risk
+
+SEX_MISSING, SEX_MALE, SEX_FEMALE, SEX_OTHER = 0, 1, 2, 3
+
+# Bin edges (lower bounds, inclusive) and points per bin. Bin 0 lies below the
+# first edge; for age the last bin (80+) scores nothing, as in the scalar code.
+AGE_EDGES = np.array([40, 45, 50, 55, 60, 65, 70, 75, 80], dtype=float)
+AGE_POINTS_MALE = np.array([0, 0, 3, 6, 8, 10, 11, 12, 13, 0])
+AGE_POINTS_FEMALE = np.array([0, -7, -3, 0, 3, 6, 8, 10, 12, 0])
+
+CHOL_EDGES = np.array([160, 200, 240, 280], dtype=float)
+CHOL_POINTS_MALE = np.array([0, 4, 7, 9, 11])
+CHOL_POINTS_FEMALE = np.array([0, 4, 8, 11, 13])
+
+HDL_EDGES = np.array([40, 50, 60], dtype=float)
+HDL_POINTS = np.array([2, 1, 0, -1])
+
+BP_EDGES = np.array([120, 130, 140, 160], dtype=float)
+BP_POINTS_TREATED = np.array([0, 3, 4, 5, 6])
+BP_POINTS_UNTREATED = np.array([0, 1, 2, 3, 4])
+
+SMOKER_POINTS = {SEX_MALE: 4, SEX_FEMALE: 3}
+DIABETIC_POINTS = {SEX_MALE: 2, SEX_FEMALE: 4}
+
+# Risk tables indexed by points clipped to [first, last] minus first.
+MALE_RISK_FIRST, MALE_RISK_LAST = 4, 17
+MALE_RISK = np.array([1, 2, 2, 3, 4, 5, 6, 8, 10, 12, 16, 20, 25, 30], dtype=float)
+FEMALE_RISK_FIRST, FEMALE_RISK_LAST = 11, 23
+FEMALE_RISK = np.array([1, 2, 2, 3, 4, 5, 6, 8, 11, 14, 17, 22, 27], dtype=float)
+
+POINT_COMPONENTS = ("age", "total_chol", "hdl", "systolic_bp", "smoker", "diabetic")
+
+
+# ----------------------------
+# Input conversion
+# ----------------------------
+def _is_missing(values):
+    return np.frompyfunc(lambda v: v is None or (isinstance(v, float) and v != v), 1, 1)(values).astype(bool)
+
+
+def as_float(values):
+    """Array of floats with None mapped to NaN."""
+    arr = np.asarray(values)
+    if arr.dtype.kind in "biuf":
+        return arr.astype(float)
+    arr = arr.astype(object)
+    missing = _is_missing(arr)
+    out = np.full(arr.shape, np.nan)
+    out[~missing] = arr[~missing].astype(float)
+    return out
+
+
+def as_flag(values):
+    """Array of 1.0 (truthy) / 0.0 (falsy) / NaN (None or NaN)."""
+    arr = np.asarray(values)
+    if arr.dtype.kind in "biuf":
+        out = (arr != 0).astype(float)
+        if arr.dtype.kind == "f":
+            out[np.isnan(arr)] = np.nan
+        return out
+    arr = arr.astype(object)
+    missing = _is_missing(arr)
+    out = np.frompyfunc(bool, 1, 1)(arr).astype(float)
+    out[missing] = np.nan
+    return out
+
+
+def _sex_code(value):
+    if not isinstance(value, str):
+        return SEX_MISSING
+    return {"male": SEX_MALE, "female": SEX_FEMALE}.get(value.lower(), SEX_OTHER)
+
+
+def sex_codes(sex):
+    """Array of SEX_* codes; anything that is not a string counts as missing."""
+    arr = np.asarray(sex)
+    if arr.dtype.kind not in "US":
+        arr = arr.astype(object)
+    codes = np.full(arr.shape, SEX_MISSING, dtype=np.int8)
+    # Cohorts hold only a handful of distinct values, so compare per distinct value.
+    for value in set(arr.reshape(-1).tolist()):
+        if isinstance(value, str):
+            codes[arr == value] = _sex_code(value)
+    return codes
+
+
+def _broadcast(*arrays):
+    return np.broadcast_arrays(*[np.atleast_1d(a) for a in arrays])
+
+
+# ----------------------------
+# Points and risk
+# ----------------------------
+def _bin_index(values, edges):
+    # side="right" puts a value equal to an edge into the bin starting at it.
+    return np.searchsorted(edges, values, side="right")
+
+
+def _age_points(codes, age):
+    idx = _bin_index(age, AGE_EDGES)
+    points = np.where(codes == SEX_MALE, AGE_POINTS_MALE[idx], np.where(codes == SEX_FEMALE, AGE_POINTS_FEMALE[idx], 0))
+    points[np.isnan(age)] = 0
+    return points
+
+
+def _chol_points(codes, total_chol):
+    idx = _bin_index(total_chol, CHOL_EDGES)
+    points = np.where(codes == SEX_MALE, CHOL_POINTS_MALE[idx],
+                      np.where(codes == SEX_FEMALE, CHOL_POINTS_FEMALE[idx], 0))
+    points[np.isnan(total_chol)] = 0
+    return points
+
+
+def _hdl_points(codes, hdl):
+    return np.where(np.isnan(hdl), 0, HDL_POINTS[_bin_index(hdl, HDL_EDGES)])
+
+
+def _bp_points(codes, systolic_bp, bp_treatment):
+    idx = _bin_index(systolic_bp, BP_EDGES)
+    points = np.where(bp_treatment == 1, BP_POINTS_TREATED[idx], BP_POINTS_UNTREATED[idx])
+    points[np.isnan(systolic_bp) | np.isnan(bp_treatment)] = 0
+    return points
+
+
+def _flag_points(table):
+    def points(codes, flag):
+        return np.where((codes != SEX_MISSING) & (flag == 1),
+                        np.where(codes == SEX_MALE, table[SEX_MALE], table[SEX_FEMALE]), 0)
+    return points
+
+
+# Per component: (function of (codes, *inputs), the converted inputs it reads).
+COMPONENT_FUNCTIONS = {
+    "age": (_age_points, ("age",)),
+    "total_chol": (_chol_points, ("total_chol",)),
+    "hdl": (_hdl_points, ("hdl",)),
+    "systolic_bp": (_bp_points, ("systolic_bp", "bp_treatment")),
+    "smoker": (_flag_points(SMOKER_POINTS), ("smoker",)),
+    "diabetic": (_flag_points(DIABETIC_POINTS), ("diabetic",)),
+}
+
+
+def prepare_columns(age, sex, total_chol, hdl, systolic_bp, bp_treatment, smoker, diabetic):
+    """
+    Converts and broadcasts the point inputs once: {"sex": SEX_* codes, measurements
+    as float arrays (NaN for missing), flags as 1.0/0.0/NaN}.
+    """
+    codes = np.asarray(sex) if np.asarray(sex).dtype.kind in "iu" else sex_codes(sex)
+    age, total_chol, hdl, systolic_bp = (as_float(v) for v in (age, total_chol, hdl, systolic_bp))
+    bp_treatment, smoker, diabetic = (as_flag(v) for v in (bp_treatment, smoker, diabetic))
+    codes, age, total_chol, hdl, systolic_bp, bp_treatment, smoker, diabetic = _broadcast(
+        codes, age, total_chol, hdl, systolic_bp, bp_treatment, smoker, diabetic)
+    return {"sex": codes, "age": age, "total_chol": total_chol, "hdl": hdl, "systolic_bp": systolic_bp,
+            "bp_treatment": bp_treatment, "smoker": smoker, "diabetic": diabetic}
+
+
+def component_points(columns, names=POINT_COMPONENTS):
+    """Points of the named components for columns from prepare_columns, as {component: int array}."""
+    points = {}
+    for name in names:
+        function, inputs = COMPONENT_FUNCTIONS[name]
+        points[name] = function(columns["sex"], *(columns[field] for field in inputs))
+    return points
+
+
+def ascvd_point_components(age, sex, total_chol, hdl, systolic_bp, bp_treatment, smoker, diabetic):
+    """
+    Points contributed by each risk factor, as {component: int array}. `sex`
+    may be given as strings or as precomputed SEX_* codes.
+    """
+    return component_points(prepare_columns(age, sex, total_chol, hdl, systolic_bp, bp_treatment, smoker, diabetic))
+
+
+def calculate_ascvd_points(age, sex, total_chol, hdl, systolic_bp, bp_treatment, smoker, diabetic):
+    components = ascvd_point_components(age, sex, total_chol, hdl, systolic_bp, bp_treatment, smoker, diabetic)
+    return sum(components[name] for name in POINT_COMPONENTS)
+
+
+def points_to_risk(points, sex):
+    codes = np.asarray(sex) if np.asarray(sex).dtype.kind in "iu" else sex_codes(sex)
+    points, codes = _broadcast(np.asarray(points), codes)
+    male_risk = MALE_RISK[np.clip(points, MALE_RISK_FIRST, MALE_RISK_LAST) - MALE_RISK_FIRST]
+    female_risk = FEMALE_RISK[np.clip(points, FEMALE_RISK_FIRST, FEMALE_RISK_LAST) - FEMALE_RISK_FIRST]
+    return np.where(codes == SEX_MISSING, points,
+                    np.where(codes == SEX_MALE, male_risk, female_risk)).astype(float)
+
+
+def _round2(values):
+    """round(x, 2) elementwise, matching Python's correctly rounded round() on ties."""
+    rounded = np.round(values, 2)
+    scaled = values * 100
+    near_tie = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    for i in np.flatnonzero(near_tie):
+        rounded.flat[i] = round(float(values.flat[i]), 2)
+    return rounded
+
+
+def combine_risk(base_risk, rcri=None, sts=None):
+    """Weights base risk (50%) with RCRI and STS (25% each), re-normalizing for missing scores."""
+    base_risk = np.asarray(base_risk, dtype=float)
+    rcri = as_float(np.nan if rcri is None else rcri)
+    sts = as_float(np.nan if sts is None else sts)
+    base_risk, rcri, sts = _broadcast(base_risk, rcri, sts)
+
+    has_rcri = ~np.isnan(rcri)
+    has_sts = ~np.isnan(sts)
+    weighted_sum = 0.5 * base_risk + np.where(has_rcri, 0.25 * rcri, 0) + np.where(has_sts, 0.25 * sts, 0)
+    total_weight = 0.5 + 0.25 * has_rcri + 0.25 * has_sts
+    return np.minimum(_round2(weighted_sum / total_weight), 100)
+
+
+def calculate_ascvd_risk(age, sex, total_chol, hdl, systolic_bp, bp_treatment, smoker, diabetic, rcri=None, sts=None):
+    """Vectorized ascvd.calculate_ascvd_risk; returns a float array of final risks."""
+    codes = sex_codes(sex)
+    pts = calculate_ascvd_points(age, codes, total_chol, hdl, systolic_bp, bp_treatment, smoker, diabetic)
+    return combine_risk(points_to_risk(pts, codes), rcri, sts)
+
+
+def calculate_ascvd_risk_frame(df):
+    """Scores a DataFrame (or dict of columns) named after patient_data.PATIENT_FIELDS."""
+    from patient_data import PATIENT_FIELDS
+
+    columns = {field: (df[field] if field in df else None) for field in PATIENT_FIELDS}
+    n = len(next(iter(df.values())) if isinstance(df, dict) else df)
+    for field, column in columns.items():
+        if column is None:
+            columns[field] = np.full(n, np.nan)
+        else:
+            columns[field] = np.asarray(column, dtype=object if field == "sex" else None)
+    return calculate_ascvd_risk(*(columns[field] for field in PATIENT_FIELDS))
+
+
+# ----------------------------
+# Parity check against the scalar calculator
+# ----------------------------
+_BOUNDARY_VALUES = {
+    "age": [None, 20, 39, 39.5, 40, 44, 44.9, 45, 49, 50, 54, 55, 59, 60, 64, 65, 69, 70, 74, 75, 79, 79.9, 80, 95],
+    "sex": [None, "male", "Male", "M", "female", "FEMALE", "other", ""],
+    "total_chol": [None, 100, 159, 159.9, 160, 199, 200, 239, 240, 279, 280, 400],
+    "hdl": [None, 20, 39, 39.9, 40, 49, 50, 59, 59.9, 60, 90],
+    "systolic_bp": [None, 90, 119, 119.9, 120, 129, 130, 139, 140, 159, 160, 220],
+    "bp_treatment": [None, True, False],
+    "smoker": [None, True, False],
+    "diabetic": [None, True, False],
+    "rcri": [None, 0, 1, 2.5, 3.3, 150],
+    "sts": [None, 0, 1.2, 7.5, 33.33, 150],
+}
+
+
+def check_parity(samples=20000, seed=0):
+    """
+    Compares the vectorized and scalar calculators on (a) every boundary value of
+    every field, swept against randomly chosen values of the other fields, and
+    (b) random combinations of boundary values. Returns the number of mismatches.
+    """
+    from patient_data import PATIENT_FIELDS
+
+    rng = np.random.default_rng(seed)
+    rows = []
+    for field in PATIENT_FIELDS:
+        for value in _BOUNDARY_VALUES[field]:
+            for _ in range(50):
+                row = {f: _BOUNDARY_VALUES[f][rng.integers(len(_BOUNDARY_VALUES[f]))] for f in PATIENT_FIELDS}
+                row[field] = value
+                rows.append(row)
+    for _ in range(samples):
+        rows.append({f: _BOUNDARY_VALUES[f][rng.integers(len(_BOUNDARY_VALUES[f]))] for f in PATIENT_FIELDS})
+
+    columns = [np.array([row[f] for row in rows], dtype=object) for f in PATIENT_FIELDS]
+    vectorized = calculate_ascvd_risk(*columns)
+    mismatches = 0
+    for row, value in zip(rows, vectorized):
+        expected = calculate_ascvd_risk_scalar(*(row[f] for f in PATIENT_FIELDS))
+        if expected != value:
+            mismatches += 1
+            if mismatches <= 10:
+                print(f"Mismatch: {row} scalar={expected} vectorized={value}")
+
+    for sex in [None, "male", "female", "other"]:
+        points = np.arange(-15, 35)
+        expected = [scalar_points_to_risk(int(p), sex) for p in points]
+        if not np.array_equal(points_to_risk(points, np.array([sex] * len(points), dtype=object)), expected):
+            mismatches += 1
+            print(f"points_to_risk mismatch for sex={sex}")
+
+    print(f"Checked {len(rows)} patients: {mismatches} mismatches")
+    return mismatches
+
+
+if __name__ == "__main__":
+    raise SystemExit(1 if check_parity() else 0)
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+What-if (counterfactual) ASCVD risk analysis for whole patient panels.
+
+Each intervention edits some inputs and therefore only some point components:
+
+    quit_smoking        smoker -> no                              (smoker)
+    treat_bp            patients at or above --bp-target mm Hg:
+                        on BP medication, systolic BP brought
+                        below the target, where that lowers the
+                        points                                    (systolic_bp)
+    lower_cholesterol   total cholesterol lowered by
+                        --chol-reduction percent                  (total_chol)
+
+A scenario is one intervention or several joined with "+", e.g.
+"quit_smoking+treat_bp". The inputs are converted and every component is
+scored once for the panel; each scenario then recomputes only the components
+its interventions touch and reuses the rest, so all scenarios for all patients
+take one vectorized pass per scenario instead of one calculate_ascvd_risk call
+per scenario per patient. Risks match ascvd_vectorized.calculate_ascvd_risk
+(and so ascvd.calculate_ascvd_risk) on the edited inputs.
+
+    python ascvd_whatif.py --patients panel.csv --output whatif.jsonl
+    python ascvd_whatif.py --patients panel.jsonl --scenarios quit_smoking treat_bp quit_smoking+treat_bp
+"""
+
+import argparse
+import csv
+import json
+import sys
+
+import numpy as np
+
+from ascvd_vectorized import POINT_COMPONENTS, combine_risk, component_points, points_to_risk, prepare_columns
+from patient_data import PATIENT_FIELDS, patient_from_record
+
+BP_TARGET = 120.0
+CHOL_REDUCTION = 30.0
+
+
+# ----------------------------
+# Interventions
+# ----------------------------
+def quit_smoking(columns, options):
+    smoker = columns["smoker"].copy()
+    smoker[smoker == 1] = 0
+    return {"smoker": smoker}
+
+
+def treat_bp(columns, options):
+    target = options.get("bp_target", BP_TARGET)
+    systolic_bp = columns["systolic_bp"].copy()
+    # "Below target" lands in the bin under the target edge (1 mm Hg under it).
+    systolic_bp[systolic_bp >= target] = target - 1
+    treated = dict(columns, systolic_bp=systolic_bp, bp_treatment=np.ones_like(systolic_bp))
+    # The treated points of the bin under the target can exceed the untreated points of the
+    # patient's own bin, so the edit is only kept where it lowers the points; it never adds risk.
+    before = component_points(columns, ["systolic_bp"])["systolic_bp"]
+    lowered = component_points(treated, ["systolic_bp"])["systolic_bp"] < before
+    return {"systolic_bp": np.where(lowered, systolic_bp, columns["systolic_bp"]),
+            "bp_treatment": np.where(lowered, 1.0, columns["bp_treatment"])}
+
+
+def lower_cholesterol(columns, options):
+    reduction = options.get("chol_reduction", CHOL_REDUCTION)
+    return {"total_chol": columns["total_chol"] * (1 - reduction / 100.0)}
+
+
+# Per intervention: (function of (columns, options) -> edited columns, components it affects).
+INTERVENTIONS = {
+    "quit_smoking": (quit_smoking, ("smoker",)),
+    "treat_bp": (treat_bp, ("systolic_bp",)),
+    "lower_cholesterol": (lower_cholesterol, ("total_chol",)),
+}
+DEFAULT_SCENARIOS = ("quit_smoking", "treat_bp", "lower_cholesterol", "quit_smoking+treat_bp+lower_cholesterol")
+
+
+def parse_scenario(scenario):
+    """Splits "a+b" into its interventions; raises ValueError for unknown names."""
+    names = tuple(name.strip() for name in scenario.split("+") if name.strip())
+    unknown = [name for name in names if name not in INTERVENTIONS]
+    if unknown or not names:
+        raise ValueError(f"Unknown intervention(s) {unknown} in {scenario!r} (expected {list(INTERVENTIONS)})")
+    return names
+
+
+# ----------------------------
+# Evaluation
+# ----------------------------
+def _risk(components, columns, rcri, sts):
+    points = sum(components[name] for name in POINT_COMPONENTS)
+    return combine_risk(points_to_risk(points, columns["sex"]), rcri, sts)
+
+
+def evaluate_scenarios(age, sex, total_chol, hdl, systolic_bp, bp_treatment, smoker, diabetic, rcri=None, sts=None,
+                       scenarios=DEFAULT_SCENARIOS, **options):
+    """
+    Scores the panel as is and under every scenario. Arguments are columns as for
+    ascvd_vectorized.calculate_ascvd_risk; `options` holds bp_target and
+    chol_reduction. Returns {"baseline": risk array, "risk": {scenario: risk
+    array}, "delta": {scenario: risk minus baseline}}.
+    """
+    columns = prepare_columns(age, sex, total_chol, hdl, systolic_bp, bp_treatment, smoker, diabetic)
+    baseline_components = component_points(columns)
+    baseline = _risk(baseline_components, columns, rcri, sts)
+
+    risk, delta = {}, {}
+    for scenario in scenarios:
+        edited = dict(columns)
+        affected = set()
+        for name in parse_scenario(scenario):
+            function, components = INTERVENTIONS[name]
+            edited.update(function(edited, options))
+            affected.update(components)
+        components = dict(baseline_components)
+        components.update(component_points(edited, sorted(affected)))
+        risk[scenario] = _risk(components, edited, rcri, sts)
+        delta[scenario] = risk[scenario] - baseline
+    return {"baseline": baseline, "risk": risk, "delta": delta}
+
+
+def evaluate_frame(df, scenarios=DEFAULT_SCENARIOS, **options):
+    """evaluate_scenarios for a DataFrame (or dict of columns) named after PATIENT_FIELDS."""
+    n = len(next(iter(df.values())) if isinstance(df, dict) else df)
+    columns = []
+    for field in PATIENT_FIELDS:
+        column = df[field] if field in df else None
+        columns.append(np.full(n, np.nan) if column is None
+                       else np.asarray(column, dtype=object if field == "sex" else None))
+    return evaluate_scenarios(*columns, scenarios=scenarios, **options)
+
+
+def ranked_interventions(result, index, min_delta=0.005):
+    """Scenarios that lower patient `index`'s risk, largest reduction first: [(scenario, risk, delta)]."""
+    rows = [(scenario, float(result["risk"][scenario][index]), float(result["delta"][scenario][index]))
+            for scenario in result["risk"]]
+    return sorted((row for row in rows if row[2] <= -min_delta), key=lambda row: row[2])
+
+
+def rank_panel(result, top=None):
+    """Patient indices ordered by the largest risk reduction any scenario achieves."""
+    best = np.min(np.vstack(list(result["delta"].values())), axis=0) if result["delta"] else np.zeros(0)
+    order = np.argsort(best, kind="stable")
+    return order[:top] if top else order
+
+
+# ----------------------------
+# CLI
+# ----------------------------
+def read_patients(path):
+    """Patient records from a CSV, JSON (object or list) or JSONL file."""
+    with open(path, newline="") as f:
+        if path.lower().endswith(".csv"):
+            return list(csv.DictReader(f))
+        if path.lower().endswith((".jsonl", ".ndjson")):
+            return [json.loads(line) for line in f if line.strip()]
+        data = json.load(f)
+    return data if isinstance(data, list) else [data]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="What-if ASCVD risk for a patient panel under interventions.")
+    parser.add_argument("--patients", required=True, help="Patient records (.csv, .json or .jsonl)")
+    parser.add_argument("--output", default="-", help="Output .jsonl path (default: stdout)")
+    parser.add_argument("--scenarios", nargs="+", default=list(DEFAULT_SCENARIOS),
+                        help=f"Interventions, combined with '+' (available: {', '.join(INTERVENTIONS)})")
+    parser.add_argument("--bp-target", type=float, default=BP_TARGET, help="Systolic BP goal for treat_bp (mm Hg)")
+    parser.add_argument("--chol-reduction", type=float, default=CHOL_REDUCTION,
+                        help="Total cholesterol reduction for lower_cholesterol (percent)")
+    parser.add_argument("--top", type=int, default=None, help="Only the N patients with the largest possible reduction")
+    args = parser.parse_args()
+    for scenario in args.scenarios:
+        try:
+            parse_scenario(scenario)
+        except ValueError as e:
+            parser.error(str(e))
+
+    records = read_patients(args.patients)
+    patients = []
+    for i, record in enumerate(records):
+        try:
+            patients.append(patient_from_record(record) or (None,) * len(PATIENT_FIELDS))
+        except ValueError as e:
+            parser.error(f"{args.patients}: record {i}: {e}")
+    if patients:
+        columns = [np.array(column, dtype=object) for column in zip(*patients)]
+    else:
+        columns = [np.array([], dtype=object) for _ in PATIENT_FIELDS]
+    result = evaluate_scenarios(*columns, scenarios=args.scenarios,
+                                bp_target=args.bp_target, chol_reduction=args.chol_reduction)
+
+    f = sys.stdout if args.output == "-" else open(args.output, "w")
+    try:
+        for i in rank_panel(result, args.top):
+            row = {"baseline_risk": float(result["baseline"][i])}
+            if "id" in records[i]:
+                row = dict(id=records[i]["id"], **row)
+            row["interventions"] = [{"scenario": scenario, "risk": risk, "delta": round(delta, 2)}
+                                    for scenario, risk, delta in ranked_interventions(result, i)]
+            f.write(json.dumps(row) + "\n")
+    finally:
+        if f is not sys.stdout:
+            f.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+"""
+Batch scoring of patient photos.
+
+Reads a directory of images or a CSV/JSONL manifest (one record per image with an
+"image" column plus optional patient fields, see patient_data.PATIENT_FIELDS),
+embeds the images chunk by chunk, runs each scaler/classifier once per chunk on
+the stacked embedding matrix and streams one result row per image as CSV or JSONL.
+
+    python batch.py --input photos/ --output results.csv
+    python batch.py --input manifest.jsonl --output results.jsonl --chunk-size 512
+    python batch.py --input photos/ --output results.csv --quality-gate
+
+With --quality-gate, blurry, tiny, badly exposed or face-less photos are rejected
+before embedding; their rows carry "rejected: <reason>" in the error column.
+With --index-dir, the embeddings and labels are kept in a similar_cases index.
+With --pipeline, reading/decoding, embedding and writing overlap (see pipeline.py),
+which keeps the embedding model busy when the photos live on slow storage.
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+
+import numpy as np
+
+import instrumentation
+import model_registry
+from embedding_cache import EmbeddingCache
+from workers import EmbeddingWorkerPool
+from ascvd import calculate_ascvd_risk, combine_with_image_points, risk_category
+from model_utils import HEADS, extract_embedding, classify_embeddings, image_risk_points, load_image
+from patient_data import patient_from_record
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+# Set by iter_records on a manifest row that cannot be used; the row is reported, not embedded.
+MANIFEST_ERROR = "manifest_error"
+RESULT_FIELDS = ("image",) + HEADS + ("image_points", "ascvd_risk", "final_risk", "risk_category", "error")
+
+
+# ----------------------------
+# Input
+# ----------------------------
+def _resolve(image_path, base_dir):
+    image_path = os.path.expanduser(image_path)
+    return image_path if os.path.isabs(image_path) else os.path.join(base_dir, image_path)
+
+
+def _iter_json_lines(f):
+    for number, line in enumerate(f, 1):
+        if line.strip():
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield {MANIFEST_ERROR: f"line {number}: invalid JSON ({e})"}
+                continue
+            yield row if isinstance(row, dict) else {MANIFEST_ERROR: f"line {number}: expected a JSON object"}
+
+
+def iter_records(input_path):
+    """
+    Yields one record dict per image; each has an "image" path and any patient
+    fields. A manifest row that is not valid JSON or has no image path is yielded
+    with a MANIFEST_ERROR message instead, so one bad row does not end the run.
+    """
+    if os.path.isdir(input_path):
+        for root, _, files in sorted(os.walk(input_path)):
+            for name in sorted(files):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    yield {"image": os.path.join(root, name)}
+        return
+
+    base_dir = os.path.dirname(os.path.abspath(input_path))
+    with open(input_path, newline="") as f:
+        if input_path.lower().endswith(".csv"):
+            rows = csv.DictReader(f)
+        elif input_path.lower().endswith((".jsonl", ".ndjson")):
+            rows = _iter_json_lines(f)
+        else:
+            raise ValueError(f"Unsupported manifest format: {input_path} (expected .csv or .jsonl)")
+        for row in rows:
+            if MANIFEST_ERROR in row:
+                yield dict(row, image="")
+                continue
+            image_path = row.get("image") or row.get("image_path")
+            if not image_path:
+                yield dict(row, image="", **{MANIFEST_ERROR: "manifest row without an image path"})
+                continue
+            record = dict(row)
+            record["image"] = _resolve(image_path, base_dir)
+            yield record
+
+
+def iter_chunks(records, chunk_size):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# ----------------------------
+# Scoring
+# ----------------------------
+def _safe_embed(embedder, image_path):
+    try:
+        embedding = embedder(image_path)
+    except Exception as e:  # unreadable image, DeepFace failure, ...
+        return None, str(e)
+    if embedding is None:
+        return None, "no embedding"
+    return embedding, None
+
+
+def _risk_fields(record, image_points):
+    patient = patient_from_record(record)
+    if patient is None:
+        return {}
+    ascvd_risk = calculate_ascvd_risk(*patient)
+    final_risk = combine_with_image_points(ascvd_risk, image_points)
+    return {"ascvd_risk": ascvd_risk, "final_risk": final_risk, "risk_category": risk_category(final_risk)}
+
+
+def score_embeddings(records, embeddings, errors, models):
+    """Classifies a chunk whose embeddings are already known (None where embedding failed)."""
+    ok = [i for i, embedding in enumerate(embeddings) if embedding is not None]
+    predictions = {}
+    if ok:
+        matrix = np.vstack([np.asarray(embeddings[i], dtype=np.float64) for i in ok])
+        predictions, _ = classify_embeddings(matrix, models)
+    position = {i: row for row, i in enumerate(ok)}
+
+    results = []
+    for i, record in enumerate(records):
+        result = {"image": record["image"], "error": errors[i]}
+        if i in position:
+            labels = {head: str(predictions[head][position[i]]) for head in models}
+            result.update(labels)
+            result["image_points"] = image_risk_points(labels)
+            try:
+                result.update(_risk_fields(record, result["image_points"]))
+            except ValueError as e:  # bad patient field: keep the image labels, report it on this row only
+                result["error"] = str(e)
+        results.append(result)
+    return results
+
+
+def _read_images(images, todo, errors):
+    """
+    Returns (readable indices of `todo`, sources) where sources[i] holds the
+    encoded bytes of each readable file path, read once; other inputs are kept.
+    """
+    sources = list(images)
+    readable = []
+    for i in todo:
+        if isinstance(images[i], str):
+            try:
+                with open(images[i], "rb") as f:
+                    sources[i] = f.read()
+            except OSError as e:
+                errors[i] = str(e)
+                continue
+        readable.append(i)
+    return readable, sources
+
+
+def _gate_images(images, todo, errors, gate):
+    """Drops the images `gate` rejects from `todo`; returns (passed, {i: decoded image})."""
+    passed = []
+    decoded = {}
+    for i in todo:
+        img = load_image(images[i])
+        if img is None:
+            errors[i] = "could not read image"
+            continue
+        report = gate(img)
+        if not report.ok:
+            errors[i] = f"rejected: {report.reason}"
+            continue
+        passed.append(i)
+        decoded[i] = img
+    return passed, decoded
+
+
+def embed_images(images, embedder=extract_embedding, cache=None, gate=None):
+    """
+    Returns ([embedding or None], [error or None]) for `images`. Cache hits skip
+    the embedder; the misses go to `embedder.embed_many` in one call when the
+    embedder is a worker pool, otherwise through `embedder` one by one. With a
+    quality_gate.QualityGate, every image is gated first (cached or not) and
+    rejected images are never embedded.
+
+    With a cache or a gate, each file is read once and its bytes serve the
+    cache key, the gate's decode and the embedder: worker pools get the bytes,
+    in-process embedders the decoded image.
+    """
+    embeddings = [None] * len(images)
+    errors = [None] * len(images)
+    keys = {}
+    todo = list(range(len(images)))
+    sources = images
+    decoded = {}
+    if cache is not None or gate is not None:
+        todo, sources = _read_images(images, todo, errors)
+    if gate is not None:
+        # Gated before the cache, which may hold embeddings from ungated runs.
+        todo, decoded = _gate_images(sources, todo, errors, gate)
+    if cache is not None:
+        misses = []
+        for i in todo:
+            keys[i], embeddings[i] = cache.lookup(sources[i])
+            if embeddings[i] is None:
+                misses.append(i)
+        todo = misses
+    if sources is not images and not hasattr(embedder, "embed_many"):
+        # In-process embedders get the decoded image instead of re-reading the file.
+        ready = []
+        for i in todo:
+            if i not in decoded:
+                decoded[i] = load_image(sources[i])
+            if decoded[i] is None:
+                errors[i] = "could not read image"
+            else:
+                ready.append(i)
+        todo = ready
+
+    with instrumentation.span("batch_embedding"):
+        if hasattr(embedder, "embed_many"):
+            results = embedder.embed_many([sources[i] for i in todo])
+        else:
+            results = [_safe_embed(embedder, decoded.get(i, sources[i])) for i in todo]
+    for i, (embedding, error) in zip(todo, results):
+        embeddings[i], errors[i] = embedding, error
+        if cache is not None and embedding is not None:
+            cache.put(keys[i], embedding)
+    return embeddings, errors
+
+
+def index_results(index, results, embeddings):
+    """Adds the successfully scored images of a chunk, with their labels, to a SimilarCaseIndex."""
+    rows = [i for i, result in enumerate(results) if embeddings[i] is not None and result.get("error") is None]
+    if rows:
+        cases = [{field: results[i][field] for field in ("image",) + HEADS + ("image_points",) if field in results[i]}
+                 for i in rows]
+        index.add(np.vstack([np.asarray(embeddings[i], dtype=np.float32) for i in rows]), cases)
+
+
+def score_chunk(records, models, embedder=extract_embedding, cache=None, gate=None, index=None):
+    """Embeds every image of the chunk, then classifies the stacked matrix once per head."""
+    embeddings = [None] * len(records)
+    errors = [record.get(MANIFEST_ERROR) for record in records]
+    usable = [i for i, error in enumerate(errors) if error is None]
+    for i, embedding, error in zip(usable, *embed_images([records[i]["image"] for i in usable], embedder, cache, gate)):
+        embeddings[i], errors[i] = embedding, error
+    results = score_embeddings(records, embeddings, errors, models)
+    if index is not None:
+        index_results(index, results, embeddings)
+    return results
+
+
+def score_records(records, models, chunk_size=256, embedder=extract_embedding, cache=None, gate=None, index=None):
+    """Generator over result dicts, one per input record, in input order."""
+    for chunk in iter_chunks(records, chunk_size):
+        yield from score_chunk(chunk, models, embedder, cache, gate, index)
+
+
+# ----------------------------
+# Output
+# ----------------------------
+class ResultWriter:
+    """Streams result rows as CSV or JSONL, flushing after each chunk."""
+
+    def __init__(self, f, fmt):
+        self.f = f
+        self.fmt = fmt
+        self.count = 0
+        if fmt == "csv":
+            self._csv = csv.DictWriter(f, fieldnames=RESULT_FIELDS, extrasaction="ignore")
+            self._csv.writeheader()
+
+    def write_rows(self, rows):
+        for row in rows:
+            if self.fmt == "csv":
+                self._csv.writerow(row)
+            else:
+                self.f.write(json.dumps({k: v for k, v in row.items() if v is not None}) + "\n")
+            self.count += 1
+        self.f.flush()
+
+
+def _output_format(output, fmt):
+    if fmt:
+        return fmt
+    return "jsonl" if output.lower().endswith((".jsonl", ".ndjson")) else "csv"
+
+
+def run(input_path, output, fmt=None, chunk_size=256, embedder=None, cache_dir=None, workers=0, quality_gate=False,
+        index_dir=None, pipelined=False, read_threads=8, prefetch=64):
+    models = model_registry.warm_up(embedding=workers == 0 and embedder is None)
+    if embedder is None and workers == 0:
+        embedder = model_registry.get_embedder()
+    cache = None
+    if cache_dir:
+        cache = EmbeddingCache(cache_dir, model_name=model_registry.embedding_model_id(), settings="original")
+    pool = None
+    if workers > 0:
+        pool = EmbeddingWorkerPool(workers)
+        embedder = pool
+    gate = None
+    if quality_gate:
+        from quality_gate import build_gate
+
+        gate = build_gate(model_registry.get_face_preprocessor(), shares_embedder=pool is None)
+    index = None
+    if index_dir:
+        from similar_cases import SimilarCaseIndex
+
+        index = SimilarCaseIndex(index_dir, model_name=model_registry.embedding_model_id())
+    fmt = _output_format(output, fmt)
+    f = sys.stdout if output == "-" else open(output, "w", newline="")
+    try:
+        writer = ResultWriter(f, fmt)
+        if pipelined:
+            from pipeline import Pipeline
+
+            stages = Pipeline(models, embedder, chunk_size, read_threads, embed_threads=workers or 1,
+                              prefetch=prefetch, cache=cache, gate=gate, index=index)
+            print(f"Pipeline: {json.dumps(stages.run(iter_records(input_path), writer))}", file=sys.stderr)
+        else:
+            for rows in iter_chunks(score_records(iter_records(input_path), models, chunk_size, embedder, cache, gate,
+                                                  index), chunk_size):
+                writer.write_rows(rows)
+    finally:
+        if f is not sys.stdout:
+            f.close()
+        if pool is not None:
+            pool.close()
+        if index is not None:
+            index.flush()
+        if cache is not None:
+            cache.flush()
+            print(f"Embedding cache: {json.dumps(cache.stats())}", file=sys.stderr)
+    return writer.count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch CVD image scoring over a directory or manifest.")
+    parser.add_argument("--input", required=True, help="Image directory, or .csv/.jsonl manifest with an 'image' column")
+    parser.add_argument("--output", default="-", help="Output .csv/.jsonl path (default: stdout)")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="Output format (default: from --output extension)")
+    parser.add_argument("--chunk-size", type=int, default=256, help="Images embedded before each classifier pass")
+    parser.add_argument("--cache-dir", help="Directory of the persistent embedding cache (disabled if omitted)")
+    parser.add_argument("--workers", type=int, default=0, help="Embedding worker processes (0: embed in this process)")
+    parser.add_argument("--quality-gate", action="store_true",
+                        help="Reject unusable photos (size, blur, exposure, no face) before embedding")
+    parser.add_argument("--index-dir", help="Also add every scored embedding to this similar-case index")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="Overlap reading/decoding, embedding and writing (for slow or network storage)")
+    parser.add_argument("--read-threads", type=int, default=8, help="Reader/decoder threads with --pipeline")
+    parser.add_argument("--prefetch", type=int, default=64, help="Decoded images buffered ahead of the embedder")
+    args = parser.parse_args()
+
+    count = run(args.input, args.output, args.format, args.chunk_size, cache_dir=args.cache_dir, workers=args.workers,
+                quality_gate=args.quality_gate, index_dir=args.index_dir, pipelined=args.pipeline,
+                read_threads=args.read_threads, prefetch=args.prefetch)
+    print(f"Scored {count} images.", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+Reproducible benchmarks for the image and risk pipelines.
+
+Times, separately, image decode/resize (load_and_preprocess_image), embedding
+extraction, scaler+classifier prediction for each head, and ASCVD risk scoring,
+over synthetic images and patients at several batch sizes and worker counts.
+Results are written as JSON with p50/p95/p99 latency and throughput per case.
+
+When the VGG-Face weights are not available (or with --stub) embeddings come
+from a deterministic random-projection stub, so the suite runs offline.
+
+    python benchmark.py --output bench.json
+    python benchmark.py --baseline bench_baseline.json --max-regression 0.25
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+import model_registry
+from ascvd import calculate_ascvd_risk
+from model_utils import classify_embeddings, load_and_preprocess_image
+
+EMBEDDING_DIM = 4096
+_STUB_SIDE = 32
+_stub_projection = None
+
+
+# ----------------------------
+# Stub embedding model
+# ----------------------------
+def stub_embedding(image):
+    """
+    Deterministic stand-in for VGG-Face: a fixed random projection of a 32x32
+    grayscale thumbnail to 4096 dims, L2-normalized. Same signature as
+    extract_embedding (path or BGR array).
+    """
+    global _stub_projection
+    if _stub_projection is None:
+        rng = np.random.default_rng(1234)
+        _stub_projection = rng.standard_normal((_STUB_SIDE * _STUB_SIDE, EMBEDDING_DIM)).astype(np.float32)
+    img = cv2.imread(image) if isinstance(image, str) else image
+    if img is None:
+        return None
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    thumb = cv2.resize(gray, (_STUB_SIDE, _STUB_SIDE), interpolation=cv2.INTER_AREA).astype(np.float32) / 255.0
+    embedding = thumb.reshape(-1) @ _stub_projection
+    return embedding / (np.linalg.norm(embedding) or 1.0)
+
+
+def vgg_face_available():
+    if model_registry.EMBEDDING_BACKEND != "deepface":
+        return True  # an exported backend brings its own model file
+    try:
+        import deepface  # noqa: F401
+    except ImportError:
+        return False
+    home = os.environ.get("DEEPFACE_HOME", os.path.expanduser("~"))
+    return os.path.exists(os.path.join(home, ".deepface", "weights", "vgg_face_weights.h5"))
+
+
+# ----------------------------
+# Synthetic inputs
+# ----------------------------
+def synthetic_images(directory, count, size=(1280, 960), seed=0):
+    """Writes `count` reproducible JPEGs of `size` (width, height); returns their paths."""
+    rng = np.random.default_rng(seed)
+    width, height = size
+    paths = []
+    for i in range(count):
+        # Smooth gradients plus noise compress like photos rather than like pure noise.
+        base = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+        img = base * rng.uniform(0.3, 1.0, size=(1, 1, 3)) + rng.normal(0, 12, size=(height, width, 3))
+        cv2.circle(img, (width // 2, height // 2), min(width, height) // 4, tuple(rng.uniform(0, 255, 3).tolist()), -1)
+        path = os.path.join(directory, f"synthetic_{i:04d}.jpg")
+        cv2.imwrite(path, np.clip(img, 0, 255).astype(np.uint8))
+        paths.append(path)
+    return paths
+
+
+def synthetic_patients(count, seed=0):
+    """Returns a list of calculate_ascvd_risk argument tuples with some missing values."""
+    rng = np.random.default_rng(seed)
+
+    def maybe(value, p_missing=0.05):
+        return None if rng.random() < p_missing else value
+
+    patients = []
+    for _ in range(count):
+        patients.append((
+            maybe(int(rng.integers(35, 85))),
+            maybe(str(rng.choice(["male", "female"]))),
+            maybe(float(rng.uniform(120, 320))),
+            maybe(float(rng.uniform(25, 90))),
+            maybe(float(rng.uniform(95, 200))),
+            maybe(bool(rng.random() < 0.4)),
+            maybe(bool(rng.random() < 0.2)),
+            maybe(bool(rng.random() < 0.15)),
+            maybe(float(rng.uniform(0, 4)), 0.7),
+            maybe(float(rng.uniform(0, 10)), 0.7),
+        ))
+    return patients
+
+
+# ----------------------------
+# Measurement
+# ----------------------------
+def summarize(latencies, items_per_call=1):
+    latencies = np.asarray(latencies, dtype=float)
+    total = latencies.sum()
+    return {
+        "calls": int(latencies.size),
+        "items_per_call": items_per_call,
+        "p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "p95_ms": float(np.percentile(latencies, 95) * 1000),
+        "p99_ms": float(np.percentile(latencies, 99) * 1000),
+        "mean_ms": float(latencies.mean() * 1000),
+        "throughput_per_s": float(latencies.size * items_per_call / total) if total > 0 else float("inf"),
+    }
+
+
+def time_calls(fn, args_list, warmup=1):
+    for args in args_list[:warmup]:
+        fn(*args)
+    latencies = []
+    for args in args_list:
+        start = time.perf_counter()
+        fn(*args)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def bench_decode(images, target_size):
+    return summarize(time_calls(load_and_preprocess_image, [(path, target_size) for path in images]))
+
+
+def bench_embedding(images, embedder):
+    return summarize(time_calls(embedder, [(path,) for path in images]))
+
+
+def bench_heads(models, embeddings, batch_sizes, repeats):
+    """Per-head timings for {head: (classifier, scaler)}; one "heads/compiled" case for CompiledHeads."""
+    if isinstance(models, dict):
+        cases = {head: {head: pair} for head, pair in models.items()}
+    else:
+        cases = {"compiled": models}
+    results = {}
+    for name, case_models in cases.items():
+        for batch_size in batch_sizes:
+            batches = [(embeddings[(i * batch_size) % len(embeddings):][:batch_size],) for i in range(repeats)]
+            batches = [(np.resize(b, (batch_size, embeddings.shape[1])),) for (b,) in batches]
+
+            def predict(batch):
+                return classify_embeddings(batch, case_models)
+
+            results[f"heads/{name}/batch_{batch_size}"] = summarize(time_calls(predict, batches), batch_size)
+    return results
+
+
+def bench_ascvd(patients, batch_sizes, repeats):
+    results = {"ascvd/scalar": summarize(time_calls(calculate_ascvd_risk, patients))}
+    try:
+        from ascvd_vectorized import calculate_ascvd_risk as calculate_ascvd_risk_many
+    except ImportError:
+        return results
+    for batch_size in batch_sizes:
+        calls = []
+        for i in range(repeats):
+            rows = [patients[(i * batch_size + j) % len(patients)] for j in range(batch_size)]
+            calls.append(tuple(np.array(column, dtype=object) for column in zip(*rows)))
+        results[f"ascvd/vectorized/batch_{batch_size}"] = summarize(time_calls(calculate_ascvd_risk_many, calls), batch_size)
+    return results
+
+
+def bench_workers(images, worker_counts, stub):
+    from workers import EmbeddingWorkerPool
+
+    results = {}
+    for n in worker_counts:
+        # One image per worker per call, so each latency is that of a full round on the pool.
+        batches = [([images[(i * n + j) % len(images)] for j in range(n)],)
+                   for i in range(max(1, len(images) // n))]
+        with EmbeddingWorkerPool(n, embedder=stub_embedding if stub else None) as pool:
+            pool.warm_up()
+            latencies = time_calls(pool.embed_many, batches)
+        results[f"workers/{n}"] = summarize(latencies, n)
+    return results
+
+
+def run_suite(args):
+    stub = args.stub or not vgg_face_available()
+    embedder = stub_embedding if stub else model_registry.get_embedder()
+    target_size = (args.target_size, args.target_size)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        images = synthetic_images(directory, args.images, (args.width, args.height), seed=args.seed)
+        results["decode_resize"] = bench_decode(images, target_size)
+        results["embedding"] = bench_embedding(images, embedder)
+        if args.max_workers > 1:
+            counts = sorted({1, *[n for n in (2, 4, 8, 16) if n < args.max_workers], args.max_workers})
+            results.update(bench_workers(images, counts, stub))
+
+        embeddings = np.vstack([np.asarray(embedder(path), dtype=np.float64) for path in images])
+
+    models = model_registry.get_models()
+    results.update(bench_heads(models, embeddings, args.batch_sizes, args.repeats))
+    results.update(bench_ascvd(synthetic_patients(args.patients, seed=args.seed), args.batch_sizes, args.repeats))
+
+    meta = {
+        "embedder": "stub" if stub else model_registry.embedding_model_id(),
+        "images": args.images,
+        "image_size": [args.width, args.height],
+        "target_size": list(target_size),
+        "patients": args.patients,
+        "batch_sizes": args.batch_sizes,
+        "seed": args.seed,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "cpu_count": os.cpu_count(),
+        "platform": platform.platform(),
+    }
+    return {"meta": meta, "results": results}
+
+
+# ----------------------------
+# Regression check
+# ----------------------------
+def compare_to_baseline(report, baseline, max_regression):
+    """Returns a list of human-readable regressions (p50 slower than baseline * (1 + max_regression))."""
+    regressions = []
+    for name, current in report["results"].items():
+        previous = baseline.get("results", {}).get(name)
+        if previous is None or previous["p50_ms"] <= 0:
+            continue
+        ratio = current["p50_ms"] / previous["p50_ms"]
+        if ratio > 1 + max_regression:
+            regressions.append(f"{name}: p50 {current['p50_ms']:.3f} ms vs baseline {previous['p50_ms']:.3f} ms (x{ratio:.2f})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the CVD image and risk pipelines.")
+    parser.add_argument("--output", default="-", help="JSON results path (default: stdout)")
+    parser.add_argument("--images", type=int, default=16, help="Number of synthetic images")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=960)
+    parser.add_argument("--target_size", type=int, default=224)
+    parser.add_argument("--patients", type=int, default=2000, help="Number of synthetic patients")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 64])
+    parser.add_argument("--repeats", type=int, default=20, help="Calls per batched case")
+    parser.add_argument("--max-workers", type=int, default=1, help="Also measure embedding worker pools up to N")
+    parser.add_argument("--stub", action="store_true", help="Use the stub embedding model even if VGG-Face is available")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", help="Baseline JSON to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.25,
+                        help="Allowed fractional p50 slowdown against the baseline (default 0.25)")
+    args = parser.parse_args()
+
+    report = run_suite(args)
+    text = json.dumps(report, indent=2)
+    if args.output == "-":
+        print(text)
+    else:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(report, baseline, args.max_regression)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+Compiled multi-head predictor.
+
+An offline "compile" step turns the four scaler/classifier pickle pairs into one
+compact NumPy artifact, and CompiledHeads scores every head for a batch of
+embeddings in a single vectorized call:
+
+  - linear heads (anything with coef_/intercept_) have the StandardScaler folded
+    into their weights and are stacked into one matrix multiply;
+  - tree heads (decision trees, random forests, extra-trees) are flattened into
+    array form; all trees of all heads are traversed together, level by level,
+    over the standardized features they actually split on.
+
+    python compiled_heads.py compile --output compiled_heads.npz
+    python compiled_heads.py compile --output compiled_heads/     (memory-mapped directory)
+    python compiled_heads.py check --artifact compiled_heads.npz
+
+An output path without the .npz suffix is written as a directory of .npy files
+plus manifest.json. Loading it memory-maps every array read-only, so it loads in
+milliseconds, never unpickles anything, and all worker processes on a host
+share the same physical pages through the OS page cache.
+
+The check compares labels against the original pickles. Tree heads match
+exactly: standardization and the float32 feature cast are applied in the same
+order as scikit-learn.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+ARTIFACT_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+_ROW_CHUNK = 256
+
+
+# ----------------------------
+# Compilation
+# ----------------------------
+def _scaler_params(scaler, n_features):
+    # StandardScaler keeps mean_ even with with_mean=False, but transform() does not subtract it.
+    mean = getattr(scaler, "mean_", None) if getattr(scaler, "with_mean", True) else None
+    scale = getattr(scaler, "scale_", None) if getattr(scaler, "with_std", True) else None
+    mean = np.zeros(n_features) if mean is None else np.asarray(mean, dtype=np.float64)
+    scale = np.ones(n_features) if scale is None else np.asarray(scale, dtype=np.float64)
+    return mean, scale
+
+
+def _tree_estimators(classifier):
+    if hasattr(classifier, "estimators_"):
+        return list(classifier.estimators_)
+    if hasattr(classifier, "tree_"):
+        return [classifier]
+    return None
+
+
+def compile_heads(models):
+    """
+    Compiles {head: (classifier, scaler)} into the arrays of a CompiledHeads.
+    Raises ValueError for classifiers that are neither linear nor tree-based.
+    """
+    heads = list(models)
+    n_features = None
+    arrays = {}
+    manifest = {"version": ARTIFACT_VERSION, "heads": {}}
+
+    linear_weights, linear_biases = [], []
+    tree_feature, tree_threshold, tree_left, tree_right, tree_value = [], [], [], [], []
+    roots, tree_head = [], []
+    column_of = {}  # (head index, raw feature) -> column of the standardized feature matrix
+    node_offset = 0
+    max_depth = 0
+    n_classes_max = max(len(classifier.classes_) for classifier, _ in models.values())
+
+    for h, head in enumerate(heads):
+        classifier, scaler = models[head]
+        head_features = getattr(classifier, "n_features_in_", None)
+        if n_features is None:
+            n_features = head_features
+        elif head_features != n_features:
+            raise ValueError(f"{head}: expects {head_features} features, other heads expect {n_features}")
+        mean, scale = _scaler_params(scaler, n_features)
+        classes = np.asarray(classifier.classes_)
+        arrays[f"classes/{head}"] = classes.astype(str) if classes.dtype == object else classes
+        entry = {"n_classes": len(classifier.classes_)}
+
+        estimators = _tree_estimators(classifier)
+        if hasattr(classifier, "coef_") and hasattr(classifier, "intercept_"):
+            coef = np.atleast_2d(np.asarray(classifier.coef_, dtype=np.float64))
+            intercept = np.atleast_1d(np.asarray(classifier.intercept_, dtype=np.float64))
+            # w . (x - mean) / scale + b  ==  (w / scale) . x + (b - w . mean / scale)
+            weight = coef / scale
+            entry.update(kind="linear", column=sum(w.shape[0] for w in linear_weights), outputs=coef.shape[0])
+            linear_weights.append(weight)
+            linear_biases.append(intercept - weight @ mean)
+        elif estimators is not None:
+            first_tree = len(roots)
+            for estimator in estimators:
+                tree = estimator.tree_
+                leaf = tree.children_left < 0
+                columns = np.full(tree.node_count, -1, dtype=np.int32)
+                for node in np.flatnonzero(~leaf):
+                    key = (h, int(tree.feature[node]))
+                    if key not in column_of:
+                        column_of[key] = len(column_of)
+                    columns[node] = column_of[key]
+                value = tree.value[:, 0, :].astype(np.float64)
+                value = value / np.maximum(value.sum(axis=1, keepdims=True), 1e-300)
+                padded = np.zeros((tree.node_count, n_classes_max))
+                padded[:, :value.shape[1]] = value
+
+                tree_feature.append(columns)
+                tree_threshold.append(tree.threshold.astype(np.float64))
+                tree_left.append(np.where(leaf, -1, tree.children_left + node_offset).astype(np.int32))
+                tree_right.append(np.where(leaf, -1, tree.children_right + node_offset).astype(np.int32))
+                tree_value.append(padded)
+                roots.append(node_offset)
+                tree_head.append(h)
+                node_offset += tree.node_count
+                max_depth = max(max_depth, int(tree.max_depth))
+            entry.update(kind="trees", first_tree=first_tree, n_trees=len(roots) - first_tree)
+        else:
+            raise ValueError(f"{head}: cannot compile {type(classifier).__name__} (not linear or tree-based)")
+        manifest["heads"][head] = entry
+
+    columns = sorted(column_of.items(), key=lambda item: item[1])
+    column_mean = np.empty(len(columns))
+    column_scale = np.empty(len(columns))
+    column_feature = np.empty(len(columns), dtype=np.int32)
+    for (h, feature), column in columns:
+        mean, scale = _scaler_params(models[heads[h]][1], n_features)
+        column_feature[column] = feature
+        column_mean[column] = mean[feature]
+        column_scale[column] = scale[feature]
+
+    manifest.update(head_order=heads, n_features=int(n_features), max_depth=max_depth, n_classes_max=n_classes_max)
+    arrays.update(
+        linear_weight=(np.vstack(linear_weights).T if linear_weights else np.zeros((n_features, 0))),
+        linear_bias=(np.concatenate(linear_biases) if linear_biases else np.zeros(0)),
+        tree_feature=(np.concatenate(tree_feature) if tree_feature else np.zeros(0, dtype=np.int32)),
+        tree_threshold=(np.concatenate(tree_threshold) if tree_threshold else np.zeros(0)),
+        tree_left=(np.concatenate(tree_left) if tree_left else np.zeros(0, dtype=np.int32)),
+        tree_right=(np.concatenate(tree_right) if tree_right else np.zeros(0, dtype=np.int32)),
+        tree_value=(np.concatenate(tree_value) if tree_value else np.zeros((0, n_classes_max))),
+        tree_roots=np.asarray(roots, dtype=np.int32),
+        tree_head=np.asarray(tree_head, dtype=np.int32),
+        column_feature=column_feature,
+        column_mean=column_mean,
+        column_scale=column_scale,
+    )
+    return CompiledHeads(manifest, arrays)
+
+
+# ----------------------------
+# Runtime
+# ----------------------------
+class CompiledHeads:
+    """
+    All heads as one predictor. Iterating yields the head names, so it can be
+    passed wherever a {head: (classifier, scaler)} dict is expected by
+    model_utils.classify_embeddings.
+    """
+
+    def __init__(self, manifest, arrays):
+        self.manifest = manifest
+        self.arrays = arrays
+        self.heads = list(manifest["head_order"])
+        self.classes = {head: arrays[f"classes/{head}"] for head in self.heads}
+        a = arrays
+        self._linear_weight, self._linear_bias = a["linear_weight"], a["linear_bias"]
+        self._feature, self._threshold = a["tree_feature"], a["tree_threshold"]
+        self._left, self._right, self._value = a["tree_left"], a["tree_right"], a["tree_value"]
+        self._roots = a["tree_roots"]
+        self._column_feature, self._column_mean, self._column_scale = (
+            a["column_feature"], a["column_mean"], a["column_scale"])
+
+    def __iter__(self):
+        return iter(self.heads)
+
+    def __len__(self):
+        return len(self.heads)
+
+    def __contains__(self, head):
+        return head in self.heads
+
+    # Persistence
+    def save(self, path):
+        np.savez(path, manifest=np.array(json.dumps(self.manifest)), **self.arrays)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Loads an .npz artifact, or a directory artifact (memory-mapped unless mmap=False)."""
+        if os.path.isdir(path):
+            return cls.load_dir(path, mmap)
+        with np.load(path, allow_pickle=False) as data:
+            manifest = json.loads(str(data["manifest"]))
+            arrays = {key: data[key] for key in data.files if key != "manifest"}
+        return cls(manifest, arrays)
+
+    def save_dir(self, directory):
+        """Writes one .npy file per array plus manifest.json, which maps array names to files."""
+        os.makedirs(directory, exist_ok=True)
+        files = {}
+        for key, array in self.arrays.items():
+            files[key] = key.replace("/", "__") + ".npy"
+            np.save(os.path.join(directory, files[key]), np.ascontiguousarray(array), allow_pickle=False)
+        with open(os.path.join(directory, MANIFEST_NAME), "w") as f:
+            json.dump(dict(self.manifest, files=files), f, indent=2)
+
+    @classmethod
+    def load_dir(cls, directory, mmap=True):
+        """Loads a directory artifact; with mmap the arrays are read-only views of the files."""
+        with open(os.path.join(directory, MANIFEST_NAME)) as f:
+            manifest = json.load(f)
+        files = manifest.pop("files")
+        arrays = {key: np.load(os.path.join(directory, name), mmap_mode="r" if mmap else None, allow_pickle=False)
+                  for key, name in files.items()}
+        return cls(manifest, arrays)
+
+    def save_artifact(self, path):
+        """Saves as .npz when `path` ends in .npz, otherwise as a memory-mappable directory."""
+        if path.endswith(".npz"):
+            self.save(path)
+        else:
+            self.save_dir(path)
+
+    # Scoring
+    def _tree_leaves(self, X):
+        """Leaf node reached in every tree, shape (n_rows, n_trees)."""
+        # Standardize only the features the trees split on; float64 then float32,
+        # exactly like StandardScaler.transform followed by the tree's input cast.
+        # Columns are gathered as contiguous rows of X.T, which is much cheaper than a column gather.
+        Xt = np.ascontiguousarray(X.T)[self._column_feature]
+        Xc = ((Xt - self._column_mean[:, None]) / self._column_scale[:, None]).astype(np.float32)
+        n_rows, n_trees = X.shape[0], self._roots.size
+        nodes = np.tile(self._roots, n_rows)
+        row_of = np.repeat(np.arange(n_rows), n_trees)
+        # Advance every (row, tree) path one level per pass, dropping paths that reached a leaf.
+        active = np.flatnonzero(self._feature[nodes] >= 0)
+        while active.size:
+            current = nodes[active]
+            x = Xc[self._feature[current], row_of[active]]
+            following = np.where(x <= self._threshold[current], self._left[current], self._right[current])
+            nodes[active] = following
+            active = active[self._feature[following] >= 0]
+        return nodes.reshape(n_rows, n_trees)
+
+    def predict_proba(self, embeddings):
+        """{head: (n, n_classes) probabilities, or decision values for linear heads}."""
+        X = np.atleast_2d(np.asarray(embeddings, dtype=np.float64))
+        out = {head: [] for head in self.heads}
+        for start in range(0, X.shape[0], _ROW_CHUNK):
+            chunk = X[start:start + _ROW_CHUNK]
+            linear = chunk @ self._linear_weight + self._linear_bias if self._linear_bias.size else None
+            leaves = self._tree_leaves(chunk) if self._roots.size else None
+            for head in self.heads:
+                entry = self.manifest["heads"][head]
+                if entry["kind"] == "linear":
+                    out[head].append(linear[:, entry["column"]:entry["column"] + entry["outputs"]])
+                else:
+                    trees = leaves[:, entry["first_tree"]:entry["first_tree"] + entry["n_trees"]]
+                    proba = np.zeros((chunk.shape[0], self.manifest["n_classes_max"]))
+                    for t in range(trees.shape[1]):  # accumulate in tree order, as scikit-learn does
+                        proba += self._value[trees[:, t]]
+                    out[head].append(proba[:, :entry["n_classes"]] / entry["n_trees"])
+        return {head: np.vstack(parts) for head, parts in out.items()}
+
+    def predict(self, embeddings):
+        """{head: array of labels} for a (n, n_features) embedding matrix."""
+        labels = {}
+        for head, scores in self.predict_proba(embeddings).items():
+            entry = self.manifest["heads"][head]
+            classes = self.classes[head]
+            if entry["kind"] == "linear" and scores.shape[1] == 1:
+                labels[head] = classes[(scores[:, 0] > 0).astype(int)]
+            else:
+                labels[head] = classes[np.argmax(scores, axis=1)]
+        return labels
+
+
+# ----------------------------
+# Parity check
+# ----------------------------
+def check_parity(compiled, models, samples=512, seed=0):
+    """
+    Scores synthetic embeddings drawn around each scaler's mean with both the
+    compiled artifact and the original pickles. Returns {head: agreement rate}.
+    """
+    from model_utils import classify_embeddings
+
+    rng = np.random.default_rng(seed)
+    _, scaler = next(iter(models.values()))
+    mean, scale = _scaler_params(scaler, compiled.manifest["n_features"])
+    X = mean + scale * rng.standard_normal((samples, mean.size))
+
+    start = time.perf_counter()
+    reference, _ = classify_embeddings(X, models)
+    reference_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    predicted = compiled.predict(X)
+    compiled_seconds = time.perf_counter() - start
+
+    agreement = {head: float(np.mean(predicted[head] == reference[head])) for head in compiled.heads}
+    print(f"pickles {reference_seconds * 1000:.1f} ms, compiled {compiled_seconds * 1000:.1f} ms for {samples} embeddings")
+    for head, rate in agreement.items():
+        print(f"{head}: {rate:.2%} agreement")
+    return agreement
+
+
+def main():
+    import model_registry
+
+    parser = argparse.ArgumentParser(description="Compile the scaler/classifier pickles into one stacked predictor.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    compile_parser = sub.add_parser("compile", help="Write the compiled artifact")
+    compile_parser.add_argument("--output", default="compiled_heads.npz",
+                                help="An .npz file, or a directory for the memory-mapped format")
+    compile_parser.add_argument("--model-dir", default=None, help="Directory holding the pickles")
+    check_parser = sub.add_parser("check", help="Compare a compiled artifact with the pickles")
+    check_parser.add_argument("--artifact", default="compiled_heads.npz", help="An .npz file or artifact directory")
+    check_parser.add_argument("--model-dir", default=None)
+    check_parser.add_argument("--samples", type=int, default=512)
+    args = parser.parse_args()
+
+    models = model_registry.load_pickled_models(args.model_dir)
+    if args.command == "compile":
+        compiled = compile_heads(models)
+        compiled.save_artifact(args.output)
+        print(f"Wrote {args.output}: " + ", ".join(
+            f"{head} ({entry['kind']})" for head, entry in compiled.manifest["heads"].items()))
+        agreement = check_parity(compiled, models)
+    else:
+        agreement = check_parity(CompiledHeads.load(args.artifact), models, args.samples)
+    sys.exit(0 if all(rate == 1.0 for rate in agreement.values()) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+Pluggable embedding backends.
+
+Every backend is a callable with the signature of model_utils.extract_embedding
+(file path or decoded BGR array in, 4096-dim embedding or None out):
+
+    deepface      TensorFlow VGG-Face through DeepFace.represent (the reference)
+    onnx          the same network exported to ONNX, run with ONNX Runtime
+    onnx-int8     ONNX export with dynamically int8-quantized weights
+    tflite        the same network converted to TensorFlow Lite
+    tflite-int8   TFLite with dynamic-range int8 quantization
+
+The exported backends reuse DeepFace's face detection, alignment and resizing,
+so only the forward pass changes. The backend is chosen with
+CVD_EMBEDDING_BACKEND (default "deepface"); exported models are read from
+CVD_EMBEDDING_MODEL_PATH or the default file name below, next to the pickles.
+
+    python embedding_backends.py export --backend onnx-int8
+    python embedding_backends.py drift --backend onnx-int8 --images photos/
+
+The ONNX backends need onnxruntime (and tf2onnx to export); the TFLite backends
+run on tflite-runtime or TensorFlow. They are optional and not in requirements.txt.
+"""
+
+import abc
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+BACKENDS = ("deepface", "onnx", "onnx-int8", "tflite", "tflite-int8")
+DEFAULT_MODEL_FILES = {
+    "onnx": "vgg_face.onnx",
+    "onnx-int8": "vgg_face_int8.onnx",
+    "tflite": "vgg_face.tflite",
+    "tflite-int8": "vgg_face_int8.tflite",
+}
+MODEL_NAME = "VGG-Face"
+TARGET_SIZE = (224, 224)
+
+
+def _default_model_path(name):
+    import model_registry
+
+    return os.path.join(model_registry.MODEL_DIR, DEFAULT_MODEL_FILES[name])
+
+
+def prepare_face_input(image, detector_backend="opencv", align=True):
+    """
+    The (1, 224, 224, 3) float32 network input DeepFace.represent would build for
+    `image` with enforce_detection=False: detected/aligned face, BGR->RGB,
+    padded resize to 224x224. Returns None if nothing could be extracted.
+    """
+    from deepface.modules import detection
+
+    faces = detection.extract_faces(img_path=image, detector_backend=detector_backend, grayscale=False,
+                                    enforce_detection=False, align=align)
+    if not faces:
+        return None
+    return face_to_input(faces[0]["face"])
+
+
+def face_to_input(face):
+    """Network input for an aligned face as returned by extract_faces (or a face_preprocessing.FaceCrop)."""
+    from deepface.modules import preprocessing
+
+    face = face[:, :, ::-1]
+    face = preprocessing.resize_image(img=face, target_size=(TARGET_SIZE[1], TARGET_SIZE[0]))
+    face = preprocessing.normalize_input(img=face, normalization="base")
+    return np.asarray(face, dtype=np.float32)
+
+
+def _l2_normalize(embedding):
+    embedding = np.asarray(embedding, dtype=np.float32).reshape(-1)
+    norm = np.linalg.norm(embedding)
+    return embedding / norm if norm > 0 else embedding
+
+
+class EmbeddingBackend(abc.ABC):
+    name = None
+
+    @abc.abstractmethod
+    def embed(self, image):
+        """Embeds a file path or decoded BGR array (detection and alignment included)."""
+
+    @abc.abstractmethod
+    def embed_face(self, face):
+        """Embeds an already detected and aligned face (see face_preprocessing)."""
+
+    def __call__(self, image):
+        return self.embed(image)
+
+
+class DeepFaceBackend(EmbeddingBackend):
+    """The TensorFlow reference: model_utils.extract_embedding."""
+
+    name = "deepface"
+
+    def embed(self, image):
+        from model_utils import extract_embedding
+
+        return extract_embedding(image)
+
+    def embed_face(self, face):
+        from face_preprocessing import embed_face
+
+        return embed_face(face)
+
+
+class OnnxBackend(EmbeddingBackend):
+    def __init__(self, model_path, name="onnx", threads=None):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        self.name = name
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def _forward(self, face):
+        output = self.session.run(None, {self.input_name: face})[0]
+        return _l2_normalize(output[0])
+
+    def embed(self, image):
+        face = prepare_face_input(image)
+        return None if face is None else self._forward(face)
+
+    def embed_face(self, face):
+        return self._forward(face_to_input(face))
+
+
+class TFLiteBackend(EmbeddingBackend):
+    def __init__(self, model_path, name="tflite", threads=None):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            from tensorflow.lite import Interpreter
+
+        self.name = name
+        self.interpreter = Interpreter(model_path=model_path, num_threads=threads)
+        self.interpreter.allocate_tensors()
+        self.input_index = self.interpreter.get_input_details()[0]["index"]
+        self.output_index = self.interpreter.get_output_details()[0]["index"]
+
+    def _forward(self, face):
+        self.interpreter.set_tensor(self.input_index, face)
+        self.interpreter.invoke()
+        return _l2_normalize(self.interpreter.get_tensor(self.output_index)[0])
+
+    def embed(self, image):
+        face = prepare_face_input(image)
+        return None if face is None else self._forward(face)
+
+    def embed_face(self, face):
+        return self._forward(face_to_input(face))
+
+
+def get_backend(name=None, model_path=None, threads=None):
+    """
+    Builds the backend named by `name` or CVD_EMBEDDING_BACKEND (default "deepface").
+    `threads` caps the intra-op threads of the exported backends (e.g. one per
+    worker process); None leaves the runtime's default of one per core.
+    """
+    name = name or os.environ.get("CVD_EMBEDDING_BACKEND", "deepface")
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend {name!r} (expected one of {', '.join(BACKENDS)})")
+    if name == "deepface":
+        return DeepFaceBackend()
+    model_path = model_path or os.environ.get("CVD_EMBEDDING_MODEL_PATH") or _default_model_path(name)
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(f"{model_path} not found; create it with: python embedding_backends.py export --backend {name}")
+    if name.startswith("onnx"):
+        return OnnxBackend(model_path, name, threads)
+    return TFLiteBackend(model_path, name, threads)
+
+
+# ----------------------------
+# Export
+# ----------------------------
+def _keras_model():
+    import model_registry
+
+    return model_registry.get_embedding_model().model
+
+
+def export(name, output=None):
+    """Exports the DeepFace VGG-Face network for backend `name`; returns the written path."""
+    output = output or _default_model_path(name)
+    model = _keras_model()
+    if name.startswith("onnx"):
+        import tensorflow as tf
+        import tf2onnx
+
+        signature = (tf.TensorSpec((None,) + TARGET_SIZE + (3,), tf.float32, name="input"),)
+        float_path = output if name == "onnx" else output + ".float.onnx"
+        tf2onnx.convert.from_keras(model, input_signature=signature, output_path=float_path)
+        if name == "onnx-int8":
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+
+            quantize_dynamic(float_path, output, weight_type=QuantType.QInt8)
+            os.remove(float_path)
+    elif name.startswith("tflite"):
+        import tensorflow as tf
+
+        converter = tf.lite.TFLiteConverter.from_keras_model(model)
+        if name == "tflite-int8":
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]  # dynamic-range int8 weights
+        with open(output, "wb") as f:
+            f.write(converter.convert())
+    else:
+        raise ValueError(f"Nothing to export for backend {name!r}")
+    return output
+
+
+# ----------------------------
+# Accuracy drift
+# ----------------------------
+def measure_drift(images, candidate, reference=None, models=None):
+    """
+    Embeds every image with the reference (TensorFlow) backend and `candidate`
+    and reports embedding cosine similarity, per-head label agreement of the
+    four classifiers and mean latency of both backends.
+    """
+    import model_registry
+    from model_utils import classify_embeddings
+
+    reference = reference or DeepFaceBackend()
+    models = models or model_registry.get_models()
+    pairs = []
+    seconds = {"reference": 0.0, "candidate": 0.0}
+    for image in images:
+        start = time.perf_counter()
+        expected = reference(image)
+        seconds["reference"] += time.perf_counter() - start
+        start = time.perf_counter()
+        actual = candidate(image)
+        seconds["candidate"] += time.perf_counter() - start
+        if expected is not None and actual is not None:
+            pairs.append((np.asarray(expected, dtype=np.float64), np.asarray(actual, dtype=np.float64)))
+    if not pairs:
+        return {"images": len(images), "compared": 0}
+
+    expected = np.vstack([e for e, _ in pairs])
+    actual = np.vstack([a for _, a in pairs])
+    cosine = np.sum(expected * actual, axis=1) / (
+        np.linalg.norm(expected, axis=1) * np.linalg.norm(actual, axis=1))
+    expected_labels, _ = classify_embeddings(expected, models)
+    actual_labels, _ = classify_embeddings(actual, models)
+    return {
+        "backend": candidate.name,
+        "images": len(images),
+        "compared": len(pairs),
+        "cosine_min": float(cosine.min()),
+        "cosine_mean": float(cosine.mean()),
+        "label_agreement": {head: float(np.mean(expected_labels[head] == actual_labels[head])) for head in expected_labels},
+        "reference_ms_per_image": seconds["reference"] * 1000 / len(images),
+        "candidate_ms_per_image": seconds["candidate"] * 1000 / len(images),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export and evaluate alternative VGG-Face embedding backends.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export_parser = sub.add_parser("export", help="Export the VGG-Face network for a backend")
+    export_parser.add_argument("--backend", choices=BACKENDS[1:], required=True)
+    export_parser.add_argument("--output", default=None)
+    drift_parser = sub.add_parser("drift", help="Compare a backend's outputs with the TensorFlow reference")
+    drift_parser.add_argument("--backend", choices=BACKENDS[1:], required=True)
+    drift_parser.add_argument("--model-path", default=None)
+    drift_parser.add_argument("--images", required=True, help="Image directory or .csv/.jsonl manifest")
+    drift_parser.add_argument("--min-agreement", type=float, default=None,
+                              help="Exit non-zero if any head agrees on fewer than this fraction of images")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        print(f"Wrote {export(args.backend, args.output)}")
+        return
+
+    from batch import MANIFEST_ERROR, iter_records
+
+    images = [record["image"] for record in iter_records(args.images) if MANIFEST_ERROR not in record]
+    report = measure_drift(images, get_backend(args.backend, args.model_path))
+    print(json.dumps(report, indent=2))
+    if args.min_agreement is not None and any(
+            rate < args.min_agreement for rate in report.get("label_agreement", {}).values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+# embedding_cache.py
+"""
+Content-addressed on-disk cache of face embeddings.
+
+Embeddings are keyed by a SHA-256 of the image bytes together with the
+embedding model name and preprocessing settings, and stored as rows of a
+memory-mapped float32 matrix (embeddings.f32) with a small JSON index that
+maps keys to rows in least-recently-used order. When the cache is full the
+least recently used row is overwritten. A hash of each row's key is stored next
+to it (keys.bin) and checked on every read, so an index flushed before a row
+was reused can never hand out another image's embedding.
+
+The cache is meant for a single writing process; concurrent readers of the
+same directory only see entries flushed before they opened it.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+DEFAULT_DIM = 4096
+_INDEX_FILE = "index.json"
+_DATA_FILE = "embeddings.f32"
+_KEYS_FILE = "keys.bin"
+_KEY_HASH_BYTES = 16
+
+
+def _key_hash(key):
+    return np.frombuffer(hashlib.blake2b(key.encode(), digest_size=_KEY_HASH_BYTES).digest(), dtype=np.uint8)
+
+
+def _input_size(image):
+    """Size of the input whose decode and forward pass a cache hit skipped."""
+    if isinstance(image, np.ndarray):
+        return image.nbytes
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return len(image)
+    return os.path.getsize(image)
+
+
+class EmbeddingCache:
+    def __init__(self, directory, model_name="VGG-Face", settings="", dim=DEFAULT_DIM,
+                 max_entries=None, max_bytes=512 * 1024 * 1024):
+        self.directory = directory
+        self.model_name = model_name
+        self.settings = settings
+        self.dim = dim
+        row_bytes = dim * np.dtype(np.float32).itemsize
+        self.max_entries = max_entries or max(1, max_bytes // row_bytes)
+
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+        self._lock = threading.Lock()
+        self._slots = OrderedDict()  # key -> row, least recently used first
+        self._free = []
+        self._capacity = 0
+        self._data = None
+        self._keys = None  # (capacity, _KEY_HASH_BYTES) hash of the key each row was written for
+        self._dirty = False
+
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    # ----------------------------
+    # Keys
+    # ----------------------------
+    def key_for_bytes(self, data):
+        h = hashlib.sha256()
+        h.update(f"{self.model_name}|{self.settings}|".encode())
+        h.update(data)
+        return h.hexdigest()
+
+    def key_for(self, image):
+        """Key for a file path, raw encoded bytes or a decoded NumPy image."""
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            return self.key_for_bytes(bytes(image))
+        if isinstance(image, np.ndarray):
+            header = f"{image.shape}|{image.dtype}|".encode()
+            return self.key_for_bytes(header + np.ascontiguousarray(image).tobytes())
+        with open(image, "rb") as f:
+            return self.key_for_bytes(f.read())
+
+    # ----------------------------
+    # Storage
+    # ----------------------------
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _load(self):
+        index_path = self._path(_INDEX_FILE)
+        if not os.path.exists(index_path):
+            return
+        with open(index_path) as f:
+            index = json.load(f)
+        if index.get("dim") != self.dim or not os.path.exists(self._path(_KEYS_FILE)):
+            # Written for a different model (or without row keys); start over rather than mix embeddings.
+            return
+        self._capacity = index["capacity"]
+        self._data = np.memmap(self._path(_DATA_FILE), dtype=np.float32, mode="r+",
+                               shape=(self._capacity, self.dim))
+        self._keys = np.memmap(self._path(_KEYS_FILE), dtype=np.uint8, mode="r+",
+                               shape=(self._capacity, _KEY_HASH_BYTES))
+        for key, row in index["entries"]:
+            self._slots[key] = row
+        # A smaller max_entries than the one the cache was written with evicts the oldest rows.
+        while len(self._slots) > self.max_entries:
+            self._slots.popitem(last=False)
+        if self._capacity > self.max_entries:
+            self._shrink()
+        used = set(self._slots.values())
+        self._free = [row for row in range(self._capacity) if row not in used]
+
+    def _map(self, name, dtype, shape, old):
+        path = self._path(name)
+        if old is None:
+            return np.memmap(path, dtype=dtype, mode="w+", shape=shape)
+        # Resize the backing file before remapping it with the new shape.
+        old.flush()
+        with open(path, "r+b") as f:
+            f.truncate(int(np.prod(shape)) * np.dtype(dtype).itemsize)
+        return np.memmap(path, dtype=dtype, mode="r+", shape=shape)
+
+    def _resize(self, capacity):
+        data, keys = self._data, self._keys
+        self._data = self._keys = None
+        self._data = self._map(_DATA_FILE, np.float32, (capacity, self.dim), data)
+        self._keys = self._map(_KEYS_FILE, np.uint8, (capacity, _KEY_HASH_BYTES), keys)
+        self._capacity = capacity
+
+    def _grow(self):
+        capacity = min(self.max_entries, max(64, self._capacity * 2))
+        self._free.extend(range(capacity - 1, self._capacity - 1, -1))
+        self._resize(capacity)
+
+    def _shrink(self):
+        """Moves the surviving rows below max_entries, cuts the files to that size and rewrites the index."""
+        capacity = self.max_entries
+        used = {row for row in self._slots.values() if row < capacity}
+        free = [row for row in range(capacity) if row not in used]
+        for key, row in self._slots.items():
+            if row >= capacity:
+                new_row = free.pop()
+                self._data[new_row] = self._data[row]
+                self._keys[new_row] = self._keys[row]
+                self._slots[key] = new_row
+        self._resize(capacity)
+        self._dirty = True
+        self.flush()
+
+    def _allocate_row(self):
+        if not self._free and self._capacity < self.max_entries:
+            self._grow()
+        if self._free:
+            return self._free.pop()
+        _, row = self._slots.popitem(last=False)  # evict least recently used
+        return row
+
+    def flush(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            self._data.flush()
+            self._keys.flush()
+            index = {
+                "model_name": self.model_name,
+                "settings": self.settings,
+                "dim": self.dim,
+                "capacity": self._capacity,
+                "entries": list(self._slots.items()),
+            }
+            tmp_path = self._path(_INDEX_FILE + ".tmp")
+            with open(tmp_path, "w") as f:
+                json.dump(index, f)
+            os.replace(tmp_path, self._path(_INDEX_FILE))
+            self._dirty = False
+
+    close = flush
+
+    # ----------------------------
+    # Lookup
+    # ----------------------------
+    def __len__(self):
+        return len(self._slots)
+
+    def _get(self, key):
+        row = self._slots.get(key)
+        if row is None:
+            return None
+        if not np.array_equal(self._keys[row], _key_hash(key)):
+            # The row was reused for another key after the index was last flushed.
+            del self._slots[key]
+            self._free.append(row)
+            self._dirty = True
+            return None
+        self._slots.move_to_end(key)
+        self._dirty = True
+        return np.array(self._data[row])
+
+    def get(self, key):
+        with self._lock:
+            return self._get(key)
+
+    def put(self, key, embedding):
+        embedding = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        if embedding.shape[0] != self.dim:
+            raise ValueError(f"Expected a {self.dim}-dim embedding, got {embedding.shape[0]}")
+        with self._lock:
+            row = self._slots.get(key)
+            if row is None:
+                row = self._allocate_row()
+            self._keys[row] = 0  # never pairs a half-written row with either key
+            self._data[row] = embedding
+            self._keys[row] = _key_hash(key)
+            self._slots[key] = row
+            self._slots.move_to_end(key)
+            self._dirty = True
+
+    def lookup(self, image):
+        """Returns (key, embedding or None) and records the hit or miss."""
+        key = self.key_for(image)
+        with self._lock:
+            embedding = self._get(key)
+            if embedding is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if embedding is not None:
+            size = _input_size(image)
+            with self._lock:
+                self.bytes_saved += size
+        return key, embedding
+
+    def stats(self):
+        with self._lock:
+            entries, hits, misses, bytes_saved = len(self._slots), self.hits, self.misses, self.bytes_saved
+        lookups = hits + misses
+        return {
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "bytes_saved": bytes_saved,
+        }
@@ -0,0 +1,178 @@
+# face_preprocessing.py
+"""
+Shared, resolution-aware face preprocessing.
+
+DeepFace.represent runs face detection on whatever it is given, so 12 MP phone
+photos were detected at full resolution, and every consumer (embedding, quality
+gate, video sampling) paid for detection separately. FacePreprocessor is the
+single stage in front of all of them:
+
+  1. downscale the decoded image so its longer side is at most
+     CVD_WORKING_SIZE pixels (default 640; 0 keeps the original resolution);
+  2. detect and align the face once with CVD_DETECTOR_BACKEND (any DeepFace
+     detector: opencv, ssd, mtcnn, retinaface, ...; default "opencv", as
+     DeepFace.represent uses);
+  3. keep the aligned crop in a small in-memory LRU keyed by the downscaled
+     pixels, so later consumers of the same image get it for free.
+
+FaceEmbedder embeds the crop with detection skipped. The crop is handed over
+exactly as DeepFace.extract_faces returns it (RGB, scaled to [0, 1]), which
+makes the network input identical to a detecting represent() call on the
+downscaled image. Detection and downscaling are reported as instrumentation
+spans ("downscale", "face_detection/<backend>") and in FacePreprocessor.stats().
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+import instrumentation
+from model_utils import load_image
+
+WORKING_SIZE = int(os.environ.get("CVD_WORKING_SIZE", "640"))
+DETECTOR_BACKEND = os.environ.get("CVD_DETECTOR_BACKEND", "opencv")
+
+
+class FaceCrop:
+    """
+    An aligned face: `face` as returned by DeepFace.extract_faces (RGB float in
+    [0, 1]), its `facial_area` (x, y, w, h) in original-image pixels and the
+    detector `confidence` (0 when no face was found and the whole image is used).
+    """
+
+    def __init__(self, face, facial_area, confidence):
+        self.face = face
+        self.facial_area = facial_area
+        self.confidence = confidence
+
+    @property
+    def detected(self):
+        return self.confidence > 0
+
+
+def downscale(img, working_size=WORKING_SIZE):
+    """Returns (image, scale) with the longer side at most `working_size` (0: unchanged)."""
+    longest = max(img.shape[:2])
+    if not working_size or longest <= working_size:
+        return img, 1.0
+    scale = working_size / longest
+    return cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA), scale
+
+
+class FacePreprocessor:
+    """
+    Downscale, detect and align once per image; callable with a file path,
+    encoded bytes or a decoded BGR array. Returns a FaceCrop, or None when the
+    image cannot be read.
+    """
+
+    def __init__(self, working_size=WORKING_SIZE, detector_backend=DETECTOR_BACKEND, cache_entries=128):
+        self.working_size = working_size
+        self.detector_backend = detector_backend
+        self.cache_entries = cache_entries
+        self._crops = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"detections": 0, "cache_hits": 0, "detection_seconds": 0.0, "downscale_seconds": 0.0}
+
+    @property
+    def settings(self):
+        """Identifies the preprocessing, e.g. for embedding cache keys."""
+        return f"{self.detector_backend}@{self.working_size}"
+
+    def _key(self, img):
+        digest = hashlib.blake2b(np.ascontiguousarray(img).data, digest_size=16)
+        digest.update(repr(img.shape).encode())
+        return digest.hexdigest()
+
+    def detect(self, img):
+        """Runs the detector on an (already downscaled) BGR image; returns (face, facial_area, confidence)."""
+        from deepface.modules import detection
+
+        with instrumentation.span(f"face_detection/{self.detector_backend}"):
+            faces = detection.extract_faces(img_path=img, detector_backend=self.detector_backend, grayscale=False,
+                                            enforce_detection=False, align=True)
+        if not faces:
+            return None
+        face = faces[0]
+        area = face["facial_area"]
+        return face["face"], (area["x"], area["y"], area["w"], area["h"]), float(face.get("confidence") or 0)
+
+    def __call__(self, source):
+        img = load_image(source)
+        if img is None:
+            return None
+        # No shortcut on the array's identity: callers such as video capture reuse one
+        # buffer for every frame. A repeat (quality gate, then embedder) is found by content.
+        return self._crop(img)
+
+    def _crop(self, img):
+        start = time.perf_counter()
+        with instrumentation.span("downscale"):
+            small, scale = downscale(img, self.working_size)
+        downscale_seconds = time.perf_counter() - start
+
+        key = self._key(small)
+        with self._lock:
+            self._stats["downscale_seconds"] += downscale_seconds
+            crop = self._crops.get(key)
+            if crop is not None:
+                self._crops.move_to_end(key)
+                self._stats["cache_hits"] += 1
+                return crop
+
+        start = time.perf_counter()
+        detected = self.detect(small)
+        seconds = time.perf_counter() - start
+        if detected is None:
+            return None
+        face, (x, y, w, h), confidence = detected
+        crop = FaceCrop(face, tuple(int(round(v / scale)) for v in (x, y, w, h)), confidence)
+        with self._lock:
+            self._stats["detections"] += 1
+            self._stats["detection_seconds"] += seconds
+            self._crops[key] = crop
+            while len(self._crops) > self.cache_entries:
+                self._crops.popitem(last=False)
+        return crop
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, cached_crops=len(self._crops), settings=self.settings)
+        if stats["detections"]:
+            stats["mean_detection_ms"] = stats["detection_seconds"] * 1000.0 / stats["detections"]
+        return stats
+
+
+def embed_face(face, model_name="VGG-Face"):
+    """VGG-Face embedding of an aligned crop from FacePreprocessor (detection skipped)."""
+    from deepface import DeepFace
+
+    result = DeepFace.represent(img_path=face, model_name=model_name, detector_backend="skip",
+                                enforce_detection=False)
+    if isinstance(result, list) and len(result) > 0 and "embedding" in result[0]:
+        return result[0]["embedding"]
+    return None
+
+
+class FaceEmbedder:
+    """
+    Embedding function with the model_utils.extract_embedding signature that
+    goes through a shared FacePreprocessor; `embed_face` embeds one crop (the
+    DeepFace reference by default, or an embedding_backends backend's embed_face).
+    """
+
+    def __init__(self, preprocessor, embed_face=embed_face):
+        self.preprocessor = preprocessor
+        self.embed_face = embed_face
+
+    def __call__(self, image):
+        crop = self.preprocessor(image)
+        if crop is None:
+            return None
+        with instrumentation.span("embedding_forward"):
+            return self.embed_face(crop.face)
@@ -1,53 +1,95 @@
 #!/usr/bin/env python3
 
 #python final_integrated.py --test_image ~/Desktop/CVDAPPMaster/test.png
+#python final_integrated.py --age 55 --sex male --total_chol 210 --hdl 45 --systolic_bp 130 --bp_treatment yes --smoker no --diabetic yes
+#python final_integrated.py --patients patients.jsonl     (JSON object/list or JSONL; "-" streams JSONL from stdin)
 
-try:
-    import cv2
-except ModuleNotFoundError:
-    print("cv2 not installed")
-    
-import os
-import cv2
-import numpy as np
+# Only lightweight modules are imported here. The imaging stack (OpenCV, DeepFace
+# and TensorFlow, the classifiers) is imported when an image is actually scored,
+# so risk-only calls start in tens of milliseconds.
 import argparse
-import joblib
-from deepface import DeepFace
-from ascvd import calculate_ascvd_risk  # Ensure ascvd.py is in the same directory or on PYTHONPATH
+import json
+import sys
+import instrumentation
+from patient_data import PATIENT_FIELDS, patient_from_record
+from ascvd import calculate_ascvd_risk, combine_with_image_points, risk_category  # Ensure ascvd.py is in the same directory or on PYTHONPATH
 
 # ----------------------------
 # Helper Functions for Image Processing
 # ----------------------------
 def load_and_preprocess_image(image_path, target_size=(224, 224)):
     """Loads an image, converts it to RGB, resizes, and ensures it has 3 channels."""
-    img = cv2.imread(image_path)
-    if img is None:
-        return None
-    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-    img = cv2.resize(img, target_size)
-    if len(img.shape) == 2 or (len(img.shape) == 3 and img.shape[2] == 1):
-        img = cv2.cvtColor(img, cv2.COLOR_GRAY2RGB)
-    return img
+    from model_utils import load_and_preprocess_image as load_and_preprocess
+
+    return load_and_preprocess(image_path, target_size)
 
 def extract_embedding(image):
     """Extracts the VGG-Face embedding from an image using DeepFace."""
-    result = DeepFace.represent(img_path=image, model_name="VGG-Face", enforce_detection=False)
-    if isinstance(result, list) and len(result) > 0 and "embedding" in result[0]:
-        return result[0]["embedding"]
-    return None
+    from model_utils import extract_embedding as extract
+
+    return extract(image)
 
 def predict_image(image_path, classifier, scaler, target_size=(224, 224)):
     """Processes an image and returns the predicted class using the provided classifier and scaler."""
-    img = load_and_preprocess_image(image_path, target_size)
-    if img is None:
-        return None
-    embedding = extract_embedding(img)
-    if embedding is None:
-        return None
-    embedding = np.array(embedding).reshape(1, -1)
-    embedding_scaled = scaler.transform(embedding)
-    prediction = classifier.predict(embedding_scaled)
-    return prediction[0]
+    from model_utils import predict_all
+
+    predictions, _ = predict_all(image_path, {"head": (classifier, scaler)}, target_size=target_size,
+                                 embedder=extract_embedding, embedder_input="preprocessed")
+    return predictions["head"]
+
+class ImagePipeline:
+    """
+    Loads the models (and the optional embedding cache and quality gate) on the
+    first image it scores. With `quality_gate`, predict raises
+    quality_gate.ImageRejected for an unusable photo.
+    """
+
+    def __init__(self, target_size=(224, 224), cache_dir=None, quality_gate=False):
+        self.target_size = target_size
+        self.cache_dir = cache_dir
+        self.quality_gate = quality_gate
+        self.models = None
+        self.embedder = None
+        self.embedder_input = "preprocessed"
+        self.cache = None
+        self.gate = None
+
+    def _load(self):
+        import model_registry
+
+        # Load pre-trained models and scalers for all four models (once per process).
+        with instrumentation.span("load_models"):
+            self.models = model_registry.warm_up()
+        self.embedder = model_registry.get_embedder()
+        # The shared face preprocessing stage downscales and detects on the decoded original itself.
+        if model_registry.get_face_preprocessor() is not None:
+            self.embedder_input = "original"
+        if self.cache_dir:
+            from embedding_cache import EmbeddingCache
+
+            settings = "original" if self.embedder_input == "original" else f"preprocessed{self.target_size}"
+            self.cache = EmbeddingCache(self.cache_dir, model_name=model_registry.embedding_model_id(),
+                                        settings=settings)
+        if self.quality_gate:
+            from quality_gate import build_gate
+
+            self.gate = build_gate(model_registry.get_face_preprocessor())
+
+    def predict(self, image_path):
+        if self.models is None:
+            self._load()
+        from model_utils import predict_all, image_risk_points
+
+        # The image is decoded once and its embedding is shared by all four classifiers.
+        predictions, timings = predict_all(
+            image_path, self.models, target_size=self.target_size,
+            embedder=self.embedder, embedder_input=self.embedder_input, cache=self.cache, gate=self.gate
+        )
+        return predictions, timings, image_risk_points(predictions)
+
+    def close(self):
+        if self.cache is not None:
+            self.cache.flush()
 
 # ----------------------------
 # Patient Data Input
@@ -89,6 +131,74 @@ def get_patient_data():
     
     return age, sex, total_chol, hdl, systolic_bp, bp_treatment, smoker, diabetic, rcri, sts
 
+def _iter_json_lines(lines):
+    for number, line in enumerate(lines, 1):
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                yield ValueError(f"line {number}: invalid JSON ({e})")
+
+def iter_patient_records(path):
+    """
+    Yields patient records from a JSON object or list, or from JSONL. "-" streams
+    JSONL from stdin so each result is written as soon as its line is read. A
+    JSONL line that is not valid JSON is yielded as a ValueError, so the stream
+    can report it and go on.
+    """
+    if path == "-":
+        yield from _iter_json_lines(sys.stdin)
+        return
+    with open(path) as f:
+        if path.lower().endswith((".jsonl", ".ndjson")):
+            yield from _iter_json_lines(f)
+            return
+        data = json.load(f)
+    yield from (data if isinstance(data, list) else [data])
+
+def score_record(record, pipeline):
+    """Scores one patient record; an "image" field adds the image-based predictions."""
+    result = {}
+    if "id" in record:
+        result["id"] = record["id"]
+    image_points = 0
+    if record.get("image"):
+        predictions, _, image_points = pipeline.predict(record["image"])
+        result["image"] = record["image"]
+        result["predictions"] = {head: (str(pred) if pred is not None else None) for head, pred in predictions.items()}
+        result["image_points"] = image_points
+    patient = patient_from_record(record)
+    if patient is not None:
+        with instrumentation.span("ascvd_risk"):
+            result["ascvd_risk"] = calculate_ascvd_risk(*patient)
+        result["final_risk"] = combine_with_image_points(result["ascvd_risk"], image_points)
+        result["risk_category"] = risk_category(result["final_risk"])
+    return result
+
+def score_stream(records, pipeline):
+    """score_record over `records`; a malformed or failing record yields {"id": ..., "error": ...} instead."""
+    for record in records:
+        if isinstance(record, ValueError):
+            yield {"error": str(record)}
+            continue
+        if not isinstance(record, dict):
+            yield {"error": f"expected a JSON object, got {type(record).__name__}"}
+            continue
+        try:
+            yield score_record(record, pipeline)
+        except Exception as e:  # bad patient field, unreadable image, ...
+            result = {"id": record["id"]} if "id" in record else {}
+            result["error"] = str(e) or type(e).__name__
+            yield result
+
+def _write_metrics(args):
+    report = instrumentation.prometheus_text() if args.metrics == "prometheus" else instrumentation.to_json() + "\n"
+    if args.metrics_file:
+        with open(args.metrics_file, "w") as f:
+            f.write(report)
+    else:
+        print("\n" + report, end="", file=sys.stderr if args.patients or args.json else sys.stdout)
+
 # ----------------------------
 # Main Integrated Pipeline
 # ----------------------------
@@ -96,84 +206,101 @@ def main():
     parser = argparse.ArgumentParser(
         description="Integrated CVD Risk Estimator: Combines image-based symptom predictions and patient data."
     )
-    parser.add_argument('--test_image', type=str, required=True, help="Path to the test image")
+    parser.add_argument('--test_image', type=str, default=None, help="Path to the test image (optional for a risk-only call)")
     parser.add_argument('--target_size', type=int, default=224, help="Target image size (default 224)")
+    parser.add_argument('--cache_dir', type=str, default=None, help="Directory of the persistent embedding cache (optional)")
+    parser.add_argument('--metrics', choices=["prometheus", "json"], default=None,
+                        help="Print per-stage latency/memory metrics in this format at the end (optional)")
+    parser.add_argument('--metrics_file', type=str, default=None, help="Write the metrics to this file instead of stdout")
+    patient_args = parser.add_argument_group("patient data (non-interactive; omitted fields count as not available)")
+    for field, help_text in [
+        ("age", "Age in years"), ("sex", "male/female"), ("total_chol", "Total cholesterol (mg/dL)"),
+        ("hdl", "HDL cholesterol (mg/dL)"), ("systolic_bp", "Systolic blood pressure (mm Hg)"),
+        ("bp_treatment", "On blood pressure medication (yes/no)"), ("smoker", "Smoker (yes/no)"),
+        ("diabetic", "Diabetic (yes/no)"), ("rcri", "RCRI score"), ("sts", "STS score"),
+    ]:
+        patient_args.add_argument(f"--{field}", type=str, default=None, help=help_text)
+    parser.add_argument('--patients', type=str, default=None,
+                        help="Score patient records from a JSON/JSONL file, or '-' for JSONL on stdin; "
+                             "records may carry an 'image' path. Writes one JSON line per record.")
+    parser.add_argument('--json', action="store_true", help="Print the result as one JSON object")
+    parser.add_argument('--quality_gate', action="store_true",
+                        help="Reject unusable photos (size, blur, exposure, no face) before embedding")
     args = parser.parse_args()
     
-    target_size = (args.target_size, args.target_size)
+    if args.metrics:
+        instrumentation.enable()
     
-    # Load pre-trained models and scalers for all four models.
-    aging_classifier = joblib.load("aging_spots_classifier_model.pkl")
-    aging_scaler = joblib.load("aging_spots_classifier_model_scaler.pkl")
-    jugular_classifier = joblib.load("jugular_veins_classifier_model.pkl")
-    jugular_scaler = joblib.load("jugular_veins_classifier_model_scaler.pkl")
-    xanthelasma_classifier = joblib.load("xanthelasma_classifier_model.pkl")
-    xanthelasma_scaler = joblib.load("xanthelasma_classifier_model_scaler.pkl")
-    neck_classifier = joblib.load("neck_circumference_classifier_model.pkl")
-    neck_scaler = joblib.load("neck_circumference_classifier_model_scaler.pkl")
+    pipeline = ImagePipeline((args.target_size, args.target_size), args.cache_dir, args.quality_gate)
     
-    print("\nRunning image through each model...\n")
+    if args.patients:
+        try:
+            for result in score_stream(iter_patient_records(args.patients), pipeline):
+                print(json.dumps(result), flush=True)
+        finally:
+            pipeline.close()
+        if args.metrics:
+            _write_metrics(args)
+        return
     
-    aging_pred = predict_image(args.test_image, aging_classifier, aging_scaler, target_size=target_size)
-    jugular_pred = predict_image(args.test_image, jugular_classifier, jugular_scaler, target_size=target_size)
-    xanthelasma_pred = predict_image(args.test_image, xanthelasma_classifier, xanthelasma_scaler, target_size=target_size)
-    neck_pred = predict_image(args.test_image, neck_classifier, neck_scaler, target_size=target_size)
+    patient_record = {field: getattr(args, field) for field in PATIENT_FIELDS}
+    patient_data = patient_from_record(patient_record)
     
-    # Print predictions for each model.
-    if aging_pred is not None:
-        print(f"Aging Spots Prediction: {aging_pred}")
-    else:
-        print("Aging Spots Prediction: Unable to determine")
+    if args.json:
+        record = dict(patient_record, image=args.test_image)
+        print(json.dumps(next(score_stream([record], pipeline))))
+        pipeline.close()
+        if args.metrics:
+            _write_metrics(args)
+        return
+    
+    image_points = 0
+    if args.test_image:
+        print("\nRunning image through each model...\n")
+        from quality_gate import ImageRejected
+
+        try:
+            predictions, timings, image_points = pipeline.predict(args.test_image)
+        except ImageRejected as e:
+            sys.exit(f"Image rejected by the quality gate: {e.reason}")
+        finally:
+            pipeline.close()
+        if pipeline.cache is not None:
+            print(f"Embedding cache: {pipeline.cache.stats()}")
         
-    if jugular_pred is not None:
-        print(f"Jugular Veins Prediction: {jugular_pred}")
-    else:
-        print("Jugular Veins Prediction: Unable to determine")
+        from model_utils import HEAD_LABELS
         
-    if xanthelasma_pred is not None:
-        print(f"Xanthelasma Prediction: {xanthelasma_pred}")
-    else:
-        print("Xanthelasma Prediction: Unable to determine")
+        # Print predictions for each model.
+        for head, label in HEAD_LABELS.items():
+            pred = predictions[head]
+            if pred is not None:
+                print(f"{label} Prediction: {pred}")
+            else:
+                print(f"{label} Prediction: Unable to determine")
         
-    if neck_pred is not None:
-        print(f"Neck Circumference Prediction: {neck_pred}")
-    else:
-        print("Neck Circumference Prediction: Unable to determine")
+        print("\nTimings: " + ", ".join(f"{stage} {seconds * 1000:.1f} ms" for stage, seconds in timings.items()))
+        print(f"\nImage-based risk points: {image_points}")
+    elif patient_data is None:
+        parser.error("give --test_image, patient data flags (e.g. --age/--sex) or --patients")
     
-    # Assign image-based risk points based on predictions.
-    image_points = 0
-    # (Point values are arbitrary; adjust as needed.)
-    if aging_pred is not None and aging_pred.lower() == "positive":
-        image_points += 2
-    if jugular_pred is not None and jugular_pred.lower() == "positive":
-        image_points += 1
-    if xanthelasma_pred is not None and xanthelasma_pred.lower() == "positive":
-        image_points += 3
-    if neck_pred is not None and neck_pred.lower() == "positive":
-        image_points += 2  # Assign 2 points for a positive neck circumference result
-    
-    print(f"\nImage-based risk points: {image_points}")
-    
-    # Gather patient data
-    patient_data = get_patient_data()
+    # Gather patient data (prompting only when none was given on the command line)
+    if patient_data is None:
+        patient_data = get_patient_data()
     # Unpack patient data into expected parameters for the ASCVD risk calculator
     # (Assuming the function expects: age, sex, total_chol, hdl, systolic_bp, bp_treatment, smoker, diabetic, rcri, sts)
-    ascvd_risk = calculate_ascvd_risk(*patient_data)
+    with instrumentation.span("ascvd_risk"):
+        ascvd_risk = calculate_ascvd_risk(*patient_data)
     print(f"\nASCVD 10-year risk from patient data: {ascvd_risk}%")
     
     # Combine risks (for example, image points are weighted by 2, then added to ASCVD risk)
-    final_risk = ascvd_risk + image_points * 2
+    final_risk = combine_with_image_points(ascvd_risk, image_points)
     print(f"\nFinal estimated risk of CVD: {final_risk}%")
     
     # Optional risk categorization
-    if final_risk <= 5:
-        print("Risk Category: Low Risk")
-    elif 5 < final_risk <= 7.4:
-        print("Risk Category: Medium-low Risk")
-    elif 7.5 <= final_risk <= 19.9:
-        print("Risk Category: Medium-high Risk")
-    else:  # final_risk >= 20
-        print("Risk Category: High Risk")
+    print(f"Risk Category: {risk_category(final_risk)}")
+    
+    if args.metrics:
+        _write_metrics(args)
 
 if __name__ == "__main__":
     main()
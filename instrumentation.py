@@ -0,0 +1,164 @@
+# instrumentation.py
+"""
+Lightweight per-stage latency, counter and memory instrumentation.
+
+    with instrumentation.span("embedding"):
+        ...
+    instrumentation.count("images_total")
+
+Spans record call count, total and max seconds, and the growth of the process's
+peak RSS while they were open. Everything is off by default: a disabled span()
+returns a shared no-op context manager, so instrumented code pays one global
+lookup per call. Enable with enable() or the CVD_METRICS=1 environment variable,
+then export with prometheus_text() or to_json().
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_enabled = os.environ.get("CVD_METRICS", "").lower() in ("1", "true", "yes")
+_lock = threading.Lock()
+_spans = {}
+_counters = {}
+
+
+def _peak_rss_bytes():
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("name", "_start", "_rss")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self._rss = _peak_rss_bytes()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self._start
+        rss_growth = _peak_rss_bytes() - self._rss
+        with _lock:
+            stats = _spans.get(self.name)
+            if stats is None:
+                stats = _spans[self.name] = {"count": 0, "seconds": 0.0, "max_seconds": 0.0, "peak_rss_growth_bytes": 0}
+            stats["count"] += 1
+            stats["seconds"] += seconds
+            stats["max_seconds"] = max(stats["max_seconds"], seconds)
+            stats["peak_rss_growth_bytes"] += rss_growth
+        return False
+
+
+def enabled():
+    return _enabled
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def reset():
+    with _lock:
+        _spans.clear()
+        _counters.clear()
+
+
+def span(name):
+    """Context manager timing one stage; a shared no-op when instrumentation is off."""
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(name)
+
+
+def count(name, value=1):
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def snapshot():
+    with _lock:
+        return {
+            "spans": {name: dict(stats) for name, stats in _spans.items()},
+            "counters": dict(_counters),
+            "peak_rss_bytes": _peak_rss_bytes(),
+        }
+
+
+# ----------------------------
+# Exporters
+# ----------------------------
+def _label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+
+def prometheus_text(prefix="cvd"):
+    """Metrics in the Prometheus text exposition format."""
+    data = snapshot()
+    lines = [
+        f"# HELP {prefix}_stage_seconds Time spent in each pipeline stage.",
+        f"# TYPE {prefix}_stage_seconds summary",
+    ]
+    for name, stats in sorted(data["spans"].items()):
+        lines.append(f'{prefix}_stage_seconds_count{{stage="{_label(name)}"}} {stats["count"]}')
+        lines.append(f'{prefix}_stage_seconds_sum{{stage="{_label(name)}"}} {stats["seconds"]:.9f}')
+    lines += [
+        f"# HELP {prefix}_stage_max_seconds Slowest single call of each pipeline stage.",
+        f"# TYPE {prefix}_stage_max_seconds gauge",
+    ]
+    for name, stats in sorted(data["spans"].items()):
+        lines.append(f'{prefix}_stage_max_seconds{{stage="{_label(name)}"}} {stats["max_seconds"]:.9f}')
+    lines += [
+        f"# HELP {prefix}_stage_peak_rss_growth_bytes Growth of the process peak RSS while each stage ran.",
+        f"# TYPE {prefix}_stage_peak_rss_growth_bytes counter",
+    ]
+    for name, stats in sorted(data["spans"].items()):
+        lines.append(f'{prefix}_stage_peak_rss_growth_bytes{{stage="{_label(name)}"}} {stats["peak_rss_growth_bytes"]}')
+    for name, value in sorted(data["counters"].items()):
+        lines.append(f"# TYPE {prefix}_{name} counter")
+        lines.append(f"{prefix}_{name} {value}")
+    lines += [
+        f"# HELP {prefix}_process_peak_rss_bytes Peak resident set size of this process.",
+        f"# TYPE {prefix}_process_peak_rss_bytes gauge",
+        f"{prefix}_process_peak_rss_bytes {data['peak_rss_bytes']}",
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def to_json():
+    """Metrics as one JSON object (one line, suitable for JSON logs)."""
+    data = snapshot()
+    data["timestamp"] = time.time()
+    return json.dumps(data, sort_keys=True)
@@ -0,0 +1,178 @@
+# model_registry.py
+"""
+Process-wide registry of the trained classifiers, their scalers and the
+VGG-Face embedding model.
+
+Every artifact is loaded at most once per process and then kept resident, so
+Streamlit reruns, CLI calls and service requests reuse the same objects.
+"""
+
+import os
+import threading
+import time
+
+import joblib
+
+from model_utils import HEADS
+
+MODEL_DIR = os.environ.get("CVD_MODEL_DIR", os.path.dirname(os.path.abspath(__file__)))
+# Optional artifact written by `compiled_heads.py compile`; used instead of the pickles when set.
+# A directory artifact is memory-mapped, so every worker process shares one copy of the arrays.
+COMPILED_HEADS_PATH = os.environ.get("CVD_COMPILED_HEADS")
+EMBEDDING_MODEL_NAME = "VGG-Face"
+# Embedding backend (see embedding_backends.BACKENDS); "deepface" is the TensorFlow reference.
+EMBEDDING_BACKEND = os.environ.get("CVD_EMBEDDING_BACKEND", "deepface")
+# Shared downscale/detect/align stage in front of the embedder (see face_preprocessing);
+# CVD_FACE_PREPROCESSING=0 hands the raw image to the embedder as before.
+FACE_PREPROCESSING = os.environ.get("CVD_FACE_PREPROCESSING", "1") == "1"
+
+_lock = threading.Lock()
+_models = None
+_embedding_model = None
+_embedder = None
+_face_preprocessor = None
+_load_seconds = {}
+
+
+def _artifact_paths(head, model_dir):
+    return (
+        os.path.join(model_dir, f"{head}_classifier_model.pkl"),
+        os.path.join(model_dir, f"{head}_classifier_model_scaler.pkl"),
+    )
+
+
+def load_pickled_models(model_dir=None):
+    """Loads {head: (classifier, scaler)} from the pickles (uncached)."""
+    models = {}
+    for head in HEADS:
+        classifier_path, scaler_path = _artifact_paths(head, model_dir or MODEL_DIR)
+        models[head] = (joblib.load(classifier_path), joblib.load(scaler_path))
+    return models
+
+
+def get_models(model_dir=None):
+    """
+    Returns the heads, loading them on first use: {head: (classifier, scaler)}
+    from the pickles, or a CompiledHeads when CVD_COMPILED_HEADS is set.
+    """
+    global _models
+    if _models is not None:
+        return _models
+    with _lock:
+        if _models is None:
+            start = time.perf_counter()
+            if COMPILED_HEADS_PATH:
+                from compiled_heads import CompiledHeads
+
+                models = CompiledHeads.load(COMPILED_HEADS_PATH)
+            else:
+                models = load_pickled_models(model_dir)
+            _load_seconds["classifiers"] = time.perf_counter() - start
+            _models = models
+    return _models
+
+
+def get_embedding_model():
+    """Builds the DeepFace VGG-Face model once; DeepFace reuses it for every represent() call."""
+    global _embedding_model
+    if _embedding_model is not None:
+        return _embedding_model
+    with _lock:
+        if _embedding_model is None:
+            from deepface import DeepFace
+
+            start = time.perf_counter()
+            _embedding_model = DeepFace.build_model(EMBEDDING_MODEL_NAME)
+            _load_seconds["embedding_model"] = time.perf_counter() - start
+    return _embedding_model
+
+
+def get_face_preprocessor():
+    """The process-wide face_preprocessing.FacePreprocessor, or None when disabled."""
+    global _face_preprocessor
+    if not FACE_PREPROCESSING:
+        return None
+    if _face_preprocessor is None:
+        with _lock:
+            if _face_preprocessor is None:
+                from face_preprocessing import FacePreprocessor
+
+                _face_preprocessor = FacePreprocessor()
+    return _face_preprocessor
+
+
+def get_embedder(threads=None):
+    """
+    The configured embedding function (CVD_EMBEDDING_BACKEND): extract_embedding
+    for the DeepFace reference, otherwise an embedding_backends backend, built once
+    (with `threads` intra-op threads, see get_backend). With face preprocessing
+    enabled, either one embeds the shared aligned crop.
+    """
+    global _embedder
+    if _embedder is not None:
+        return _embedder
+    preprocessor = get_face_preprocessor()
+    if EMBEDDING_BACKEND == "deepface":
+        from model_utils import extract_embedding
+
+        get_embedding_model()
+        if preprocessor is not None:
+            from face_preprocessing import FaceEmbedder
+
+            _embedder = FaceEmbedder(preprocessor)
+        else:
+            _embedder = extract_embedding
+        return _embedder
+    with _lock:
+        if _embedder is None:
+            from embedding_backends import get_backend
+
+            start = time.perf_counter()
+            backend = get_backend(EMBEDDING_BACKEND, threads=threads)
+            if preprocessor is not None:
+                from face_preprocessing import FaceEmbedder
+
+                backend = FaceEmbedder(preprocessor, backend.embed_face)
+            _embedder = backend
+            _load_seconds["embedding_model"] = time.perf_counter() - start
+    return _embedder
+
+
+def embedding_model_id():
+    """Identifies the embedding network, backend and face preprocessing, e.g. for embedding cache keys."""
+    model_id = EMBEDDING_MODEL_NAME if EMBEDDING_BACKEND == "deepface" else f"{EMBEDDING_MODEL_NAME}/{EMBEDDING_BACKEND}"
+    preprocessor = get_face_preprocessor()
+    if preprocessor is not None:
+        model_id += f"+{preprocessor.settings}"
+    return model_id
+
+
+def warm_up(model_dir=None, embedding=True):
+    """Eagerly loads every artifact so the first request does not pay the cold start."""
+    models = get_models(model_dir)
+    if embedding:
+        get_embedder()
+    return models
+
+
+def health():
+    """Readiness summary suitable for a health-check endpoint or a status line."""
+    return {
+        "ready": _models is not None and _embedder is not None,
+        "classifiers_loaded": _models is not None,
+        "heads": list(_models) if _models is not None else [],
+        "embedding_model": embedding_model_id() if _embedder is not None else None,
+        "load_seconds": dict(_load_seconds),
+        "face_preprocessing": _face_preprocessor.stats() if _face_preprocessor is not None else None,
+    }
+
+
+def reset():
+    """Drops every loaded artifact (e.g. after the pickles have been retrained)."""
+    global _models, _embedding_model, _embedder, _face_preprocessor
+    with _lock:
+        _models = None
+        _embedding_model = None
+        _embedder = None
+        _face_preprocessor = None
+        _load_seconds.clear()
@@ -1,11 +1,51 @@
 # model_utils.py
 
+import time
+
 import cv2
 import numpy as np
-from deepface import DeepFace
 
-def load_and_preprocess_image(image_path, target_size=(224, 224)):
-    img = cv2.imread(image_path)
+import instrumentation
+
+# The four image-based heads, in the order they are reported.
+HEADS = ("aging_spots", "jugular_veins", "xanthelasma", "neck_circumference")
+
+HEAD_LABELS = {
+    "aging_spots": "Aging Spots",
+    "jugular_veins": "Jugular Veins",
+    "xanthelasma": "Xanthelasma",
+    "neck_circumference": "Neck Circumference",
+}
+
+# Image-based risk points awarded for a positive prediction from each head.
+# (Point values are arbitrary; adjust as needed.)
+HEAD_POINTS = {
+    "aging_spots": 2,
+    "jugular_veins": 1,
+    "xanthelasma": 3,
+    "neck_circumference": 2,
+}
+
+def decode_image(data):
+    """Decodes encoded image bytes (JPEG, PNG, ...) in memory into a BGR array, or None."""
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    if buffer.size == 0:
+        return None
+    return cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+
+def load_image(source):
+    """
+    Returns the image as a BGR array, decoding it exactly once. `source` may be a
+    file path, encoded image bytes or an already decoded BGR array.
+    """
+    if isinstance(source, np.ndarray):
+        return source
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return decode_image(source)
+    return cv2.imread(source)
+
+def preprocess_image(img, target_size=(224, 224)):
+    """Converts a decoded BGR image to RGB, resizes it, and ensures it has 3 channels."""
     if img is None:
         return None
     img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
@@ -14,20 +54,133 @@ def load_and_preprocess_image(image_path, target_size=(224, 224)):
         img = cv2.cvtColor(img, cv2.COLOR_GRAY2RGB)
     return img
 
-def extract_embedding(image_path):
-    result = DeepFace.represent(img_path=image_path, model_name="VGG-Face", enforce_detection=False)
+def load_and_preprocess_image(image_path, target_size=(224, 224)):
+    return preprocess_image(load_image(image_path), target_size)
+
+def extract_embedding(image):
+    # `image` may be a file path or a decoded BGR array; DeepFace accepts both.
+    # Imported here so that modules using only the classifiers do not load TensorFlow.
+    from deepface import DeepFace
+
+    result = DeepFace.represent(img_path=image, model_name="VGG-Face", enforce_detection=False)
     if isinstance(result, list) and len(result) > 0 and "embedding" in result[0]:
         return result[0]["embedding"]
     return None
 
-def predict_image(image_path, classifier, scaler, target_size=(224, 224)):
-    img = load_and_preprocess_image(image_path, target_size)
-    if img is None:
-        return None
-    embedding = extract_embedding(image_path)
-    if embedding is None:
-        return None
+def classify_embeddings(embeddings, models):
+    """
+    Runs every head in `models` ({head: (classifier, scaler)}, or a compiled
+    CompiledHeads) on a stacked (n_images, n_features) embedding matrix with one
+    transform/predict per head. Returns ({head: array of n labels}, {head: seconds}).
+    """
+    embeddings = np.asarray(embeddings)
+    predictions = {}
+    timings = {}
+    if hasattr(models, "predict_proba") and not isinstance(models, dict):
+        # A compiled_heads.CompiledHeads scores every head in one call.
+        start = time.perf_counter()
+        with instrumentation.span("compiled_heads"):
+            predictions = models.predict(embeddings)
+        timings["heads"] = time.perf_counter() - start
+        return predictions, timings
+    for head, (classifier, scaler) in models.items():
+        start = time.perf_counter()
+        with instrumentation.span(f"scaler_transform/{head}"):
+            embeddings_scaled = scaler.transform(embeddings)
+        with instrumentation.span(f"classifier_predict/{head}"):
+            predictions[head] = classifier.predict(embeddings_scaled)
+        timings[head] = time.perf_counter() - start
+    return predictions, timings
+
+def classify_embedding(embedding, models):
+    """Runs every head in `models` ({head: (classifier, scaler)}) on one embedding."""
     embedding = np.array(embedding).reshape(1, -1)
-    embedding_scaled = scaler.transform(embedding)
-    prediction = classifier.predict(embedding_scaled)
-    return prediction[0]
+    predictions, timings = classify_embeddings(embedding, models)
+    return {head: labels[0] for head, labels in predictions.items()}, timings
+
+def predict_all(source, models, target_size=(224, 224), embedder=extract_embedding,
+                embedder_input="original", cache=None, gate=None):
+    """
+    Embeds the image once and fans the embedding out to every head in `models`.
+
+    `source` is a file path, encoded image bytes or a decoded BGR array; it is
+    decoded once and the same buffer feeds preprocessing and the embedder.
+    `embedder_input` selects what is handed to `embedder`: the decoded
+    "original" image or the "preprocessed" (resized RGB) one. With an
+    EmbeddingCache, a hit on `source` skips decoding and embedding entirely.
+    With a quality_gate.QualityGate, an unusable image raises ImageRejected
+    (with the gate's report) before the cache or the embedder is consulted.
+    Returns ({head: label or None}, {stage: seconds}); the timings hold
+    "decode", "preprocess", "embedding" and one entry per head.
+    """
+    predictions = {head: None for head in models}
+    timings = {}
+    instrumentation.count("images_total")
+
+    if isinstance(source, str) and cache is not None and gate is not None:
+        with open(source, "rb") as f:
+            source = f.read()  # read once for the gate's decode and the cache key
+
+    img = None
+    if gate is not None:
+        # Gated before the cache, which may hold embeddings from ungated runs.
+        start = time.perf_counter()
+        with instrumentation.span("decode"):
+            img = load_image(source)
+        timings["decode"] = time.perf_counter() - start
+        if img is None:
+            instrumentation.count("images_unreadable_total")
+            return predictions, timings
+        start = time.perf_counter()
+        gate.enforce(img)
+        timings["quality_gate"] = time.perf_counter() - start
+
+    embedding = None
+    if cache is not None:
+        start = time.perf_counter()
+        with instrumentation.span("cache_lookup"):
+            key, embedding = cache.lookup(source)
+        timings["cache"] = time.perf_counter() - start
+        instrumentation.count("embedding_cache_hits_total" if embedding is not None else "embedding_cache_misses_total")
+
+    if embedding is None:
+        if img is None:
+            start = time.perf_counter()
+            with instrumentation.span("decode"):
+                img = load_image(source)
+            timings["decode"] = time.perf_counter() - start
+            if img is None:
+                instrumentation.count("images_unreadable_total")
+                return predictions, timings
+
+        start = time.perf_counter()
+        with instrumentation.span("preprocess"):
+            preprocessed = preprocess_image(img, target_size)
+        timings["preprocess"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with instrumentation.span("embedding"):
+            embedding = embedder(preprocessed if embedder_input == "preprocessed" else img)
+        timings["embedding"] = time.perf_counter() - start
+        if embedding is None:
+            instrumentation.count("embedding_failures_total")
+            return predictions, timings
+        if cache is not None:
+            cache.put(key, embedding)
+
+    head_predictions, head_timings = classify_embedding(embedding, models)
+    predictions.update(head_predictions)
+    timings.update(head_timings)
+    return predictions, timings
+
+def image_risk_points(predictions):
+    """Sums HEAD_POINTS over the heads that predicted "positive"."""
+    points = 0
+    for head, pred in predictions.items():
+        if pred is not None and str(pred).lower() == "positive":
+            points += HEAD_POINTS.get(head, 0)
+    return points
+
+def predict_image(source, classifier, scaler, target_size=(224, 224)):
+    predictions, _ = predict_all(source, {"head": (classifier, scaler)}, target_size)
+    return predictions["head"]
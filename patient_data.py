@@ -0,0 +1,79 @@
+# patient_data.py
+"""
+Parsing of patient records (from manifests, JSON or command-line flags) into the
+positional arguments expected by ascvd.calculate_ascvd_risk.
+"""
+
+import math
+
+# Argument order of calculate_ascvd_risk.
+PATIENT_FIELDS = (
+    "age", "sex", "total_chol", "hdl", "systolic_bp",
+    "bp_treatment", "smoker", "diabetic", "rcri", "sts",
+)
+
+_NUMERIC_FIELDS = {"age": int, "total_chol": float, "hdl": float, "systolic_bp": float, "rcri": float, "sts": float}
+_BOOLEAN_FIELDS = ("bp_treatment", "smoker", "diabetic")
+
+
+def _is_blank(value):
+    return value is None or (isinstance(value, str) and value.strip() == "")
+
+
+def parse_sex(value):
+    if _is_blank(value):
+        return None
+    sex = str(value).strip().lower()
+    if sex in ["m"]:
+        sex = "male"
+    elif sex in ["f"]:
+        sex = "female"
+    return sex
+
+
+def parse_bool(value):
+    if _is_blank(value):
+        return None
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in ["yes", "y", "true", "t", "1"]:
+        return True
+    if text in ["no", "n", "false", "f", "0"]:
+        return False
+    return None
+
+
+def parse_number(value, type_func):
+    if _is_blank(value):
+        return None
+    number = float(value)
+    if not math.isfinite(number):  # "inf", "nan", "1e400"
+        raise ValueError(f"not a finite number: {value!r}")
+    if type_func is int:
+        return int(number)
+    return number
+
+
+def patient_from_record(record):
+    """
+    Converts a mapping with any of PATIENT_FIELDS (strings, numbers or booleans;
+    blank or missing means "not available") into the calculate_ascvd_risk
+    argument tuple. Returns None when the record carries no patient data at all;
+    raises ValueError naming the field when a number cannot be parsed.
+    """
+    if all(_is_blank(record.get(field)) for field in PATIENT_FIELDS):
+        return None
+    values = []
+    for field in PATIENT_FIELDS:
+        value = record.get(field)
+        if field == "sex":
+            values.append(parse_sex(value))
+        elif field in _BOOLEAN_FIELDS:
+            values.append(parse_bool(value))
+        else:
+            try:
+                values.append(parse_number(value, _NUMERIC_FIELDS[field]))
+            except (TypeError, ValueError, OverflowError):
+                raise ValueError(f"invalid {field}: {value!r}") from None
+    return tuple(values)
@@ -0,0 +1,303 @@
+# pipeline.py
+"""
+Overlapped read/decode -> embed -> classify/write pipeline for large batch runs.
+
+batch.py's default loop reads, embeds and classifies one chunk after the other,
+so on slow (e.g. network-mounted) storage the embedding model idles while files
+are read, and the storage idles while the model runs. Here the stages run
+concurrently and are connected by bounded queues:
+
+    feeder -> [read_threads] read bytes, cache lookup, decode, quality gate
+           -> [embed_threads] embedder (in-process model or worker pool)
+           -> main thread: restore input order, classify and write per chunk
+
+Reading and decoding run on a thread pool (file I/O and cv2.imdecode release
+the GIL) and prefetch up to `prefetch` decoded images ahead of the embedder.
+Every queue is bounded and at most `max_in_flight` records are between the
+feeder and the writer, so a slow stage throttles the stages before it
+(backpressure) instead of buffering the archive in memory. Each stage reports
+its utilization: busy time over wall time and threads, plus the time spent
+starved (waiting for input) or blocked (waiting for room downstream).
+
+    python batch.py --input /mnt/archive/photos --output results.csv --pipeline --read-threads 16
+"""
+
+import queue
+import threading
+import time
+
+import instrumentation
+from model_utils import decode_image
+
+_DONE = object()
+
+
+class StageStats:
+    """Busy/starved/blocked seconds and item count of one stage, summed over its threads."""
+
+    def __init__(self, name, threads):
+        self.name = name
+        self.threads = threads
+        self.items = 0
+        self.busy = 0.0
+        self.starved = 0.0
+        self.blocked = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, items=0, busy=0.0, starved=0.0, blocked=0.0):
+        with self._lock:
+            self.items += items
+            self.busy += busy
+            self.starved += starved
+            self.blocked += blocked
+
+    def report(self, wall):
+        capacity = wall * self.threads
+        return {
+            "threads": self.threads,
+            "items": self.items,
+            "utilization": self.busy / capacity if capacity else 0.0,
+            "starved_fraction": self.starved / capacity if capacity else 0.0,
+            "blocked_fraction": self.blocked / capacity if capacity else 0.0,
+        }
+
+
+def _get(q, stats):
+    start = time.perf_counter()
+    item = q.get()
+    stats.add(starved=time.perf_counter() - start)
+    return item
+
+
+def _put(q, item, stats):
+    start = time.perf_counter()
+    q.put(item)
+    stats.add(blocked=time.perf_counter() - start)
+
+
+class _Item:
+    __slots__ = ("seq", "record", "data", "image", "key", "embedding", "error")
+
+    def __init__(self, seq, record):
+        self.seq = seq
+        self.record = record
+        self.data = None
+        self.image = None
+        self.key = None
+        self.embedding = None
+        self.error = None
+
+
+class Pipeline:
+    """
+    One pipelined pass over `records` (dicts with an "image" path). `embedder`
+    is any model_utils.extract_embedding-style callable; with an
+    EmbeddingWorkerPool use one embed thread per worker process; the pool is
+    handed the encoded file bytes and decodes them in the worker, instead of a
+    full-resolution array pickled through its pipe. `cache`, `gate` and `index`
+    are as for batch.score_records. `max_in_flight` must be at least
+    `chunk_size`, since the writer frees slots a whole chunk at a time.
+    """
+
+    def __init__(self, models, embedder, chunk_size=256, read_threads=8, embed_threads=1, prefetch=64,
+                 max_in_flight=None, cache=None, gate=None, index=None):
+        self.models = models
+        self.embedder = embedder
+        self.chunk_size = chunk_size
+        self.read_threads = read_threads
+        self.embed_threads = embed_threads
+        self.prefetch = prefetch
+        self.max_in_flight = max_in_flight or max(2 * chunk_size, prefetch + read_threads + embed_threads)
+        if self.max_in_flight < chunk_size:
+            raise ValueError(f"max_in_flight ({self.max_in_flight}) must be at least chunk_size ({chunk_size})")
+        self.cache = cache
+        self.gate = gate
+        self.index = index
+        self._send_bytes = hasattr(embedder, "embed_many")
+        self.stats = {
+            "read": StageStats("read", read_threads),
+            "embed": StageStats("embed", embed_threads),
+            "write": StageStats("write", 1),
+        }
+        self.wall_seconds = 0.0
+        self._feed_error = None
+
+    # ----------------------------
+    # Stages
+    # ----------------------------
+    def _feed(self, records, paths, in_flight):
+        try:
+            for seq, record in enumerate(records):
+                in_flight.acquire()  # released by the writer once the record has been written
+                paths.put(_Item(seq, record))
+        except Exception as e:  # e.g. a malformed manifest row; re-raised by run()
+            self._feed_error = e
+        finally:
+            for _ in range(self.read_threads):
+                paths.put(_DONE)
+
+    def _read_one(self, item):
+        from batch import MANIFEST_ERROR
+
+        if MANIFEST_ERROR in item.record:
+            item.error = item.record[MANIFEST_ERROR]
+            return
+        with open(item.record["image"], "rb") as f:
+            item.data = f.read()
+        # The gate runs before the cache: a cached embedding may come from an ungated run.
+        if self.gate is not None and not self._decode_and_gate(item):
+            return
+        if self.cache is not None:
+            item.key, item.embedding = self.cache.lookup(item.data)
+            if item.embedding is not None:
+                item.data = item.image = None
+                return
+        if self._send_bytes:
+            item.image = None  # the worker process decodes item.data itself
+        else:
+            if item.image is None:
+                self._decode_and_gate(item)
+            item.data = None
+
+    def _decode_and_gate(self, item):
+        """Decodes item.data and applies the gate; false (with item.error set) if the image is unusable."""
+        item.image = decode_image(item.data)
+        if item.image is None:
+            item.error = "could not read image"
+        elif self.gate is not None:
+            report = self.gate(item.image)
+            if not report.ok:
+                item.error = f"rejected: {report.reason}"
+                item.image = None
+        if item.error is not None:
+            item.data = None
+        return item.error is None
+
+    def _read(self, paths, decoded, finished):
+        stats = self.stats["read"]
+        try:
+            while True:
+                item = _get(paths, stats)
+                if item is _DONE:
+                    break
+                start = time.perf_counter()
+                try:
+                    with instrumentation.span("pipeline_read"):
+                        self._read_one(item)
+                except Exception as e:  # unreadable file, gate or cache failure: one error row, not a dead thread
+                    item.data = item.image = None
+                    item.error = str(e) or type(e).__name__
+                stats.add(items=1, busy=time.perf_counter() - start)
+                _put(decoded, item, stats)
+        finally:
+            if finished():
+                for _ in range(self.embed_threads):
+                    decoded.put(_DONE)
+
+    def _embed(self, decoded, embedded, finished):
+        from batch import _safe_embed
+
+        stats = self.stats["embed"]
+        try:
+            while True:
+                item = _get(decoded, stats)
+                if item is _DONE:
+                    break
+                source = item.data if self._send_bytes else item.image
+                if source is not None and item.error is None:
+                    start = time.perf_counter()
+                    with instrumentation.span("pipeline_embed"):
+                        item.embedding, item.error = _safe_embed(self.embedder, source)
+                    item.data = item.image = None
+                    if self.cache is not None and item.embedding is not None:
+                        try:
+                            self.cache.put(item.key, item.embedding)
+                        except Exception:  # the embedding is still good; it just isn't cached
+                            pass
+                    stats.add(items=1, busy=time.perf_counter() - start)
+                _put(embedded, item, stats)
+        finally:
+            if finished():
+                embedded.put(_DONE)
+
+    def _write_chunk(self, chunk, writer):
+        from batch import index_results, score_embeddings
+
+        stats = self.stats["write"]
+        start = time.perf_counter()
+        with instrumentation.span("pipeline_write"):
+            records = [item.record for item in chunk]
+            embeddings = [item.embedding for item in chunk]
+            results = score_embeddings(records, embeddings, [item.error for item in chunk], self.models)
+            if self.index is not None:
+                index_results(self.index, results, embeddings)
+            writer.write_rows(results)
+        stats.add(items=len(chunk), busy=time.perf_counter() - start)
+
+    # ----------------------------
+    # Driver
+    # ----------------------------
+    def run(self, records, writer):
+        """Scores `records` and writes the results in input order through `writer` (a batch.ResultWriter)."""
+        paths = queue.Queue(maxsize=self.read_threads * 2)
+        decoded = queue.Queue(maxsize=self.prefetch)
+        embedded = queue.Queue(maxsize=self.chunk_size)
+        in_flight = threading.BoundedSemaphore(self.max_in_flight)
+
+        def countdown(n):
+            # Returns a callable that is true for the last of `n` threads to finish.
+            remaining = [n]
+            lock = threading.Lock()
+
+            def finished():
+                with lock:
+                    remaining[0] -= 1
+                    return remaining[0] == 0
+            return finished
+
+        read_finished = countdown(self.read_threads)
+        embed_finished = countdown(self.embed_threads)
+        threads = [threading.Thread(target=self._feed, args=(records, paths, in_flight), name="pipeline-feed",
+                                    daemon=True)]
+        threads += [threading.Thread(target=self._read, args=(paths, decoded, read_finished),
+                                     name=f"pipeline-read-{i}", daemon=True) for i in range(self.read_threads)]
+        threads += [threading.Thread(target=self._embed, args=(decoded, embedded, embed_finished),
+                                     name=f"pipeline-embed-{i}", daemon=True) for i in range(self.embed_threads)]
+
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        pending = {}  # seq -> item that finished ahead of an earlier one
+        next_seq = 0
+        chunk = []
+        stats = self.stats["write"]
+        while True:
+            item = _get(embedded, stats)
+            if item is _DONE:
+                break
+            pending[item.seq] = item
+            while next_seq in pending:
+                chunk.append(pending.pop(next_seq))
+                next_seq += 1
+                if len(chunk) >= self.chunk_size:
+                    self._write_chunk(chunk, writer)
+                    for _ in chunk:
+                        in_flight.release()
+                    chunk = []
+        if chunk:
+            self._write_chunk(chunk, writer)
+        for thread in threads:
+            thread.join()
+        self.wall_seconds = time.perf_counter() - start
+        if self._feed_error is not None:
+            raise self._feed_error
+        return self.report()
+
+    def report(self):
+        wall = self.wall_seconds
+        return {
+            "wall_seconds": wall,
+            "images_per_second": self.stats["write"].items / wall if wall else 0.0,
+            "stages": {name: stats.report(wall) for name, stats in self.stats.items()},
+        }
+
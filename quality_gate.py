@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Cheap image-quality and face-presence gate, run before the VGG-Face pass.
+
+The embedding model is called with enforce_detection=False, so tiny, blurry,
+dark or face-less photos still cost a full forward pass and produce meaningless
+labels. QualityGate checks a decoded image in a few milliseconds:
+
+  - resolution      shorter side of the original image
+  - sharpness       variance of the Laplacian of the downscaled grayscale copy
+  - exposure        mean brightness and the fraction of clipped pixels
+  - face            best Haar-cascade detection weight on the downscaled copy, or
+                    the confidence of a shared face_preprocessing.FacePreprocessor
+
+and returns a QualityReport; an unusable image is rejected with a short
+machine-readable reason ("too_small", "blurry", "too_dark", "too_bright",
+"overexposed", "no_face"). predict_all, batch.py and the service short-circuit
+rejected images before embedding.
+
+    python quality_gate.py photos/*.jpg
+"""
+
+import argparse
+import json
+import logging
+import os
+
+import cv2
+import numpy as np
+
+import instrumentation
+
+# Haar cascade used for the face check. opencv-python wheels ship it under
+# cv2.data.haarcascades; CVD_FACE_CASCADE overrides the path.
+FACE_CASCADE_PATH = os.environ.get("CVD_FACE_CASCADE") or os.path.join(
+    getattr(getattr(cv2, "data", None), "haarcascades", ""), "haarcascade_frontalface_default.xml")
+
+logger = logging.getLogger(__name__)
+
+
+def load_cascade(cascade_path=FACE_CASCADE_PATH):
+    """The Haar face cascade at `cascade_path`, or None when it is missing or unreadable."""
+    if not cascade_path or not os.path.exists(cascade_path):
+        return None
+    cascade = cv2.CascadeClassifier(cascade_path)
+    return None if cascade.empty() else cascade
+
+
+class ImageRejected(ValueError):
+    """Raised when the quality gate rejects an image; carries the QualityReport."""
+
+    def __init__(self, report):
+        super().__init__(f"image rejected: {report.reason}")
+        self.report = report
+        self.reason = report.reason
+
+
+class QualityReport:
+    """Outcome of the gate: `ok`, the first failing `reason` (or None) and the raw `metrics`."""
+
+    def __init__(self, reason, metrics):
+        self.reason = reason
+        self.metrics = metrics
+
+    @property
+    def ok(self):
+        return self.reason is None
+
+    def to_dict(self):
+        return {"ok": self.ok, "reason": self.reason, "metrics": self.metrics}
+
+
+class QualityGate:
+    """
+    Callable quality check for decoded BGR images. Every check works on a copy
+    downscaled to at most `work_size` pixels on its longer side. The face check
+    uses the Haar cascade at `cascade_path`, or with a `face_detector`
+    (face_preprocessing.FacePreprocessor) its detection, whose crop is then
+    cached for the embedder. With `require_face` and neither available the gate
+    raises ValueError rather than silently passing face-less images.
+    """
+
+    def __init__(self, min_side=96, min_sharpness=15.0, min_brightness=40.0, max_brightness=220.0,
+                 max_clipped=0.5, require_face=True, min_face_confidence=0.0, work_size=256,
+                 cascade_path=FACE_CASCADE_PATH, face_detector=None):
+        self.min_side = min_side
+        self.min_sharpness = min_sharpness
+        self.min_brightness = min_brightness
+        self.max_brightness = max_brightness
+        self.max_clipped = max_clipped
+        self.require_face = require_face
+        self.min_face_confidence = min_face_confidence
+        self.work_size = work_size
+        self.face_detector = face_detector
+        self._cascade = None
+        if require_face and face_detector is None:
+            self._cascade = load_cascade(cascade_path)
+            if self._cascade is None:
+                raise ValueError(f"No face detector for the quality gate: no Haar cascade at {cascade_path!r} "
+                                 "(set CVD_FACE_CASCADE or pass a face_detector)")
+        if not require_face:
+            logger.warning("Quality gate built without a face check; face-less images will not be rejected")
+
+    def _downscale(self, gray):
+        scale = self.work_size / max(gray.shape[:2])
+        if scale >= 1:
+            return gray
+        return cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    def face_confidence(self, gray):
+        """Weight of the strongest face detection on `gray`, -inf without one."""
+        min_face = max(24, min(gray.shape[:2]) // 8)
+        faces, _, weights = self._cascade.detectMultiScale3(
+            gray, scaleFactor=1.1, minNeighbors=4, minSize=(min_face, min_face), outputRejectLevels=True)
+        if len(faces) == 0:
+            return float("-inf")
+        return float(np.max(weights))
+
+    def check(self, img):
+        """Returns a QualityReport for a decoded BGR (or grayscale) image."""
+        metrics = {"width": int(img.shape[1]), "height": int(img.shape[0])}
+        if min(img.shape[:2]) < self.min_side:
+            return QualityReport("too_small", metrics)
+
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+        small = self._downscale(gray)
+        metrics["sharpness"] = float(cv2.Laplacian(small, cv2.CV_64F).var())
+        metrics["brightness"] = float(small.mean())
+        metrics["clipped"] = float(np.mean((small <= 5) | (small >= 250)))
+        if metrics["brightness"] < self.min_brightness:
+            return QualityReport("too_dark", metrics)
+        if metrics["brightness"] > self.max_brightness:
+            return QualityReport("too_bright", metrics)
+        if metrics["clipped"] > self.max_clipped:
+            return QualityReport("overexposed", metrics)
+        if metrics["sharpness"] < self.min_sharpness:
+            return QualityReport("blurry", metrics)
+
+        if self.require_face:
+            if self.face_detector is not None:
+                crop = self.face_detector(img)
+                confidence = crop.confidence if crop is not None and crop.detected else float("-inf")
+            else:
+                confidence = self.face_confidence(small)
+            metrics["face_confidence"] = confidence if np.isfinite(confidence) else None
+            if confidence < self.min_face_confidence:
+                return QualityReport("no_face", metrics)
+        return QualityReport(None, metrics)
+
+    def __call__(self, img):
+        with instrumentation.span("quality_gate"):
+            report = self.check(img)
+        if not report.ok:
+            instrumentation.count(f"images_rejected_{report.reason}_total")
+        return report
+
+    def enforce(self, img):
+        """Raises ImageRejected unless `img` passes; returns the report otherwise."""
+        report = self(img)
+        if not report.ok:
+            raise ImageRejected(report)
+        return report
+
+
+def build_gate(face_preprocessor=None, shares_embedder=True, **options):
+    """
+    QualityGate for a scoring entry point. When the embedder runs in this process
+    the face check goes through `face_preprocessor`, so its crop is reused for the
+    embedding; otherwise (worker processes, external embedder) the Haar cascade is
+    preferred and `face_preprocessor` is the fallback. Raises ValueError when
+    neither is available.
+    """
+    if face_preprocessor is not None and (shares_embedder or load_cascade() is None):
+        return QualityGate(face_detector=face_preprocessor, **options)
+    return QualityGate(**options)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report the quality-gate verdict for images.")
+    parser.add_argument("images", nargs="+")
+    parser.add_argument("--no-face-check", action="store_true", help="Skip the face-presence check")
+    args = parser.parse_args()
+
+    try:
+        gate = QualityGate(require_face=not args.no_face_check)
+    except ValueError as e:
+        parser.error(f"{e}; use --no-face-check to skip the face check")
+    for path in args.images:
+        img = cv2.imread(path)
+        report = gate(img) if img is not None else QualityReport("unreadable", {})
+        print(json.dumps(dict(image=path, **report.to_dict())))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+HTTP inference service.
+
+Keeps the classifiers and the VGG-Face model warm and serves:
+
+    GET  /health           readiness of the models and micro-batcher statistics
+    GET  /metrics          per-stage metrics in Prometheus text format (CVD_METRICS=1)
+    POST /predict/image    multipart upload ("image" file, optional patient fields
+                           as form fields) -> four image labels, image points and,
+                           if patient data is given, ASCVD and final risk
+    POST /predict/ascvd    JSON patient record, or a list of records, -> risk
+
+Patient fields and image_points are validated before any work is queued; a
+record that cannot be parsed, or carries no patient fields, is answered with
+400 (for a list, naming the first such record).
+
+Uploads are decoded in memory. Concurrent image requests are grouped by a
+MicroBatcher into batches of up to CVD_BATCH_MAX_SIZE requests, embedded
+together, with every head run once on the stacked embeddings. Only an embedder
+that embeds a batch in parallel (the worker pool, CVD_EMBEDDING_WORKERS > 0)
+gains from waiting for requests, so only then does the first request open a
+window of CVD_BATCH_WINDOW_MS milliseconds; the in-process embedder handles one
+image at a time, and a batch is just whatever requests queued up meanwhile.
+With CVD_QUALITY_GATE=1, unusable uploads (tiny, blurry, badly exposed, no
+face) are answered with 422 and the gate's reason before reaching the batcher.
+
+    gunicorn -w 1 -k gthread --threads 16 -b 0.0.0.0:8000 'service:create_app()'
+"""
+
+import math
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+
+import numpy as np
+from flask import Flask, jsonify, request
+
+import instrumentation
+import model_registry
+from ascvd import calculate_ascvd_risk, combine_with_image_points, risk_category
+from model_utils import classify_embeddings, decode_image, extract_embedding, image_risk_points
+from patient_data import PATIENT_FIELDS, patient_from_record
+
+BATCH_MAX_SIZE = int(os.environ.get("CVD_BATCH_MAX_SIZE", "8"))
+BATCH_WINDOW_MS = float(os.environ.get("CVD_BATCH_WINDOW_MS", "10"))
+REQUEST_TIMEOUT = float(os.environ.get("CVD_REQUEST_TIMEOUT", "60"))
+EMBEDDING_WORKERS = int(os.environ.get("CVD_EMBEDDING_WORKERS", "0"))
+MAX_UPLOAD_BYTES = int(os.environ.get("CVD_MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+QUALITY_GATE = os.environ.get("CVD_QUALITY_GATE", "0") == "1"
+
+
+class MicroBatcher:
+    """
+    Groups concurrent image requests into small batches on a background thread.
+    `submit(image)` returns a Future resolving to {head: label} (or raising).
+    The collection window only applies to embedders with `embed_many`; others
+    take the requests already queued without waiting.
+    """
+
+    def __init__(self, models, embedder=extract_embedding, max_batch=BATCH_MAX_SIZE, window_ms=BATCH_WINDOW_MS):
+        self.models = models
+        self.embedder = embedder
+        self.max_batch = max_batch
+        self.window = window_ms / 1000.0 if hasattr(embedder, "embed_many") else 0.0
+        self.batches = 0
+        self.items = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, image):
+        future = Future()
+        self._queue.put((image, future))
+        return future
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _embed(self, images):
+        if hasattr(self.embedder, "embed_many"):
+            return self.embedder.embed_many(images)
+        results = []
+        for image in images:
+            try:
+                embedding = self.embedder(image)
+                results.append((embedding, None if embedding is not None else "no embedding"))
+            except Exception as e:
+                results.append((None, str(e)))
+        return results
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            images = [image for image, _ in batch]
+            futures = [future for _, future in batch]
+            try:
+                with instrumentation.span("batch_embedding"):
+                    results = self._embed(images)
+                ok = [i for i, (embedding, _) in enumerate(results) if embedding is not None]
+                predictions = {}
+                if ok:
+                    matrix = np.vstack([np.asarray(results[i][0], dtype=np.float64) for i in ok])
+                    predictions, _ = classify_embeddings(matrix, self.models)
+                for row, i in enumerate(ok):
+                    futures[i].set_result({head: str(labels[row]) for head, labels in predictions.items()})
+                for i, (embedding, error) in enumerate(results):
+                    if embedding is None:
+                        futures[i].set_exception(ValueError(error))
+            except Exception as e:
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            self.batches += 1
+            self.items += len(batch)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": self.items / self.batches if self.batches else 0.0,
+            "queued": self._queue.qsize(),
+            "max_batch": self.max_batch,
+            "window_ms": self.window * 1000.0,
+        }
+
+
+def _parse_image_points(value):
+    """JSON `image_points` as a number (None if absent); raises ValueError otherwise."""
+    if value is None:
+        return None
+    try:
+        finite = not isinstance(value, bool) and isinstance(value, (int, float)) and math.isfinite(value)
+    except OverflowError:  # an integer too large for a float
+        finite = False
+    if not finite:
+        raise ValueError(f"invalid image_points: {value!r} (expected a finite number)")
+    return value
+
+
+def _parse_ascvd_record(record):
+    """(patient, image_points) of one /predict/ascvd record; raises ValueError for unusable records."""
+    if not isinstance(record, dict):
+        raise ValueError("expected a JSON object")
+    patient = patient_from_record(record)
+    if patient is None:
+        raise ValueError(f"no patient fields given (expected any of {list(PATIENT_FIELDS)})")
+    return patient, _parse_image_points(record.get("image_points"))
+
+
+def _risk_response(patient, image_points=None, ascvd_risk=None):
+    if ascvd_risk is None:
+        ascvd_risk = calculate_ascvd_risk(*patient)
+    response = {"ascvd_risk": ascvd_risk}
+    if image_points is not None:
+        final_risk = combine_with_image_points(ascvd_risk, image_points)
+        response["final_risk"] = final_risk
+        response["risk_category"] = risk_category(final_risk)
+    return response
+
+
+def create_app(embedder=None):
+    models = model_registry.warm_up(embedding=EMBEDDING_WORKERS == 0 and embedder is None)
+    if embedder is None and EMBEDDING_WORKERS > 0:
+        from workers import EmbeddingWorkerPool
+
+        embedder = EmbeddingWorkerPool(EMBEDDING_WORKERS)
+        embedder.warm_up()
+    batcher = MicroBatcher(models, embedder or model_registry.get_embedder())
+    gate = None
+    if QUALITY_GATE:
+        from quality_gate import build_gate
+
+        gate = build_gate(model_registry.get_face_preprocessor(), shares_embedder=embedder is None)
+
+    app = Flask(__name__)
+    app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_BYTES
+
+    @app.get("/health")
+    def health():
+        status = model_registry.health()
+        if embedder is not None:
+            status["ready"] = status["classifiers_loaded"]
+        status["batcher"] = batcher.stats()
+        return jsonify(status), 200 if status["ready"] else 503
+
+    @app.get("/metrics")
+    def metrics():
+        return instrumentation.prometheus_text(), 200, {"Content-Type": "text/plain; version=0.0.4"}
+
+    @app.post("/predict/image")
+    def predict_image():
+        upload = request.files.get("image")
+        if upload is None:
+            return jsonify({"error": "missing 'image' file field"}), 400
+        try:
+            patient = patient_from_record(request.form)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        image = decode_image(upload.read())
+        if image is None:
+            return jsonify({"error": "could not decode image"}), 400
+
+        start = time.perf_counter()
+        if gate is not None:
+            report = gate(image)
+            if not report.ok:
+                return jsonify({"error": "image rejected", "reason": report.reason, "metrics": report.metrics}), 422
+        try:
+            predictions = batcher.submit(image).result(timeout=REQUEST_TIMEOUT)
+        except TimeoutError:
+            return jsonify({"error": "timed out waiting for the embedding model"}), 503
+        except ValueError as e:
+            return jsonify({"error": f"could not score image: {e}"}), 422
+
+        response = {"predictions": predictions, "image_points": image_risk_points(predictions)}
+        if patient is not None:
+            response.update(_risk_response(patient, response["image_points"]))
+        response["latency_ms"] = (time.perf_counter() - start) * 1000.0
+        return jsonify(response)
+
+    @app.post("/predict/ascvd")
+    def predict_ascvd():
+        payload = request.get_json(silent=True)
+        if isinstance(payload, dict):
+            try:
+                patient, image_points = _parse_ascvd_record(payload)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            return jsonify(_risk_response(patient, image_points))
+        if isinstance(payload, list):
+            from ascvd_vectorized import calculate_ascvd_risk as calculate_ascvd_risk_many
+
+            # Every record must be scorable on its own, as for a single object.
+            parsed = []
+            for i, record in enumerate(payload):
+                try:
+                    parsed.append(_parse_ascvd_record(record))
+                except ValueError as e:
+                    return jsonify({"error": f"record {i}: {e}"}), 400
+            if not parsed:
+                return jsonify([])
+            columns = [np.array(column, dtype=object) for column in zip(*(patient for patient, _ in parsed))]
+            risks = calculate_ascvd_risk_many(*columns).tolist()
+            return jsonify([_risk_response(patient, image_points, risk)
+                            for (patient, image_points), risk in zip(parsed, risks)])
+        return jsonify({"error": "expected a JSON object or list of objects"}), 400
+
+    return app
+
+
+if __name__ == "__main__":
+    create_app().run(host="0.0.0.0", port=int(os.environ.get("PORT", "8000")), threaded=True)
@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+"""
+On-disk nearest-neighbour index of previously scored face embeddings.
+
+Reviewers can retrieve the k most similar earlier cases, and their labels, for
+a new photo. Vectors are L2-normalized and stored as rows of a memory-mapped
+matrix (vectors.bin, float32 or float16), so similarity is a dot product. The
+case metadata (image, head labels, ...) is kept one JSON line per row
+(cases.jsonl). Inserts append to both files, so the index can grow
+incrementally, e.g. from every batch run with --index-dir. Rows only count once
+flush() has recorded them (with the length of cases.jsonl) in index.json; case
+lines appended after the last flush, e.g. by a crashed run, are cut off on load.
+
+Search is exact for small indexes: a chunked matrix product over all rows.
+Once an index has been trained (`train`, spherical k-means in NumPy), larger
+indexes are searched approximately, IVF style: every row is assigned to its
+nearest of n_lists centroids (lists.i32), and a query only scores the rows of
+its n_probe nearest lists. Rows inserted after training are assigned on insert.
+
+    python similar_cases.py search --index-dir cases/ --image photo.jpg -k 5
+    python similar_cases.py train --index-dir cases/
+    python similar_cases.py bench --n 200000
+
+Like EmbeddingCache, an index directory is meant for a single writing process.
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+DEFAULT_DIM = 4096
+EXACT_LIMIT = 50000  # trained indexes at or below this size are still searched exactly
+DEFAULT_N_PROBE = 8
+_CHUNK_ROWS = 16384
+_META_FILE = "index.json"
+_VECTORS_FILE = "vectors.bin"
+_LISTS_FILE = "lists.i32"
+_CENTROIDS_FILE = "centroids.npy"
+_CASES_FILE = "cases.jsonl"
+
+
+def _normalize(vectors):
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1)
+
+
+def _top_k(scores, ids, k):
+    """Best `k` (score, id) pairs of one query, highest score first."""
+    if scores.size > k:
+        keep = np.argpartition(-scores, k - 1)[:k]
+        scores, ids = scores[keep], ids[keep]
+    order = np.argsort(-scores, kind="stable")
+    return scores[order], ids[order]
+
+
+def kmeans(vectors, n_clusters, iterations=10, seed=0):
+    """Spherical k-means on L2-normalized rows; returns normalized (n_clusters, dim) centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].astype(np.float32)
+    for _ in range(iterations):
+        assignment = assign_lists(vectors, centroids)
+        order = np.argsort(assignment, kind="stable")
+        present, starts = np.unique(assignment[order], return_index=True)
+        sums = np.zeros_like(centroids)
+        sums[present] = np.add.reduceat(vectors[order], starts, axis=0)
+        empty = ~sums.any(axis=1)
+        # Re-seed empty clusters with random rows so every list stays in use.
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+        centroids = _normalize(sums)
+    return centroids
+
+
+def assign_lists(vectors, centroids):
+    """Nearest centroid of every row, in chunks."""
+    out = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), _CHUNK_ROWS):
+        chunk = np.asarray(vectors[start:start + _CHUNK_ROWS], dtype=np.float32)
+        out[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+    return out
+
+
+class SimilarCaseIndex:
+    def __init__(self, directory, dim=DEFAULT_DIM, dtype="float32", model_name=None):
+        """`model_name` guards against mixing embeddings; None accepts the one an existing index was built with."""
+        self.directory = directory
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.model_name = model_name
+        self.count = 0
+        self.centroids = None
+
+        self._lock = threading.Lock()
+        self._capacity = 0
+        self._cases_bytes = 0  # length of cases.jsonl through row `count`
+        self._vectors = None
+        self._lists = None
+        self._cases = None  # loaded on first use
+        self._inverted = None  # (ids sorted by list, list start offsets, rows covered)
+
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    # ----------------------------
+    # Storage
+    # ----------------------------
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _load(self):
+        meta_path = self._path(_META_FILE)
+        if not os.path.exists(meta_path):
+            return
+        with open(meta_path) as f:
+            meta = json.load(f)
+        self.model_name = self.model_name or meta["model_name"]
+        if meta["dim"] != self.dim or meta["model_name"] != self.model_name:
+            raise ValueError(f"{self.directory} holds {meta['model_name']} vectors of dim {meta['dim']}, "
+                             f"not {self.model_name} of dim {self.dim}")
+        self.dtype = np.dtype(meta["dtype"])
+        self.count = meta["count"]
+        self._capacity = meta["capacity"]
+        self._vectors = np.memmap(self._path(_VECTORS_FILE), dtype=self.dtype, mode="r+",
+                                  shape=(self._capacity, self.dim))
+        self._lists = np.memmap(self._path(_LISTS_FILE), dtype=np.int32, mode="r+", shape=(self._capacity,))
+        if os.path.exists(self._path(_CENTROIDS_FILE)):
+            self.centroids = np.load(self._path(_CENTROIDS_FILE))
+        self._reconcile_cases(meta["cases_bytes"])
+
+    def _reconcile_cases(self, cases_bytes):
+        """Cuts cases.jsonl back to the `count` rows recorded in index.json."""
+        path = self._path(_CASES_FILE)
+        if not os.path.exists(path):
+            open(path, "wb").close()
+        if os.path.getsize(path) < cases_bytes:
+            raise ValueError(f"{path} is shorter than recorded in {_META_FILE}")
+        if os.path.getsize(path) > cases_bytes:
+            with open(path, "r+b") as f:
+                f.truncate(cases_bytes)
+        self._cases_bytes = cases_bytes
+
+    def _remap(self, name, dtype, shape, old):
+        path = self._path(name)
+        if old is None:
+            return np.memmap(path, dtype=dtype, mode="w+", shape=shape)
+        # Extend the backing file before remapping it with the larger shape.
+        old.flush()
+        with open(path, "r+b") as f:
+            f.truncate(int(np.prod(shape)) * np.dtype(dtype).itemsize)
+        return np.memmap(path, dtype=dtype, mode="r+", shape=shape)
+
+    def _grow(self, needed):
+        capacity = max(1024, self._capacity)
+        while capacity < needed:
+            capacity *= 2
+        self._vectors = self._remap(_VECTORS_FILE, self.dtype, (capacity, self.dim), self._vectors)
+        self._lists = self._remap(_LISTS_FILE, np.int32, (capacity,), self._lists)
+        self._capacity = capacity
+
+    def flush(self):
+        with self._lock:
+            if self._vectors is None:
+                return
+            self._vectors.flush()
+            self._lists.flush()
+            meta = {"model_name": self.model_name or "VGG-Face", "dim": self.dim, "dtype": self.dtype.name,
+                    "count": self.count, "capacity": self._capacity, "cases_bytes": self._cases_bytes,
+                    "n_lists": 0 if self.centroids is None else len(self.centroids)}
+            tmp_path = self._path(_META_FILE + ".tmp")
+            with open(tmp_path, "w") as f:
+                json.dump(meta, f)
+            os.replace(tmp_path, self._path(_META_FILE))
+
+    close = flush
+
+    # ----------------------------
+    # Insert and train
+    # ----------------------------
+    def __len__(self):
+        return self.count
+
+    def add(self, embeddings, cases=None):
+        """Appends embeddings (one per row) with their case metadata dicts; returns the new ids."""
+        vectors = _normalize(embeddings)
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected {self.dim}-dim embeddings, got {vectors.shape[1]}")
+        cases = cases if cases is not None else [{} for _ in range(len(vectors))]
+        if len(cases) != len(vectors):
+            raise ValueError(f"{len(vectors)} embeddings but {len(cases)} cases")
+        with self._lock:
+            start = self.count
+            if start + len(vectors) > self._capacity:
+                self._grow(start + len(vectors))
+            self._vectors[start:start + len(vectors)] = vectors
+            self._lists[start:start + len(vectors)] = (
+                assign_lists(vectors, self.centroids) if self.centroids is not None else -1)
+            lines = "".join(json.dumps(case) + "\n" for case in cases).encode()
+            with open(self._path(_CASES_FILE), "ab") as f:
+                f.write(lines)
+            self._cases_bytes += len(lines)
+            if self._cases is not None:
+                self._cases.extend(cases)
+            self.count += len(vectors)
+        return np.arange(start, start + len(vectors))
+
+    def train(self, n_lists=None, sample_per_list=40, iterations=10, seed=0):
+        """
+        Clusters a sample of `sample_per_list` rows per list into n_lists (default
+        ~sqrt(n)) lists and assigns every row to its nearest list.
+        """
+        if self.count == 0:
+            raise ValueError("Cannot train an empty index")
+        n_lists = min(self.count, n_lists or max(1, int(np.sqrt(self.count))))
+        rng = np.random.default_rng(seed)
+        rows = np.sort(rng.choice(self.count, min(sample_per_list * n_lists, self.count), replace=False))
+        centroids = kmeans(np.asarray(self._vectors[rows], dtype=np.float32), n_lists, iterations, seed)
+        with self._lock:
+            self._lists[:self.count] = assign_lists(self._vectors[:self.count], centroids)
+            self.centroids = centroids
+            self._inverted = None
+            np.save(self._path(_CENTROIDS_FILE), centroids)
+        self.flush()
+
+    # ----------------------------
+    # Search
+    # ----------------------------
+    def case(self, row):
+        if self._cases is None:
+            with open(self._path(_CASES_FILE)) as f:
+                self._cases = [json.loads(line) for line in f]
+        return self._cases[row]
+
+    def _search_exact(self, queries, k):
+        best = [(np.zeros(0, np.float32), np.zeros(0, np.int64)) for _ in queries]
+        for start in range(0, self.count, _CHUNK_ROWS):
+            chunk = np.asarray(self._vectors[start:min(start + _CHUNK_ROWS, self.count)], dtype=np.float32)
+            scores = queries @ chunk.T
+            ids = np.arange(start, start + len(chunk))
+            for q in range(len(queries)):
+                s, i = _top_k(scores[q], ids, k)
+                best[q] = _top_k(np.concatenate([best[q][0], s]), np.concatenate([best[q][1], i]), k)
+        return best
+
+    def _inverted_lists(self):
+        """Row ids grouped by list for the rows present when built; later inserts are scanned separately."""
+        if self._inverted is None or self._inverted[2] < self.count - max(1024, self._inverted[2] // 10):
+            lists = np.asarray(self._lists[:self.count])
+            order = np.argsort(lists, kind="stable")
+            starts = np.searchsorted(lists[order], np.arange(len(self.centroids) + 1))
+            self._inverted = (order, starts, self.count)
+        return self._inverted
+
+    def _search_ivf(self, queries, k, n_probe):
+        order, starts, covered = self._inverted_lists()
+        tail_lists = np.asarray(self._lists[covered:self.count])
+        probes = np.argsort(-(queries @ self.centroids.T), axis=1)[:, :n_probe]
+        results = []
+        for q, lists in enumerate(probes):
+            ids = [order[starts[c]:starts[c + 1]] for c in lists]
+            ids.append(covered + np.flatnonzero(np.isin(tail_lists, lists)))
+            ids = np.sort(np.concatenate(ids))
+            scores = np.asarray(self._vectors[ids], dtype=np.float32) @ queries[q]
+            results.append(_top_k(scores, ids, k))
+        return results
+
+    def search(self, query, k=5, n_probe=DEFAULT_N_PROBE, exact=None):
+        """
+        The k most similar cases for one embedding or a (n, dim) batch: one list per
+        query of {"id", "score" (cosine similarity), "case"} dicts, most similar first.
+        """
+        queries = _normalize(query)
+        if exact is None:
+            exact = self.centroids is None or self.count <= EXACT_LIMIT
+        if self.count == 0:
+            raw = [(np.zeros(0), np.zeros(0, np.int64)) for _ in queries]
+        elif exact:
+            raw = self._search_exact(queries, k)
+        else:
+            raw = self._search_ivf(queries, k, n_probe)
+        return [[{"id": int(i), "score": float(s), "case": self.case(int(i))} for s, i in zip(scores, ids)]
+                for scores, ids in raw]
+
+    def stats(self):
+        return {"count": self.count, "dim": self.dim, "dtype": self.dtype.name,
+                "n_lists": 0 if self.centroids is None else len(self.centroids),
+                "bytes": self.count * self.dim * self.dtype.itemsize}
+
+
+# ----------------------------
+# Benchmark
+# ----------------------------
+def _synthetic_embeddings(centers, n, rng):
+    """Vectors scattered around `centers`, loosely like face embeddings of people photographed several times."""
+    members = rng.integers(len(centers), size=n)
+    return centers[members] + 0.5 * rng.standard_normal((n, centers.shape[1])).astype(np.float32)
+
+
+def benchmark(n=100000, dim=DEFAULT_DIM, queries=100, k=10, n_lists=None, n_probe=DEFAULT_N_PROBE,
+              dtype="float32", batch=4096, seed=0):
+    """Build, insert, train and search throughput plus recall@k of IVF against exact search."""
+    rng = np.random.default_rng(seed)
+    report = {"n": n, "dim": dim, "dtype": dtype}
+    centers = rng.standard_normal((max(16, n // 20), dim)).astype(np.float32)
+    with tempfile.TemporaryDirectory() as directory:
+        index = SimilarCaseIndex(directory, dim=dim, dtype=dtype)
+        seconds = 0.0
+        for start in range(0, n, batch):
+            vectors = _synthetic_embeddings(centers, min(batch, n - start), rng)
+            t = time.perf_counter()
+            index.add(vectors, [{"case": start + i} for i in range(len(vectors))])
+            seconds += time.perf_counter() - t
+        index.flush()
+        report["insert_vectors_per_s"] = n / seconds
+
+        Q = _synthetic_embeddings(centers, queries, rng)
+        t = time.perf_counter()
+        exact = index.search(Q, k, exact=True)
+        report["exact_ms_per_query"] = (time.perf_counter() - t) * 1000 / queries
+
+        t = time.perf_counter()
+        index.train(n_lists)
+        report["train_s"] = time.perf_counter() - t
+        report["n_lists"] = len(index.centroids)
+
+        t = time.perf_counter()
+        approx = index.search(Q, k, n_probe=n_probe, exact=False)
+        report["ivf_ms_per_query"] = (time.perf_counter() - t) * 1000 / queries
+        report[f"ivf_recall_at_{k}"] = float(np.mean([
+            len({hit["id"] for hit in a} & {hit["id"] for hit in e}) / k for a, e in zip(approx, exact)]))
+
+        t = time.perf_counter()
+        index.add(_synthetic_embeddings(centers, batch, rng))
+        report["trained_insert_vectors_per_s"] = batch / (time.perf_counter() - t)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Similar-case index over stored face embeddings.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    search_parser = sub.add_parser("search", help="Most similar stored cases for a photo")
+    search_parser.add_argument("--index-dir", required=True)
+    search_parser.add_argument("--image", required=True)
+    search_parser.add_argument("-k", type=int, default=5)
+    search_parser.add_argument("--n-probe", type=int, default=DEFAULT_N_PROBE)
+    search_parser.add_argument("--exact", action="store_true", help="Scan every row even if the index is trained")
+    train_parser = sub.add_parser("train", help="Cluster the index for approximate search")
+    train_parser.add_argument("--index-dir", required=True)
+    train_parser.add_argument("--lists", type=int, default=None, help="Number of lists (default ~sqrt(n))")
+    stats_parser = sub.add_parser("stats", help="Print the index size")
+    stats_parser.add_argument("--index-dir", required=True)
+    bench_parser = sub.add_parser("bench", help="Benchmark insert, train and search on synthetic vectors")
+    bench_parser.add_argument("--n", type=int, default=100000)
+    bench_parser.add_argument("--dim", type=int, default=DEFAULT_DIM)
+    bench_parser.add_argument("--queries", type=int, default=100)
+    bench_parser.add_argument("--lists", type=int, default=None)
+    bench_parser.add_argument("--n-probe", type=int, default=DEFAULT_N_PROBE)
+    bench_parser.add_argument("--dtype", choices=["float32", "float16"], default="float32")
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        report = benchmark(args.n, args.dim, args.queries, n_lists=args.lists, n_probe=args.n_probe, dtype=args.dtype)
+        print(json.dumps(report, indent=2))
+        return
+
+    import model_registry
+
+    index = SimilarCaseIndex(args.index_dir, model_name=model_registry.embedding_model_id())
+    if args.command == "stats":
+        print(json.dumps(index.stats(), indent=2))
+    elif args.command == "train":
+        index.train(args.lists)
+        print(json.dumps(index.stats(), indent=2))
+    else:
+        embedding = model_registry.get_embedder()(args.image)
+        if embedding is None:
+            sys.exit(f"Could not embed {args.image}")
+        t = time.perf_counter()
+        hits = index.search(embedding, args.k, args.n_probe, exact=True if args.exact else None)[0]
+        print(json.dumps({"image": args.image, "search_ms": (time.perf_counter() - t) * 1000, "similar": hits},
+                         indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model_utils import HEADS  # noqa: E402
+
+DIM = 8
+
+
+@pytest.fixture
+def models():
+    """Small stand-ins for the four heads: {head: (classifier, scaler)} over DIM-dimensional embeddings."""
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.preprocessing import StandardScaler
+
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(64, DIM))
+    y = np.where(X[:, 0] > 0, "positive", "negative")
+    scaler = StandardScaler().fit(X)
+    classifier = RandomForestClassifier(n_estimators=4, random_state=0).fit(scaler.transform(X), y)
+    return {head: (classifier, scaler) for head in HEADS}
+
+
+class ListWriter:
+    """batch.ResultWriter stand-in that keeps the rows."""
+
+    def __init__(self):
+        self.rows = []
+
+    def write_rows(self, rows):
+        self.rows.extend(rows)
+
+
+@pytest.fixture
+def writer():
+    return ListWriter()
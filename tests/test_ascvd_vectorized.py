@@ -0,0 +1,49 @@
+import itertools
+
+import numpy as np
+
+import ascvd
+import ascvd_vectorized
+from patient_data import PATIENT_FIELDS
+
+GRID = {
+    "age": [None, 20, 39, 40, 44.9, 45, 50, 55, 60, 65, 70, 75, 79, 80],
+    "sex": [None, "male", "F", "other"],
+    "total_chol": [None, 159, 160, 200, 240, 280],
+    "hdl": [None, 39.9, 40, 50, 60],
+    "systolic_bp": [None, 119, 120, 130, 140, 160],
+    "bp_treatment": [None, True, False],
+    "smoker": [True, False],
+    "diabetic": [True, False],
+}
+
+
+def _same(expected, actual):
+    if expected is None:
+        return np.isnan(actual)
+    return expected == actual
+
+
+def test_matches_scalar_calculator_over_grid():
+    rows = list(itertools.product(*GRID.values()))
+    columns = [np.array(column, dtype=object) for column in zip(*rows)]
+    risks = ascvd_vectorized.calculate_ascvd_risk(*columns)
+    expected = [ascvd.calculate_ascvd_risk(*row) for row in rows]
+    mismatches = [(row, e, risk) for row, e, risk in zip(rows, expected, risks) if not _same(e, risk)]
+    assert mismatches == []
+
+
+def test_rcri_and_sts_adjustments_match():
+    base = (62, "female", 210, 45, 135, True, False, True)
+    for rcri, sts in itertools.product([None, 0, 1, 2.5, 150], [None, 0, 1.2, 7.5, 150]):
+        expected = ascvd.calculate_ascvd_risk(*base, rcri, sts)
+        actual = ascvd_vectorized.calculate_ascvd_risk(*base, rcri, sts)
+        assert _same(expected, float(np.asarray(actual).reshape(-1)[0]))
+
+
+def test_frame_and_boundary_parity():
+    frame = {field: [55, "male", 213, 50, 120, False, False, False, None, None][i:i + 1] * 3
+             for i, field in enumerate(PATIENT_FIELDS)}
+    expected = ascvd.calculate_ascvd_risk(55, "male", 213, 50, 120, False, False, False)
+    assert list(ascvd_vectorized.calculate_ascvd_risk_frame(frame)) == [expected] * 3
+    assert ascvd_vectorized.check_parity(samples=2000) == 0
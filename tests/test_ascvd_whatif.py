@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from ascvd import calculate_ascvd_risk
+from ascvd_whatif import evaluate_scenarios
+
+SYSTOLIC_BP = np.array([100.0, 115.0, 119.0, 120.0, 125.0, 130.0, 135.0, 140.0, 145.0, 155.0, 160.0, 165.0, 200.0,
+                        np.nan])
+
+
+def _panel(bp_treatment):
+    n = len(SYSTOLIC_BP)
+    return dict(age=np.full(n, 55.0), sex=np.array(["male"] * n, dtype=object), total_chol=np.full(n, 150.0),
+                hdl=np.full(n, 55.0), systolic_bp=SYSTOLIC_BP, bp_treatment=np.full(n, bp_treatment),
+                smoker=np.zeros(n), diabetic=np.zeros(n))
+
+
+@pytest.mark.parametrize("target", [110.0, 120.0, 130.0, 140.0, 160.0])
+@pytest.mark.parametrize("bp_treatment", [0.0, 1.0])
+def test_treat_bp_never_raises_risk(target, bp_treatment):
+    result = evaluate_scenarios(**_panel(bp_treatment), scenarios=["treat_bp"], bp_target=target)
+    delta = result["delta"]["treat_bp"]
+    assert np.all(delta <= 0)
+    assert np.all(delta[SYSTOLIC_BP < target] == 0)
+
+
+@pytest.mark.parametrize("target, systolic_bp", [(140.0, 145.0), (130.0, 135.0), (160.0, 165.0)])
+def test_treat_bp_leaves_patients_the_treated_table_would_score_higher(target, systolic_bp):
+    panel = _panel(0.0)
+    panel["systolic_bp"] = np.array([systolic_bp])
+    panel = {name: column[:1] for name, column in panel.items()}
+    result = evaluate_scenarios(**panel, scenarios=["treat_bp"], bp_target=target)
+    baseline = calculate_ascvd_risk(55, "male", 150.0, 55.0, systolic_bp, False, False, False)
+    assert result["baseline"][0] == baseline
+    assert result["risk"]["treat_bp"][0] == baseline
+
+
+def test_treat_bp_matches_the_scalar_calculator_at_the_default_target():
+    result = evaluate_scenarios(**_panel(0.0), scenarios=["treat_bp"], bp_target=120.0)
+    for i, sbp in enumerate(SYSTOLIC_BP[:-1]):
+        treated = sbp >= 120
+        expected = calculate_ascvd_risk(55, "male", 150.0, 55.0, 119.0 if treated else sbp, treated, False, False)
+        assert result["risk"]["treat_bp"][i] == expected
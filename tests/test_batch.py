@@ -0,0 +1,81 @@
+import builtins
+
+import cv2
+import numpy as np
+
+from batch import embed_images, iter_records, score_embeddings, score_records
+from conftest import DIM
+from embedding_cache import EmbeddingCache
+from quality_gate import QualityReport
+
+
+def test_bad_patient_field_is_a_row_error(models):
+    records = [
+        {"image": "a.jpg", "age": "55", "sex": "male", "total_chol": "213", "hdl": "50", "systolic_bp": "120",
+         "bp_treatment": "no", "smoker": "no", "diabetic": "no"},
+        {"image": "b.jpg", "age": "abc", "sex": "female"},
+        {"image": "c.jpg"},
+    ]
+    embeddings = [np.zeros(DIM), np.zeros(DIM), None]
+    results = score_embeddings(records, embeddings, [None, None, "no embedding"], models)
+
+    assert results[0]["error"] is None and results[0]["ascvd_risk"] is not None
+    assert results[1]["error"] == "invalid age: 'abc'"
+    assert "aging_spots" in results[1] and "ascvd_risk" not in results[1]
+    assert results[2]["error"] == "no embedding"
+
+
+def test_non_finite_patient_numbers_are_row_errors(models):
+    records = [{"image": "a.jpg", "age": "inf", "sex": "m"}, {"image": "b.jpg", "age": 10 ** 400},
+               {"image": "c.jpg", "hdl": "nan"}]
+    results = score_embeddings(records, [np.zeros(DIM)] * 3, [None] * 3, models)
+    assert [result["error"].split(":")[0] for result in results] == ["invalid age", "invalid age", "invalid hdl"]
+
+
+def test_malformed_manifest_rows_do_not_end_the_run(tmp_path, models, writer):
+    import cv2
+
+    from pipeline import Pipeline
+
+    image = tmp_path / "a.png"
+    cv2.imwrite(str(image), np.full((16, 16, 3), 10, dtype=np.uint8))
+    manifest = tmp_path / "manifest.jsonl"
+    manifest.write_text('{"image": "a.png"}\nnot json\n{"age": 50}\n[1]\n{"image": "a.png", "id": 5}\n')
+
+    def embed(img):
+        return np.zeros(DIM)
+
+    rows = list(score_records(iter_records(str(manifest)), models, chunk_size=2, embedder=embed))
+    assert [row["error"] for row in rows] == [
+        None, "line 2: invalid JSON (Expecting value: line 1 column 1 (char 0))",
+        "manifest row without an image path", "line 4: expected a JSON object", None]
+    assert rows[0]["aging_spots"] and rows[4]["aging_spots"]
+
+    Pipeline(models, embed, chunk_size=2, read_threads=2).run(iter_records(str(manifest)), writer)
+    assert [row["error"] for row in writer.rows] == [row["error"] for row in rows]
+
+
+def test_each_image_is_read_once_with_cache_and_gate(tmp_path, monkeypatch):
+    paths = []
+    for i in range(3):
+        paths.append(str(tmp_path / f"{i}.png"))
+        cv2.imwrite(paths[-1], np.full((16, 16, 3), 10 * i, dtype=np.uint8))
+    cache = EmbeddingCache(str(tmp_path / "cache"), dim=DIM)
+    opened = []
+    real_open = builtins.open
+
+    def counting_open(file, *args, **kwargs):
+        if file in paths:
+            opened.append(file)
+        return real_open(file, *args, **kwargs)
+
+    def embed(img):
+        assert isinstance(img, np.ndarray)
+        return np.full(DIM, float(img[0, 0, 0]))
+
+    monkeypatch.setattr(builtins, "open", counting_open)
+    embeddings, errors = embed_images(paths + [str(tmp_path / "missing.png")], embed, cache,
+                                      lambda img: QualityReport(None, {}))
+    assert opened == paths
+    assert [e[0] for e in embeddings[:3]] == [0.0, 10.0, 20.0] and errors[:3] == [None] * 3
+    assert embeddings[3] is None and errors[3]
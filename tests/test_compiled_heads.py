@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from compiled_heads import CompiledHeads, compile_heads
+from conftest import DIM
+from model_utils import HEADS, classify_embeddings
+
+
+def _linear_models(**scaler_options):
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.preprocessing import StandardScaler
+
+    rng = np.random.default_rng(1)
+    X = rng.normal(loc=3.0, scale=2.0, size=(200, DIM))
+    y = np.where(X[:, 0] + X[:, 1] > 6, "positive", "negative")
+    scaler = StandardScaler(**scaler_options).fit(X)
+    classifier = LogisticRegression().fit(scaler.transform(X), y)
+    return {head: (classifier, scaler) for head in HEADS}, X
+
+
+def _assert_parity(models, X):
+    reference, _ = classify_embeddings(X, models)
+    predicted = compile_heads(models).predict(X)
+    for head in HEADS:
+        np.testing.assert_array_equal(predicted[head], reference[head])
+
+
+def test_tree_heads_match_the_pickles(models):
+    X = np.random.default_rng(2).normal(size=(500, DIM))
+    _assert_parity(models, X)
+
+
+@pytest.mark.parametrize("options", [{}, {"with_mean": False}, {"with_std": False}])
+def test_linear_heads_match_the_pickles(options):
+    models, X = _linear_models(**options)
+    _assert_parity(models, X)
+
+
+def test_mixed_heads_survive_a_directory_round_trip(models, tmp_path):
+    linear, X = _linear_models(with_mean=False)
+    mixed = dict(models, xanthelasma=linear["xanthelasma"])
+    compile_heads(mixed).save_dir(str(tmp_path / "compiled"))
+    loaded = CompiledHeads.load_dir(str(tmp_path / "compiled"))
+    reference, _ = classify_embeddings(X, mixed)
+    predicted, _ = classify_embeddings(X, loaded)
+    for head in HEADS:
+        np.testing.assert_array_equal(predicted[head], reference[head])
@@ -0,0 +1,68 @@
+import os
+import threading
+
+import numpy as np
+
+from embedding_cache import EmbeddingCache
+
+DIM = 8
+
+
+def _vector(value):
+    return np.full(DIM, value, dtype=np.float32)
+
+
+def test_row_reused_after_flush_is_not_served_for_the_old_key(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), dim=DIM, max_entries=2)
+    cache.put("a", _vector(1))
+    cache.put("b", _vector(2))
+    cache.flush()
+    cache.put("c", _vector(3))  # evicts "a" and reuses its row; the index on disk still maps "a" there
+    cache._data.flush()
+    cache._keys.flush()
+
+    reopened = EmbeddingCache(str(tmp_path), dim=DIM, max_entries=2)
+    assert reopened.get("a") is None
+    np.testing.assert_array_equal(reopened.get("b"), _vector(2))
+
+
+def test_reduced_max_entries_shrinks_the_cache(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), dim=DIM, max_entries=100)
+    for i in range(100):
+        cache.put(str(i), _vector(i))
+    cache.flush()
+
+    smaller = EmbeddingCache(str(tmp_path), dim=DIM, max_entries=10)
+    assert len(smaller) == 10
+    assert os.path.getsize(tmp_path / "embeddings.f32") == 10 * DIM * 4
+    for i in range(90, 100):
+        np.testing.assert_array_equal(smaller.get(str(i)), _vector(i))
+    for i in range(100, 120):
+        smaller.put(str(i), _vector(i))
+    assert len(smaller) == 10 and smaller._capacity == 10
+    np.testing.assert_array_equal(smaller.get("119"), _vector(119))
+
+    smaller.flush()
+    reopened = EmbeddingCache(str(tmp_path), dim=DIM, max_entries=10)
+    np.testing.assert_array_equal(reopened.get("110"), _vector(110))
+
+
+def test_counters_are_exact_under_concurrent_lookups(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), dim=DIM, max_entries=4)
+    images = [bytes([i]) * 32 for i in range(8)]
+    for data in images[:4]:
+        cache.put(cache.key_for(data), _vector(1))
+
+    def work():
+        for _ in range(500):
+            for data in images:
+                cache.lookup(data)
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (4 * 500 * 4, 4 * 500 * 4)
+    assert stats["bytes_saved"] == 4 * 500 * 4 * 32
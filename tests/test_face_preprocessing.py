@@ -0,0 +1,23 @@
+import numpy as np
+
+from face_preprocessing import FacePreprocessor
+
+
+class CountingPreprocessor(FacePreprocessor):
+    def __init__(self):
+        super().__init__(working_size=64)
+        self.seen = []
+
+    def detect(self, img):
+        self.seen.append(int(img[0, 0, 0]))
+        return None, (0, 0, img.shape[1], img.shape[0]), float(img[0, 0, 0])
+
+
+def test_reused_buffer_is_detected_again():
+    preprocessor = CountingPreprocessor()
+    frame = np.full((128, 128, 3), 10, dtype=np.uint8)
+    assert preprocessor(frame).confidence == 10
+    assert preprocessor(frame).confidence == 10  # same content: served from the crop cache
+    frame[:] = 20  # e.g. capture.read() filling the same array with the next frame
+    assert preprocessor(frame).confidence == 20
+    assert preprocessor.seen == [10, 20]
@@ -0,0 +1,98 @@
+import threading
+
+import cv2
+import numpy as np
+import pytest
+
+from conftest import DIM
+from pipeline import Pipeline
+from quality_gate import QualityReport
+
+
+def _images(tmp_path, n):
+    paths = []
+    for i in range(n):
+        path = str(tmp_path / f"{i}.png")
+        cv2.imwrite(path, np.full((16, 16, 3), 10 * i, dtype=np.uint8))
+        paths.append(path)
+    return paths
+
+
+def _embed(img):
+    return np.full(DIM, float(img[0, 0, 0]))
+
+
+def _run(pipeline, records, writer):
+    # A stalled pipeline would block forever; run it where the test can give up on it.
+    thread = threading.Thread(target=pipeline.run, args=(records, writer), daemon=True)
+    thread.start()
+    thread.join(timeout=30)
+    assert not thread.is_alive(), "pipeline stalled"
+
+
+def test_results_in_input_order(tmp_path, models, writer):
+    paths = _images(tmp_path, 20)
+    pipeline = Pipeline(models, _embed, chunk_size=3, read_threads=4, prefetch=2)
+    _run(pipeline, [{"image": path} for path in paths] + [{"image": str(tmp_path / "missing.png")}], writer)
+    assert [row["image"] for row in writer.rows] == paths + [str(tmp_path / "missing.png")]
+    assert all(row["error"] is None for row in writer.rows[:-1])
+    assert writer.rows[-1]["error"]
+
+
+def test_raising_gate_becomes_error_row(tmp_path, models, writer):
+    paths = _images(tmp_path, 6)
+
+    def gate(img):
+        if img[0, 0, 0] == 30:
+            raise RuntimeError("detector crashed")
+        return QualityReport(None, {})
+
+    pipeline = Pipeline(models, _embed, chunk_size=2, read_threads=2, gate=gate)
+    _run(pipeline, [{"image": path} for path in paths], writer)
+    assert len(writer.rows) == 6
+    assert writer.rows[3]["error"] == "detector crashed"
+    assert all(row["error"] is None for i, row in enumerate(writer.rows) if i != 3)
+
+
+def test_raising_embedder_and_cache(tmp_path, models, writer):
+    paths = _images(tmp_path, 4)
+
+    class BrokenCache:
+        def lookup(self, data):
+            return "key", None
+
+        def put(self, key, embedding):
+            raise OSError("disk full")
+
+    def embed(img):
+        if img[0, 0, 0] == 10:
+            raise RuntimeError("model failure")
+        return _embed(img)
+
+    pipeline = Pipeline(models, embed, chunk_size=2, read_threads=2, embed_threads=2, cache=BrokenCache())
+    _run(pipeline, [{"image": path} for path in paths], writer)
+    assert [row["error"] for row in writer.rows] == [None, "model failure", None, None]
+    assert all("aging_spots" in row for i, row in enumerate(writer.rows) if i != 1)
+
+
+def test_pool_embedder_is_handed_encoded_bytes(tmp_path, models, writer):
+    paths = _images(tmp_path, 4)
+    received = []
+
+    class Pool:
+        def __call__(self, data):
+            received.append(data)
+            return _embed(cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR))
+
+        def embed_many(self, images):
+            return [(self(image), None) for image in images]
+
+    pipeline = Pipeline(models, Pool(), chunk_size=2, read_threads=2)
+    _run(pipeline, [{"image": path} for path in paths], writer)
+    assert all(row["error"] is None for row in writer.rows)
+    assert all(isinstance(data, bytes) for data in received) and len(received) == 4
+
+
+def test_max_in_flight_below_chunk_size_is_rejected(models):
+    with pytest.raises(ValueError, match="max_in_flight"):
+        Pipeline(models, _embed, chunk_size=8, max_in_flight=4)
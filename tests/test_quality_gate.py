@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from face_preprocessing import FaceCrop
+from quality_gate import QualityGate, build_gate
+
+
+def _photo():
+    rng = np.random.default_rng(0)
+    return rng.integers(60, 200, size=(240, 240, 3), dtype=np.uint8)
+
+
+def test_required_face_check_without_detector_raises(tmp_path):
+    with pytest.raises(ValueError, match="No face detector"):
+        QualityGate(cascade_path=str(tmp_path / "missing.xml"))
+    assert QualityGate(require_face=False, cascade_path=str(tmp_path / "missing.xml"))(_photo()).ok
+
+
+def test_face_detector_rejects_faceless_images():
+    gate = build_gate(lambda img: FaceCrop(None, (0, 0, 0, 0), 0.0), shares_embedder=True)
+    assert gate(_photo()).reason == "no_face"
+    gate = build_gate(lambda img: FaceCrop(None, (10, 10, 50, 50), 0.9), shares_embedder=True)
+    assert gate(_photo()).ok
+
+
+def test_cached_embeddings_do_not_bypass_the_gate(tmp_path, models, writer):
+    import cv2
+
+    from batch import embed_images
+    from embedding_cache import EmbeddingCache
+    from model_utils import predict_all
+    from pipeline import Pipeline
+    from quality_gate import ImageRejected
+
+    path = str(tmp_path / "junk.png")
+    cv2.imwrite(path, np.zeros((16, 16, 3), dtype=np.uint8))
+    cache = EmbeddingCache(str(tmp_path / "cache"), dim=8)
+    cache.put(cache.key_for(path), np.ones(8))  # cached by an earlier, ungated run
+
+    gate = QualityGate(require_face=False)
+    def embed(img):
+        raise AssertionError("rejected image was embedded")
+
+    embeddings, errors = embed_images([path], embed, cache, gate)
+    assert embeddings == [None] and errors == ["rejected: too_small"]
+
+    Pipeline(models, embed, chunk_size=1, read_threads=1, cache=cache, gate=gate).run([{"image": path}], writer)
+    assert writer.rows[0]["error"] == "rejected: too_small"
+
+    with pytest.raises(ImageRejected):
+        predict_all(path, models, embedder=embed, cache=cache, gate=gate)
+    assert predict_all(path, models, embedder=embed, cache=cache)[0]["aging_spots"] is not None
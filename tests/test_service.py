@@ -0,0 +1,67 @@
+import io
+
+import cv2
+import numpy as np
+import pytest
+
+from conftest import DIM
+
+PATIENT = {"age": 55, "sex": "m", "total_chol": 200, "hdl": 50, "systolic_bp": 130, "bp_treatment": 0,
+           "smoker": 1, "diabetic": 0}
+
+
+@pytest.fixture
+def client(models, monkeypatch):
+    import model_registry
+    import service
+
+    monkeypatch.setattr(model_registry, "warm_up", lambda embedding=True: models)
+    return service.create_app(embedder=lambda img: np.zeros(DIM)).test_client()
+
+
+@pytest.mark.parametrize("body", [
+    {"age": "inf", "sex": "m"},
+    {"age": 10 ** 400, "sex": "m"},
+    '{"age": NaN, "sex": "m"}',
+    '{"age": 50, "sex": "m", "image_points": NaN}',
+    '{"age": 50, "sex": "m", "image_points": Infinity}',
+    {"age": 50, "sex": "m", "image_points": 10 ** 400},
+    {"age": 50, "sex": "m", "image_points": "2"},
+    {},
+    [PATIENT, {}],
+])
+def test_invalid_ascvd_records_are_400(client, body):
+    if isinstance(body, str):
+        response = client.post("/predict/ascvd", data=body, content_type="application/json")
+    else:
+        response = client.post("/predict/ascvd", json=body)
+    assert response.status_code == 400
+    assert response.get_json()["error"]
+
+
+def test_valid_ascvd_records(client):
+    single = client.post("/predict/ascvd", json=dict(PATIENT, image_points=2)).get_json()
+    assert single["final_risk"] >= single["ascvd_risk"]
+    many = client.post("/predict/ascvd", json=[dict(PATIENT, image_points=2), PATIENT]).get_json()
+    assert many[0] == single and many[1]["ascvd_risk"] == single["ascvd_risk"]
+
+
+def test_image_with_bad_patient_field_is_400(client):
+    _, png = cv2.imencode(".png", np.full((64, 64, 3), 100, dtype=np.uint8))
+    for age in ("abc", "inf", "1e400"):
+        response = client.post("/predict/image", data={"image": (io.BytesIO(png.tobytes()), "a.png"), "age": age})
+        assert response.status_code == 400, age
+
+
+def test_batcher_waits_only_for_embedders_that_batch(models):
+    from service import MicroBatcher
+
+    class Pool:
+        def embed_many(self, images):
+            return [(np.zeros(DIM), None) for _ in images]
+
+    assert MicroBatcher(models, lambda img: np.zeros(DIM), window_ms=500).window == 0
+    batcher = MicroBatcher(models, Pool(), window_ms=50)
+    assert batcher.window == 0.05
+    futures = [batcher.submit(None) for _ in range(3)]
+    assert all(f.result(timeout=5)["aging_spots"] in ("negative", "positive") for f in futures)
@@ -0,0 +1,27 @@
+
+import numpy as np
+
+from similar_cases import SimilarCaseIndex
+
+
+def _vectors(n, seed):
+    return np.random.default_rng(seed).normal(size=(n, 16))
+
+
+def test_unflushed_cases_are_dropped_on_reopen(tmp_path):
+    index = SimilarCaseIndex(str(tmp_path), dim=16)
+    index.add(_vectors(3, 0), [{"case": i} for i in range(3)])
+    index.flush()
+    index.add(_vectors(2, 1), [{"case": "lost"}, {"case": "lost"}])  # crash before flush
+
+    reopened = SimilarCaseIndex(str(tmp_path), dim=16)
+    assert len(reopened) == 3
+    ids = reopened.add(_vectors(1, 2), [{"case": 3}])
+    assert list(ids) == [3]
+    assert [reopened.case(i)["case"] for i in range(4)] == [0, 1, 2, 3]
+    reopened.flush()
+
+    again = SimilarCaseIndex(str(tmp_path), dim=16)
+    hit = again.search(_vectors(1, 2)[0], k=1)[0][0]
+    assert hit["id"] == 3 and hit["case"] == {"case": 3}
+
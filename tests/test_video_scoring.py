@@ -0,0 +1,41 @@
+import cv2
+import numpy as np
+import pytest
+
+from video_scoring import open_frame_sequence, open_video, sample_frames
+
+
+def _counting(frames, decoded):
+    for frame in frames:
+        def decode(frame=frame):
+            decoded.append(1)
+            return frame()
+        yield decode
+
+
+def test_only_one_frame_per_slot_is_decoded(tmp_path):
+    path = str(tmp_path / "clip.avi")
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 10, (64, 48))
+    if not writer.isOpened():
+        pytest.skip("no video encoder available")
+    for i in range(40):
+        writer.write(np.full((48, 64, 3), 5 * i, dtype=np.uint8))
+    writer.release()
+
+    frames, count = open_video(path)
+    decoded = []
+    selected, read = sample_frames(_counting(frames, decoded), count, budget=4)
+    assert [index for index, _ in selected] == [0, 10, 20, 30]
+    assert len(decoded) == 4 and read == 31
+    assert abs(int(selected[1][1][0, 0, 0]) - 50) <= 2
+
+
+def test_frame_sequence_and_budget(tmp_path):
+    for i in range(6):
+        cv2.imwrite(str(tmp_path / f"{i:02d}.png"), np.full((16, 16, 3), 40 * i, dtype=np.uint8))
+    (tmp_path / "06.png").write_bytes(b"not an image")
+    frames, count = open_frame_sequence(str(tmp_path))
+    selected, _ = sample_frames(frames, count, budget=7)
+    assert [index for index, _ in selected] == [0, 1, 2, 3, 4, 5]
+    with pytest.raises(ValueError):
+        sample_frames([], budget=0)
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Scoring of short video clips (or frame sequences) instead of single photos.
+
+Frames are sampled under a fixed budget: the clip is split into `budget` equal
+time slots and, per slot, the first frame that differs enough from the last
+selected frame (mean absolute difference of 32x32 grayscale thumbnails) is
+kept, so near-duplicate frames are skipped without running the embedding
+model. Frames of a slot that is already taken are only grabbed, not decoded.
+Only the selected frames are embedded; the four heads run once on the
+stacked embeddings and their per-frame labels are aggregated by majority vote,
+with the vote share reported as the confidence. With the registry's embedder,
+each frame goes through the shared face preprocessing (downscale, detect once).
+
+    python video_scoring.py --video clip.mp4 --budget 12
+    python video_scoring.py --frames frames_dir/
+"""
+
+import argparse
+import json
+import os
+
+import cv2
+import numpy as np
+
+import instrumentation
+import model_registry
+from model_utils import HEADS, classify_embeddings, image_risk_points
+
+FRAME_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+THUMB_SIZE = 32
+
+
+# ----------------------------
+# Frame sources
+# ----------------------------
+# A frame source yields one entry per frame: the frame itself, or a callable that
+# decodes it on demand (None if it cannot be decoded), so that frames the sampler
+# skips are never decoded. A callable is only valid until the next frame is read.
+def open_video(path):
+    """Returns (lazily decoded frames, frame count or None) for a video file."""
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise ValueError(f"Could not open video: {path}")
+    count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT)) or None
+
+    def retrieve():
+        ok, frame = capture.retrieve()
+        return frame if ok else None
+
+    def frames():
+        try:
+            while capture.grab():
+                yield retrieve
+        finally:
+            capture.release()
+
+    return frames(), count
+
+
+def open_frame_sequence(directory):
+    """Returns (lazily read frames, frame count) for a directory of still frames, in name order."""
+    paths = [os.path.join(directory, name) for name in sorted(os.listdir(directory))
+             if name.lower().endswith(FRAME_EXTENSIONS)]
+
+    def frames():
+        for path in paths:
+            yield lambda path=path: cv2.imread(path)
+
+    return frames(), len(paths)
+
+
+# ----------------------------
+# Sampling
+# ----------------------------
+def _thumbnail(frame):
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    return cv2.resize(gray, (THUMB_SIZE, THUMB_SIZE), interpolation=cv2.INTER_AREA).astype(np.float32)
+
+
+def sample_frames(frames, frame_count=None, budget=12, min_difference=4.0):
+    """
+    Selects at most `budget` frames. With a known frame count the clip is split
+    into `budget` slots and at most one frame is taken per slot; otherwise frames
+    are taken in order until the budget is spent. A frame is skipped when its
+    thumbnail differs from the last selected one by less than `min_difference`
+    grey levels on average. Frames of taken slots are not decoded. Returns
+    ([(frame index, frame)], frames read).
+    """
+    if budget < 1:
+        raise ValueError(f"budget must be at least 1, got {budget}")
+    selected = []
+    last_thumb = None
+    slot_taken = set()
+    read = 0
+    for index, frame in enumerate(frames):
+        read += 1
+        slot = index * budget // frame_count if frame_count else None
+        if slot is not None and slot in slot_taken:
+            continue
+        if callable(frame):
+            frame = frame()
+            if frame is None:
+                continue
+        thumb = _thumbnail(frame)
+        if last_thumb is not None and float(np.mean(np.abs(thumb - last_thumb))) < min_difference:
+            continue
+        selected.append((index, frame))
+        last_thumb = thumb
+        if slot is not None:
+            slot_taken.add(slot)
+        if len(selected) >= budget:
+            break
+    return selected, read
+
+
+# ----------------------------
+# Aggregation
+# ----------------------------
+def aggregate_labels(labels):
+    """Majority label over frames and its vote share, e.g. ("positive", 0.75, {"positive": 3, ...})."""
+    values, counts = np.unique(np.asarray(labels).astype(str), return_counts=True)
+    votes = {str(value): int(count) for value, count in zip(values, counts)}
+    best = int(np.argmax(counts))
+    return str(values[best]), float(counts[best] / counts.sum()), votes
+
+
+def score_frames(frames, frame_count=None, models=None, embedder=None, budget=12, min_difference=4.0):
+    """Samples, embeds and classifies frames; returns the aggregated per-head result."""
+    models = models if models is not None else model_registry.get_models()
+    embedder = embedder or model_registry.get_embedder()
+
+    with instrumentation.span("frame_sampling"):
+        selected, read = sample_frames(frames, frame_count, budget, min_difference)
+
+    embeddings = []
+    used = []
+    for index, frame in selected:
+        with instrumentation.span("embedding"):
+            embedding = embedder(frame)
+        if embedding is not None:
+            embeddings.append(np.asarray(embedding, dtype=np.float64))
+            used.append(index)
+
+    result = {"frames_read": read, "frames_selected": len(selected), "frames_embedded": len(used), "frame_indices": used}
+    if not embeddings:
+        result["heads"] = {head: None for head in HEADS}
+        return result
+
+    predictions, _ = classify_embeddings(np.vstack(embeddings), models)
+    heads = {}
+    for head in predictions:
+        label, confidence, votes = aggregate_labels(predictions[head])
+        heads[head] = {"label": label, "confidence": confidence, "votes": votes}
+    result["heads"] = heads
+    result["image_points"] = image_risk_points({head: entry["label"] for head, entry in heads.items()})
+    return result
+
+
+def score_video(path, **kwargs):
+    frames, count = open_frame_sequence(path) if os.path.isdir(path) else open_video(path)
+    return score_frames(frames, count, **kwargs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score a short video clip or frame sequence.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--video", help="Video file (anything OpenCV can decode)")
+    source.add_argument("--frames", help="Directory of still frames, in name order")
+    parser.add_argument("--budget", type=int, default=12, help="Maximum number of frames to embed")
+    parser.add_argument("--min-difference", type=float, default=4.0,
+                        help="Mean grey-level difference below which a frame counts as a near-duplicate")
+    args = parser.parse_args()
+    if args.budget < 1:
+        parser.error("--budget must be at least 1")
+
+    result = score_video(args.video or args.frames, budget=args.budget, min_difference=args.min_difference)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Multi-process embedding workers.
+
+Each worker process loads its own VGG-Face model once (with its own TensorFlow
+intra/inter-op thread budget, so N workers do not oversubscribe the host) and
+then pulls image jobs off the pool's shared queue. An EmbeddingWorkerPool is a
+drop-in embedder: `pool(image)` has the same signature as
+model_utils.extract_embedding and `pool.embed_many(images)` fans a whole chunk
+out across the workers.
+
+    python workers.py --images photos/ --max-workers 8   # throughput scaling report
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+# Per-process state of a worker, set up once by _init_worker.
+_worker_embedder = None
+
+
+def _configure_threads(intra_op_threads, inter_op_threads):
+    # The environment variables must be set before TensorFlow is first imported.
+    os.environ["TF_NUM_INTRAOP_THREADS"] = str(intra_op_threads)
+    os.environ["TF_NUM_INTEROP_THREADS"] = str(inter_op_threads)
+    os.environ["OMP_NUM_THREADS"] = str(intra_op_threads)
+    try:
+        import tensorflow as tf
+    except ImportError:
+        return
+    tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+
+
+def _init_worker(intra_op_threads, inter_op_threads, embedder):
+    global _worker_embedder
+    _configure_threads(intra_op_threads, inter_op_threads)
+    if embedder is None:
+        import model_registry
+
+        # The configured backend (CVD_EMBEDDING_BACKEND is inherited from the parent),
+        # held to this worker's thread budget like TensorFlow above.
+        embedder = model_registry.get_embedder(threads=intra_op_threads)
+    _worker_embedder = embedder
+
+
+def _embed_job(image):
+    try:
+        if isinstance(image, (bytes, bytearray)):
+            from model_utils import decode_image
+
+            image = decode_image(image)
+            if image is None:
+                return None, "could not read image"
+        embedding = _worker_embedder(image)
+    except Exception as e:  # reported back to the caller, the worker keeps running
+        return None, str(e)
+    if embedding is None:
+        return None, "no embedding"
+    return np.asarray(embedding, dtype=np.float32), None
+
+
+def _warm_job(_):
+    return os.getpid()
+
+
+class EmbeddingWorkerPool:
+    """
+    Pool of N embedding processes. `embedder` must be a picklable module-level
+    function; by default each worker uses model_registry.get_embedder().
+    """
+
+    def __init__(self, n_workers=None, intra_op_threads=1, inter_op_threads=1, embedder=None):
+        self.n_workers = n_workers or os.cpu_count() or 1
+        # TensorFlow is not fork-safe, so workers always start from a fresh interpreter.
+        context = multiprocessing.get_context("spawn")
+        self._pool = context.Pool(
+            self.n_workers,
+            initializer=_init_worker,
+            initargs=(intra_op_threads, inter_op_threads, embedder),
+        )
+
+    def warm_up(self):
+        """Blocks until every worker has finished loading its model."""
+        self._pool.map(_warm_job, range(self.n_workers), chunksize=1)
+
+    def __call__(self, image):
+        embedding, error = self._pool.apply(_embed_job, (image,))
+        if error is not None and error != "no embedding":
+            raise RuntimeError(error)
+        return embedding
+
+    embed = __call__
+
+    def embed_many(self, images, chunksize=1):
+        """Returns [(embedding or None, error or None)] in the order of `images`."""
+        return self._pool.map(_embed_job, list(images), chunksize=chunksize)
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# ----------------------------
+# Throughput scaling report
+# ----------------------------
+def measure_scaling(images, worker_counts, intra_op_threads=1, inter_op_threads=1, embedder=None):
+    """Times embed_many over `images` for each worker count; returns one row per count."""
+    rows = []
+    for n in worker_counts:
+        with EmbeddingWorkerPool(n, intra_op_threads, inter_op_threads, embedder) as pool:
+            pool.warm_up()
+            start = time.perf_counter()
+            results = pool.embed_many(images)
+            seconds = time.perf_counter() - start
+        rows.append({
+            "workers": n,
+            "images": len(images),
+            "failed": sum(1 for embedding, _ in results if embedding is None),
+            "seconds": seconds,
+            "images_per_second": len(images) / seconds if seconds > 0 else float("inf"),
+        })
+    base = rows[0]["images_per_second"] if rows else 0
+    for row in rows:
+        row["speedup"] = row["images_per_second"] / base if base else 0.0
+    return rows
+
+
+def _worker_counts(max_workers):
+    counts = []
+    n = 1
+    while n < max_workers:
+        counts.append(n)
+        n *= 2
+    counts.append(max_workers)
+    return counts
+
+
+def main():
+    from batch import MANIFEST_ERROR, iter_records
+
+    parser = argparse.ArgumentParser(description="Embedding throughput scaling from 1 to N worker processes.")
+    parser.add_argument("--images", required=True, help="Image directory or .csv/.jsonl manifest")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--intra-op-threads", type=int, default=1)
+    parser.add_argument("--inter-op-threads", type=int, default=1)
+    args = parser.parse_args()
+
+    images = [record["image"] for record in iter_records(args.images) if MANIFEST_ERROR not in record]
+    for row in measure_scaling(images, _worker_counts(args.max_workers),
+                               args.intra_op_threads, args.inter_op_threads):
+        print(json.dumps(row))
+
+
+if __name__ == "__main__":
+    main()